@@ -0,0 +1,178 @@
+"""
+Drive pyelfs through the custom transfer protocol against synthetic LFS workloads.
+
+    python benchmarks/run.py --agent sftp --workload tiny --objects 2000 --latency 0.02
+    python benchmarks/run.py --agent file --workload large --large-count 4 --large-size 268435456
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+
+from paramiko import RSAKey
+
+from sftp_server import LocalSftpServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_objects(directory, count, size):
+    objects = []
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        content = i.to_bytes(8, "big") * (size // 8) + b"\0" * (size % 8)
+        oid = hashlib.sha256(content).hexdigest()
+        path = os.path.join(directory, oid)
+        with open(path, "wb") as f:
+            f.write(content)
+        objects.append((oid, size, path))
+    return objects
+
+
+def make_large_objects(directory, count, size):
+    objects = []
+    os.makedirs(directory, exist_ok=True)
+    block = os.urandom(1 << 20)
+    for i in range(count):
+        sha = hashlib.sha256()
+        path = os.path.join(directory, f"large-{i}")
+        with open(path, "wb") as f:
+            remaining = size
+            while remaining > 0:
+                chunk = i.to_bytes(8, "big") + block[8:min(len(block), remaining)]
+                f.write(chunk)
+                sha.update(chunk)
+                remaining -= len(chunk)
+        oid = sha.hexdigest()
+        os.rename(path, os.path.join(directory, oid))
+        objects.append((oid, size, os.path.join(directory, oid)))
+    return objects
+
+
+def transfer(agent_args, operation, objects, concurrency):
+    process = subprocess.Popen([sys.executable, "-m", "pyelfs"] + agent_args,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=ROOT,
+                               universal_newlines=True, bufsize=1)
+    started_at = time.monotonic()
+    process.stdin.write(json.dumps({"event": "init", "operation": operation, "remote": "origin",
+                                    "concurrent": True, "concurrenttransfers": concurrency}) + "\n")
+    process.stdout.readline()
+
+    def send():
+        # Like git-lfs, keep sending requests while responses are read, since the agent applies backpressure.
+        for oid, size, path in objects:
+            request = {"event": operation, "oid": oid, "size": size, "action": None}
+            if operation == "upload":
+                request["path"] = path
+            process.stdin.write(json.dumps(request) + "\n")
+        process.stdin.flush()
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    pending = set(oid for oid, _, _ in objects)
+    errors = 0
+    while pending:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError(f"pyelfs exited with {len(pending)} objects pending.")
+        event = json.loads(line)
+        if event.get("event") == "complete":
+            pending.discard(event["oid"])
+            errors += "error" in event
+    elapsed = time.monotonic() - started_at
+    sender.join()
+    process.stdin.write(json.dumps({"event": "terminate"}) + "\n")
+    process.stdin.close()
+    process.wait()
+    return elapsed, errors
+
+
+def report(name, objects, elapsed, errors, server=None):
+    total = sum(size for _, size, _ in objects)
+    result = {
+        "workload": name,
+        "objects": len(objects),
+        "bytes": total,
+        "seconds": round(elapsed, 3),
+        "objects_per_second": round(len(objects) / elapsed, 1),
+        "mb_per_second": round(total / elapsed / 1e6, 2),
+        "errors": errors,
+    }
+    if server is not None:
+        result["handshakes"] = server.counters["handshakes"]
+        result["connections"] = server.counters["connections"]
+        server.counters["handshakes"] = server.counters["connections"] = 0
+    print(json.dumps(result), flush=True)
+    return result
+
+
+def main():
+    p = ArgumentParser("benchmarks/run.py")
+    p.add_argument("--agent", choices=["sftp", "file"], default="sftp")
+    p.add_argument("--workload", choices=["tiny", "large", "repush", "all"], default="all")
+    p.add_argument("--objects", type=int, default=50000, help="number of tiny objects.")
+    p.add_argument("--tiny-size", type=int, default=1024)
+    p.add_argument("--large-count", type=int, default=100)
+    p.add_argument("--large-size", type=int, default=1 << 30)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--latency", type=float, default=0.0, help="one-way latency in seconds (sftp only).")
+    p.add_argument("--bandwidth", type=float, help="bytes per second from the server (sftp only).")
+    p.add_argument("--work-dir", help="defaults to /dev/shm when it exists.")
+    p.add_argument("agent_args", nargs="*", help="extra arguments for the agent, after '--'.")
+    a = p.parse_args()
+
+    base = a.work_dir or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+    work = tempfile.mkdtemp(prefix="pyelfs-bench-", dir=base)
+    server = None
+    try:
+        temp = os.path.join(work, "temp")
+        os.mkdir(temp)
+        if a.agent == "sftp":
+            remote = os.path.join(work, "remote")
+            os.mkdir(remote)
+            key = os.path.join(work, "id_rsa")
+            RSAKey.generate(2048).write_private_key_file(key)
+            server = LocalSftpServer(remote, a.latency, a.bandwidth)
+            agent_args = ["sftp", "--hostname", "127.0.0.1", "--port", str(server.port),
+                          "--rsa-key", key, "--lfs-storage-remote", "/lfs", "--temp", temp]
+        else:
+            storage = os.path.join(work, "storage")
+            os.mkdir(storage)
+            agent_args = ["file", "--lfs-storage-local", storage, "--temp", temp]
+        agent_args += a.agent_args
+
+        workloads = ["tiny", "repush", "large"] if a.workload == "all" else [a.workload]
+        tiny = None
+        for workload in workloads:
+            if workload in ("tiny", "repush") and tiny is None:
+                tiny = make_objects(os.path.join(work, "tiny"), a.objects, a.tiny_size)
+                if workload == "repush":
+                    transfer(agent_args, "upload", tiny, a.concurrency)
+                    if server is not None:
+                        server.counters["handshakes"] = server.counters["connections"] = 0
+            if workload == "tiny":
+                report("tiny upload", tiny, *transfer(agent_args, "upload", tiny, a.concurrency), server)
+                report("tiny download", tiny, *transfer(agent_args, "download", tiny, a.concurrency), server)
+                for oid, _, _ in tiny:
+                    os.remove(os.path.join(temp, oid))
+            elif workload == "repush":
+                report("re-push", tiny, *transfer(agent_args, "upload", tiny, a.concurrency), server)
+            elif workload == "large":
+                large = make_large_objects(os.path.join(work, "large"), a.large_count, a.large_size)
+                report("large upload", large, *transfer(agent_args, "upload", large, a.concurrency), server)
+                report("large download", large, *transfer(agent_args, "download", large, a.concurrency), server)
+                shutil.rmtree(os.path.join(work, "large"))
+    finally:
+        if server is not None:
+            server.close()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from paramiko import (AUTH_FAILED, AUTH_SUCCESSFUL, OPEN_SUCCEEDED, SFTP_OK, RSAKey, ServerInterface,
+                      SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, Transport)
+from paramiko.sftp import SFTP_NO_SUCH_FILE
+
+
+class BenchServer(ServerInterface):
+
+    def __init__(self, counters):
+        self.counters = counters
+
+    def check_auth_publickey(self, username, key):
+        self.counters["handshakes"] += 1
+        return AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+
+class BenchHandle(SFTPHandle):
+
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        if attr.st_size is not None:
+            os.ftruncate(self.writefile.fileno(), attr.st_size)
+        return SFTP_OK
+
+
+class BenchSftp(SFTPServerInterface):
+    root = None
+
+    def path(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def canonicalize(self, path):
+        return os.path.normpath("/" + path).replace("\\", "/")
+
+    def list_folder(self, path):
+        try:
+            path = self.path(path)
+            return [SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self.path(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self.path(path), flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        mode = "r+b" if flags & os.O_RDWR else "wb" if flags & os.O_WRONLY else "rb"
+        if flags & os.O_APPEND:
+            mode = "ab" if flags & os.O_WRONLY else "a+b"
+        f = os.fdopen(fd, mode)
+        handle = BenchHandle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self.path(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        if os.path.exists(self.path(newpath)):
+            return SFTP_NO_SUCH_FILE
+        return self.posix_rename(oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self.path(oldpath), self.path(newpath))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self.path(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self.path(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        if attr.st_size is not None:
+            os.truncate(self.path(path), attr.st_size)
+        return SFTP_OK
+
+
+class LocalSftpServer:
+    """In-process sftp server over a local directory, for benchmarks only. Every key is accepted."""
+
+    def __init__(self, root, latency=0.0, bandwidth=None):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.host_key = RSAKey.generate(2048)
+        self.counters = {"handshakes": 0, "connections": 0}
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(64)
+        self.port = self.listener.getsockname()[1]
+        self.transports = []
+        self.running = True
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while self.running:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            self.counters["connections"] += 1
+            if self.latency or self.bandwidth:
+                client = ShapedSocket(client, self.latency, self.bandwidth)
+            transport = Transport(client)
+            transport.add_server_key(self.host_key)
+            BenchSftp.root = self.root
+            transport.set_subsystem_handler("sftp", SFTPServer, BenchSftp)
+            transport.start_server(server=BenchServer(self.counters))
+            self.transports.append(transport)
+
+    def close(self):
+        self.running = False
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+
+
+class ShapedSocket:
+    """Delays and rate-limits what the server sends, so each round trip pays the latency once."""
+
+    def __init__(self, sock, latency, bandwidth):
+        self.sock = sock
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        threading.Thread(target=self.pump, daemon=True).start()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def send(self, data):
+        with self.condition:
+            self.queue.append((time.monotonic() + self.latency, bytes(data)))
+            self.condition.notify()
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def pump(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                due, data = self.queue.popleft()
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                return
+            if self.bandwidth:
+                time.sleep(len(data) / self.bandwidth)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.sock.close()
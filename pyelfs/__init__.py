@@ -1,13 +1,26 @@
-import json
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from logging import getLogger
-from .util import stage_logger
+from time import sleep
+from .metrics import FORMATS, transfer_metrics
+from .pack import PACK_SIZE
+from .protocol import events, TERMINATE
+from .retry import RetryPolicy, TRANSIENT_ERRORS, transient
+from .scheduler import Scheduler
+from .util import ERROR_CODE, error_event, event_writer, routed, stage_logger
 
 logger = getLogger(__name__)
 __version__ = '0.1.1'
 
 
 class CustomTransferAgent(ABC):
+    max_in_flight_bytes = None
+    small_object_size = 1 << 20
+    small_workers = None
+    large_streams = None
+    retry = RetryPolicy()
+    transient_errors = TRANSIENT_ERRORS
 
     @abstractmethod
     def init(self, event, operation, remote, concurrent, concurrenttransfers):
@@ -24,7 +37,34 @@ class CustomTransferAgent(ABC):
     @staticmethod
     @stage_logger("Terminate Stage")
     def terminate():
-        yield '{"event": "terminate"}'
+        yield TERMINATE
+
+    def prepare(self, batch):
+        pass
+
+    def checkpoint(self):
+        # Stores what a session wrote, like open packs and index caches, without closing connections.
+        pass
+
+    def schedule(self, max_in_flight_bytes=None, small_object_size=None, small_workers=None,
+                 large_streams=None, retries=3, retry_delay=0.5, **kwargs):
+        self.retry = RetryPolicy(retries, retry_delay)
+        self.max_in_flight_bytes = max_in_flight_bytes
+        if small_object_size is not None:
+            self.small_object_size = small_object_size
+        self.small_workers = small_workers
+        self.large_streams = large_streams
+
+    def lanes(self, concurrent, concurrenttransfers):
+        if not concurrent:
+            return 1, 0
+        workers = max(int(concurrenttransfers or 1), 1)
+        return self.small_workers or workers, self.large_streams or max(workers // 4, 1)
+
+    def scheduler(self, executor, small_workers, large_streams, writer=event_writer):
+        return Scheduler(executor, partial(self.transfer, writer=writer), small_workers, large_streams,
+                         self.small_object_size if large_streams else None,
+                         self.max_in_flight_bytes, self.prepare)
 
     @property
     def dispatcher(self):
@@ -34,17 +74,103 @@ class CustomTransferAgent(ABC):
             "download": lambda k: self.download(**k),
         }
 
-    def main_proc(self, stream):
-        for line in stream:
-            logger.debug(line)
+    @classmethod
+    def add_schedule_argument(cls, parser):
+        parser.add_argument("--max-in-flight-bytes", type=int,
+                            help="bytes of objects transferred at once. "
+                                 "Later small objects overtake a large one that does not fit.")
+        parser.add_argument("--small-object-size", type=int,
+                            help="objects below this size (default 1 MiB) run in the small-object lane.")
+        parser.add_argument("--small-workers", type=int,
+                            help="width of the small-object lane, defaults to lfs.concurrenttransfers.")
+        parser.add_argument("--large-streams", type=int,
+                            help="dedicated streams for large objects, "
+                                 "defaults to a quarter of lfs.concurrenttransfers.")
+        parser.add_argument("--retries", type=int, default=3,
+                            help="attempts after a dropped connection or timeout, before an object is reported failed.")
+        parser.add_argument("--retry-delay", type=float, default=0.5,
+                            help="base delay in seconds of the jittered exponential backoff between attempts.")
+
+    @classmethod
+    def add_pack_argument(cls, parser):
+        parser.add_argument("--pack-threshold", type=int,
+                            help="objects below this size are appended to shared pack files "
+                                 "instead of being stored one file each. Packs are always read.")
+        parser.add_argument("--pack-size", type=int, default=PACK_SIZE,
+                            help="size at which a new pack file is started.")
+
+    @classmethod
+    def add_metrics_argument(cls, parser):
+        parser.add_argument("--metrics", help="file to write per-object transfer metrics into.")
+        parser.add_argument("--metrics-format", default="jsonl", choices=FORMATS,
+                            help="'jsonl' appends one record per object and a summary, "
+                                 "'prometheus' writes a textfile for node_exporter.")
+
+    @classmethod
+    def add_daemon_argument(cls, parser):
+        parser.add_argument("--daemon", nargs="?", const="",
+                            help="forward transfers to a running `pyelfs daemon`, "
+                                 "listening at the given socket or the default one. "
+                                 "Transfers run in this process when no daemon answers.")
+
+    def transient(self, e):
+        return transient(e, self.transient_errors)
+
+    def attempt(self, data, writer):
+        for attempt in range(self.retry.retries + 1):
             try:
-                data = json.loads(line)
+                for res in self.dispatcher[data["event"]](data):
+                    writer.write(res)
+                return
             except Exception as e:
-                logger.debug(e)
-                continue
-            for res in self.dispatcher[data["event"]](data):
-                logger.debug(res)
-                print(res, flush=True)
-        res = next(self.terminate())
-        logger.debug(res)
-        print(res, flush=True)
+                if attempt == self.retry.retries or not self.transient(e):
+                    raise
+                delay = self.retry.backoff(attempt)
+                logger.warning(f"Retry {data.get('oid')} in {delay:.2f}s after {e!r}")
+                transfer_metrics.retried()
+                sleep(delay)
+
+    def transfer(self, data, record=None, writer=event_writer):
+        try:
+            with transfer_metrics.transfer(record), routed(writer):
+                self.attempt(data, writer)
+        except Exception as e:
+            logger.exception(e)
+            writer.write(error_event(e, ERROR_CODE[data["event"].upper()], data.get("oid")))
+
+    def serve(self, stream, writer=event_writer):
+        executor = None
+        scheduler = None
+        try:
+            for data in events(stream):
+                if data["event"] == "terminate" or writer.closed:
+                    break
+                if data["event"] == "init":
+                    small_workers, large_streams = self.lanes(data.get("concurrent", True),
+                                                              data.get("concurrenttransfers"))
+                    try:
+                        for res in self.dispatcher["init"](data):
+                            writer.write(res)
+                    except Exception as e:
+                        logger.exception(e)
+                        writer.write(error_event(e, ERROR_CODE.INIT))
+                        continue
+                    if executor is None:
+                        logger.info(f"Transfer up to {small_workers} small and {large_streams} large objects at once.")
+                        executor = ThreadPoolExecutor(small_workers + large_streams)
+                        scheduler = self.scheduler(executor, small_workers, large_streams, writer)
+                    continue
+                if executor is None:
+                    executor = ThreadPoolExecutor(1)
+                    scheduler = self.scheduler(executor, 1, 0, writer)
+                scheduler.put(data, transfer_metrics.queued(data))
+            if scheduler is not None:
+                scheduler.drain()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def main_proc(self, stream):
+        self.serve(stream)
+        event_writer.write(next(self.terminate()))
+        transfer_metrics.write()
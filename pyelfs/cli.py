@@ -2,14 +2,16 @@ import logging
 import sys
 from argparse import ArgumentParser
 from enum import Enum
+from importlib import import_module
 
-from .file_agent import FileAgent
-from .null_agent import NullAgent
-from .sftp_agent import SftpAgent
-from .util import exclude, include, include_pyelfs_wrapped
+from .daemon import client_args, forward, resolve
+from .metrics import transfer_metrics
+from .util import exclude, include, include_not_none, include_optional_pyelfs_wrapped, include_pyelfs_wrapped
 
 logger = logging.getLogger(__name__)
 
+AGENTS = ("file", "sftp", "null")
+
 
 class Cli:
     def __init__(self, **kwargs):
@@ -21,16 +23,42 @@ class Cli:
             "help": exclude(),
 
             "verbose": include("--verbose"),
+            "metrics": include_pyelfs_wrapped("--metrics"),
+            "metrics_format": include("--metrics-format"),
             "temp": include_pyelfs_wrapped("--temp"),
+            "pack_threshold": include("--pack-threshold"),
+            "pack_size": include("--pack-size"),
+            "max_in_flight_bytes": include("--max-in-flight-bytes"),
+            "small_object_size": include("--small-object-size"),
+            "small_workers": include("--small-workers"),
+            "large_streams": include("--large-streams"),
+            "retries": include_not_none("--retries"),
+            "retry_delay": include_not_none("--retry-delay"),
 
             "lfs_storage": include_pyelfs_wrapped("--lfs-storage"),
             "lfs_storage_local": include_pyelfs_wrapped("--lfs-storage-local"),
             "lfs_storage_remote": include_pyelfs_wrapped("--lfs-storage-remote"),
+            "transfer_strategy": include("--transfer-strategy"),
 
             "user": include("--user"),
             "hostname": include("--hostname"),
             "port": include("--port"),
             "rsa_key": include_pyelfs_wrapped("--rsa-key"),
+            "channels": include("--channels"),
+            "window_size": include("--window-size"),
+            "max_packet_size": include("--max-packet-size"),
+            "prefetch_requests": include("--prefetch-requests"),
+            "index_cache": include_pyelfs_wrapped("--index-cache"),
+            "index_ttl": include("--index-ttl"),
+            "resume_threshold": include("--resume-threshold"),
+            "segments": include("--segments"),
+            "segment_threshold": include("--segment-threshold"),
+            "cache_dir": include_pyelfs_wrapped("--cache-dir"),
+            "cache_size": include("--cache-size"),
+            "compression": include("--compression"),
+            "replicas": include("--replicas"),
+            "write_quorum": include("--write-quorum"),
+            "daemon": include_optional_pyelfs_wrapped("--daemon"),
         }
 
     def main_proc(self, stream):
@@ -56,31 +84,104 @@ class Cli:
     @classmethod
     def add_argument(cls, parser):
         parser_sub = parser.add_subparsers(dest="agent")
-        for command in SubCommands:
-            if command.name == "init":
-                continue
-            command.value.add_argument(parser_sub.add_parser(command.name))
+        for name in AGENTS:
+            SubCommands[name].load().add_argument(parser_sub.add_parser(name))
+
+
+class Compact:
+    agents = ("file", "sftp")
+
+    def __init__(self, min_age, **kwargs):
+        self.min_age = min_age
+        self.kwargs = kwargs
+
+    def main_proc(self, stream):
+        if not self.kwargs["agent"]:
+            self.kwargs["help"]()
+            return
+        agent = SubCommands[self.kwargs["agent"]].load()(**self.kwargs)
+        print(f"{agent.compact(self.min_age)} objects were rewritten into new packs.")
+
+    @classmethod
+    def add_argument(cls, parser):
+        parser.add_argument("--min-age", type=float, default=3600,
+                            help="only packs left untouched for this many seconds are rewritten.")
+        parser_sub = parser.add_subparsers(dest="agent")
+        for name in cls.agents:
+            SubCommands[name].load().add_argument(parser_sub.add_parser(name))
+
+
+class Rebalance:
+    agents = ("file",)
+
+    def __init__(self, workers, **kwargs):
+        self.workers = workers
+        self.kwargs = kwargs
+
+    def main_proc(self, stream):
+        if not self.kwargs["agent"]:
+            self.kwargs["help"]()
+            return
+        agent = SubCommands[self.kwargs["agent"]].load()(**self.kwargs)
+        print(f"{agent.rebalance(self.workers)} objects were moved to the root they hash to.")
 
     @classmethod
-    def rep(cls):
-        return "initialize for pyelfs in git directory."
+    def add_argument(cls, parser):
+        parser.add_argument("--workers", type=int, default=8, help="objects moved at once.")
+        parser_sub = parser.add_subparsers(dest="agent")
+        for name in cls.agents:
+            SubCommands[name].load().add_argument(parser_sub.add_parser(name))
 
 
 class SubCommands(Enum):
-    init = Cli
-    file = FileAgent
-    sftp = SftpAgent
-    null = NullAgent
+    init = (".cli", "Cli", "initialize for pyelfs in git directory.")
+    compact = (".cli", "Compact", "rewrite small pack files of a remote into larger ones.")
+    rebalance = (".cli", "Rebalance", "move objects to the storage root they hash to after roots changed.")
+    prefetch = (".prefetch", "Prefetch", "fetch objects of a revision into .git/lfs with the configured agent.")
+    sync = (".sync", "Sync", "copy objects missing on one storage from another.")
+    file = (".file_agent", "FileAgent", "file agent")
+    sftp = (".sftp_agent", "SftpAgent", "sftp agent")
+    null = (".null_agent", "NullAgent", "null agent")
+    daemon = (".daemon", "Daemon", "keep file and sftp agents warm for the agents git-lfs spawns.")
+
+    def __init__(self, module, attribute, help):
+        self.module = module
+        self.attribute = attribute
+        self.help = help
+
+    def load(self):
+        # Agents are imported on demand, so that `pyelfs file` never pays for paramiko or GitPython.
+        return getattr(import_module(self.module, __package__), self.attribute)
+
+
+def unwrap(kwargs):
+    return dict((k, v.replace("pyelfs://", "") if type(v) is str else v) for k, v in kwargs.items())
+
+
+def agent_from_args(args, cwd=None):
+    command = SubCommands[args[0]].load()
+    p = ArgumentParser(f"pyelfs {args[0]}")
+    command.add_argument(p)
+    kwargs = unwrap(p.parse_args(args[1:]).__dict__)
+    return command(**(kwargs if cwd is None else resolve(kwargs, cwd)))
 
 
 def main():
+    forwarded = client_args(sys.argv[1:])
+    # A forwarding agent neither parses its options nor imports the agent, so it starts in a few milliseconds.
+    if forwarded and forward(*forwarded, sys.stdin.buffer, sys.stdout.buffer):
+        return
     p = ArgumentParser("pyelfs")
 
+    selected = next((arg for arg in sys.argv[1:] if not arg.startswith("-")), None)
     p_subcommands = p.add_subparsers(dest="subcommand")
     for subcommand in SubCommands:
-        p_subcommand = p_subcommands.add_parser(subcommand.name, help=subcommand.value.rep())
-        subcommand.value.add_argument(p_subcommand)
-        p_subcommand.set_defaults(func=subcommand.value, help=p_subcommand.print_help)
+        p_subcommand = p_subcommands.add_parser(subcommand.name, help=subcommand.help)
+        if subcommand.name != selected:
+            continue
+        command = subcommand.load()
+        command.add_argument(p_subcommand)
+        p_subcommand.set_defaults(func=command, help=p_subcommand.print_help)
 
     a = p.parse_args()
     if not a.subcommand:
@@ -91,8 +192,11 @@ def main():
             logging.basicConfig(level=logging.DEBUG, filename=a.verbose)
     except AttributeError:
         pass
+    if getattr(a, "metrics", None):
+        transfer_metrics.configure(a.metrics.replace("pyelfs://", ""), a.metrics_format)
     logger.info(f"Arguments: {a}")
-    kwarg = dict((k, v.replace("pyelfs://", "") if type(v) is str else v) for k, v in a.__dict__.items())
+    kwarg = unwrap(a.__dict__)
     logger.info(f"Modified arguments: {kwarg}")
     agent = a.func(**kwarg)
-    agent.main_proc(sys.stdin)
+    # Events are decoded from bytes, which skips the text layer of stdin.
+    agent.main_proc(getattr(sys.stdin, "buffer", sys.stdin))
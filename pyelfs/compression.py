@@ -0,0 +1,54 @@
+import zlib
+from logging import getLogger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = getLogger(__name__)
+
+MODES = ["none", "auto", "zlib", "zstd"]
+EXTENSIONS = ["zst", "zz"]
+SAMPLE_SIZE = 64 << 10
+MIN_SIZE = 4 << 10
+RATIO = 0.9
+
+
+def extension_of(mode):
+    if mode in (None, "none"):
+        return None
+    if mode == "zstd" or (mode == "auto" and zstandard is not None):
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package.")
+        return "zst"
+    return "zz"
+
+
+def compressor(extension):
+    if extension == "zst":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return zlib.compressobj(6)
+
+
+def decompressor(extension):
+    if extension == "zst":
+        if zstandard is None:
+            raise IOError("Reading a zstd compressed object needs the zstandard package.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj()
+
+
+def compressible(path, size):
+    # Samples from the start, middle and end decide, so large media never pays for a full pass.
+    if size < MIN_SIZE:
+        return False
+    sampled = compressed = 0
+    with open(path, "rb") as f:
+        for offset in sorted(set([0, max(size // 2 - SAMPLE_SIZE // 2, 0), max(size - SAMPLE_SIZE, 0)])):
+            f.seek(offset)
+            data = f.read(SAMPLE_SIZE)
+            sampled += len(data)
+            compressed += len(zlib.compress(data, 1))
+    logger.debug(f"{path} samples compress to {compressed}/{sampled} bytes.")
+    return compressed < sampled * RATIO
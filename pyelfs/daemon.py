@@ -0,0 +1,221 @@
+import io
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+from getpass import getuser
+from logging import getLogger
+from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+from tempfile import gettempdir
+from threading import Event, Lock, Thread
+from time import monotonic
+
+logger = getLogger(__name__)
+
+AGENTS = ("file", "sftp")
+BUFFER_SIZE = 64 << 10
+# Options naming local paths, which a client means relative to its own working directory.
+PATH_OPTIONS = ("lfs_storage_local", "temp", "rsa_key", "index_cache", "cache_dir")
+
+
+def default_socket():
+    runtime = os.environ.get("XDG_RUNTIME_DIR") or gettempdir()
+    return os.path.join(runtime, f"pyelfs-{getuser()}", "daemon.sock")
+
+
+def resolve(kwargs, cwd):
+    for k in PATH_OPTIONS:
+        if kwargs.get(k):
+            paths = kwargs[k].split(os.pathsep)
+            kwargs[k] = os.pathsep.join(os.path.join(cwd, os.path.expanduser(p)) if p else p for p in paths)
+    return kwargs
+
+
+def check_directory(path):
+    # Whoever can write to the directory could put their own socket there and read every transfer.
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory owned by uid {os.getuid()} and closed to others.")
+
+
+def peer_uid(sock):
+    # None where the platform does not tell the peer of a unix socket.
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def client_args(argv):
+    # Returns the socket and the agent arguments without --daemon, or None if the daemon is not wanted.
+    if not argv or argv[0] not in AGENTS or "--daemon" not in argv:
+        return None
+    i = argv.index("--daemon")
+    path = argv[i + 1] if i + 1 < len(argv) and not argv[i + 1].startswith("-") else ""
+    args = argv[:i] + argv[i + 1 + bool(path):]
+    return path.replace("pyelfs://", "") or default_socket(), args
+
+
+def forward(path, args, stdin, stdout):
+    try:
+        check_directory(os.path.dirname(path))
+    except FileNotFoundError as e:
+        logger.info(f"No daemon at {path}, transfer in this process: {e}")
+        return False
+    except PermissionError as e:
+        logger.warning(f"Refuse the daemon at {path}, transfer in this process: {e}")
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError as e:
+        logger.info(f"No daemon at {path}, transfer in this process: {e}")
+        sock.close()
+        return False
+    uid = peer_uid(sock)
+    if uid not in (None, os.getuid()):
+        logger.warning(f"Refuse the daemon at {path} run by uid {uid}, transfer in this process.")
+        sock.close()
+        return False
+    logger.info(f"Forward events to the daemon at {path}")
+    sock.sendall(json.dumps({"args": args, "cwd": os.getcwd()}).encode() + b"\n")
+
+    def send():
+        try:
+            for line in stdin:
+                sock.sendall(line)
+            sock.shutdown(socket.SHUT_WR)
+        except OSError as e:
+            logger.debug(e)
+
+    Thread(target=send, daemon=True).start()
+    with sock:
+        for data in iter(lambda: sock.recv(BUFFER_SIZE), b""):
+            stdout.write(data)
+            stdout.flush()
+    return True
+
+
+class Handler(StreamRequestHandler):
+
+    def handle(self):
+        from .protocol import loads, TERMINATE
+        from .util import ERROR_CODE, error_event, EventWriter
+        uid = peer_uid(self.request)
+        if uid not in (None, os.getuid()):
+            logger.warning(f"Refuse a client of uid {uid}.")
+            return
+        self.server.daemon.enter()
+        writer = EventWriter(io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True))
+        try:
+            request = loads(self.rfile.readline())
+            try:
+                agent = self.server.daemon.agent(request["args"], request["cwd"])
+            except (Exception, SystemExit) as e:
+                logger.exception(e)
+                writer.write(error_event(e, ERROR_CODE.INIT))
+                return
+            # Agents outlive the client, so only what it wrote is stored and connections stay open.
+            agent.serve(self.rfile, writer)
+            try:
+                agent.checkpoint()
+            except Exception as e:
+                logger.warning(f"Failed to checkpoint an agent: {e}")
+            writer.write(TERMINATE)
+        finally:
+            self.server.daemon.leave()
+
+
+class Server(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon:
+
+    def __init__(self, socket, idle_timeout, **kwargs):
+        self.socket = socket.replace("pyelfs://", "") if socket else default_socket()
+        self.idle_timeout = idle_timeout
+        self.agents = {}
+        self.lock = Lock()
+        self.clients = 0
+        self.idle_since = monotonic()
+        self.stopped = Event()
+
+    def agent(self, args, cwd):
+        from .cli import agent_from_args
+        # Clients in other directories may mean other paths by the same arguments.
+        key = (cwd, *args)
+        with self.lock:
+            if key not in self.agents:
+                if not args or args[0] not in AGENTS:
+                    raise ValueError(f"The daemon serves {' and '.join(AGENTS)} agents, not {args[:1]}.")
+                logger.info(f"Start an agent for {args}")
+                self.agents[key] = agent_from_args(list(args), cwd)
+            return self.agents[key]
+
+    def enter(self):
+        with self.lock:
+            self.clients += 1
+
+    def leave(self):
+        with self.lock:
+            self.clients -= 1
+            self.idle_since = monotonic()
+
+    def idle(self):
+        with self.lock:
+            return self.clients == 0 and monotonic() - self.idle_since >= self.idle_timeout
+
+    def watch(self, server):
+        while not self.stopped.wait(min(self.idle_timeout, 10)):
+            if self.idle():
+                logger.info(f"No client for {self.idle_timeout} seconds. Exit.")
+                server.shutdown()
+                return
+
+    def listen(self):
+        directory = os.path.dirname(self.socket)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_directory(directory)
+        if os.path.exists(self.socket):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket)
+                raise RuntimeError(f"A daemon already listens at {self.socket}.")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.socket)
+            finally:
+                probe.close()
+        server = Server(self.socket, Handler)
+        os.chmod(self.socket, 0o600)
+        server.daemon = self
+        return server
+
+    def main_proc(self, stream):
+        server = self.listen()
+        print(f"pyelfs daemon listens at {self.socket}", file=sys.stderr)
+        watcher = Thread(target=self.watch, args=(server,), daemon=True)
+        watcher.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            server.server_close()
+            os.remove(self.socket)
+            for agent in self.agents.values():
+                try:
+                    list(agent.terminate())
+                except Exception as e:
+                    logger.warning(f"Failed to terminate an agent: {e}")
+
+    @classmethod
+    def add_argument(cls, parser):
+        parser.add_argument("--socket",
+                            help=f"unix socket to listen at, defaults to {default_socket()}.")
+        parser.add_argument("--idle-timeout", type=float, default=900,
+                            help="seconds without clients after which the daemon exits.")
+        parser.add_argument("--verbose", help="verbose log")
@@ -1,12 +1,15 @@
-import json
 import os
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-from random import random
-from time import sleep
 from tempfile import gettempdir
 
 from . import CustomTransferAgent
+from .file_copy import FileCopier, STRATEGIES
+from .integrity import AtomicDownload, CHUNK_SIZE, HashCache, IntegrityError
+from .pack import LocalFs, PACK_SIZE, PackStore, RELOAD_AFTER
+from .placement import Ring
+from .protocol import complete, INIT, TERMINATE
+from .progress import Progress
 from .util import ERROR_CODE, handle_error, stage_logger
 
 logger = getLogger(__name__)
@@ -14,74 +17,191 @@ logger = getLogger(__name__)
 
 class FileAgent(CustomTransferAgent):
 
-    def __init__(self, lfs_storage_local, temp, **kwargs):
+    def __init__(self, lfs_storage_local, temp, transfer_strategy="auto",
+                 pack_threshold=None, pack_size=PACK_SIZE, **kwargs):
         self.lfs_storage_local = lfs_storage_local
+        self.roots = [os.path.expanduser(root) for root in lfs_storage_local.split(os.pathsep) if root]
+        self.ring = Ring(self.roots)
+        self.schedule(**kwargs)
         self.temp_dir = temp
-        logger.info("Wait a little to avoid pipe broken")
-        sleep(random())
+        self.copier = FileCopier(transfer_strategy)
+        self.hashes = HashCache()
+        self.present = set()
+        self.shards = set()
+        # Packs are appended sequentially, so they stay in the first root.
+        self.fs = LocalFs(self.roots[0])
+        self.packs = PackStore(pack_threshold, pack_size)
         logger.info("FileAgent is initialized")
 
     @stage_logger("Init Stage")
     def init(self, event, operation, remote, concurrent, concurrenttransfers, **kwargs):
-        yield "{}"
+        yield INIT
+
+    @stage_logger("Terminate Stage")
+    def terminate(self):
+        self.checkpoint()
+        yield TERMINATE
+
+    def checkpoint(self):
+        self.packs.close()
 
     @stage_logger("Upload Stage")
     def upload(self, event, oid, size, path, action):
-        yield json.dumps({
-            "event": "progress",
-            "oid": oid,
-            "byteSoFar": 0,
-            "bytesSinceLast": 0,
-        })
+        progress = Progress(oid, size)
         try:
-            first = os.path.join(self.lfs_storage_local, oid[0:2])
-            if not os.path.isdir(first):
-                os.mkdir(first)
-            second = os.path.join(first, oid[2:4])
-            if not os.path.isdir(second):
-                os.mkdir(second)
-            shutil.copyfile(path, os.path.join(second, oid))
-        except shutil.SameFileError:
-            pass
+            if self.exists(oid, size):
+                logger.info("A same file exists. Skip upload.")
+                progress.skip()
+            elif self.packs.packed(size):
+                with open(path, "rb") as f:
+                    self.packs.append(self.fs, oid, f.read())
+                progress.progress_callback(size)
+                self.present.add(oid)
+            else:
+                target = self.path_of(oid)
+                second = os.path.dirname(target)
+                if second not in self.shards:
+                    os.makedirs(second, exist_ok=True)
+                    self.shards.add(second)
+                self.copier.copy(path, target, progress.progress_callback)
+                self.present.add(oid)
         except Exception as e:
             handle_error(e, ERROR_CODE.UPLOAD)
-        yield json.dumps({
-            "event": "complete",
-            "oid": oid,
-        })
+        yield complete(oid)
+
+    def path_of(self, oid, root=None):
+        return os.path.join(root or self.ring.root_of(oid), oid[0:2], oid[2:4], oid)
+
+    def locate(self, oid):
+        # An object stays readable from its previous root until a rebalance moves it.
+        for root in self.ring.order(oid):
+            path = self.path_of(oid, root)
+            if os.path.exists(path):
+                return path
+        return self.path_of(oid)
+
+    def exists(self, oid, size):
+        # Objects are addressed by their sha256, so a stored file of the same size is the same object.
+        if oid in self.present:
+            return True
+        path = self.locate(oid)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            entry = self.packs.lookup(self.fs, oid)
+            return entry is not None and entry[2] == size
+        self.shards.add(os.path.dirname(path))
+        if st.st_size != size:
+            return False
+        self.present.add(oid)
+        return True
 
     @stage_logger("Download Stage")
     def download(self, event, oid, size, action):
         temp_path = os.path.join(self.temp_dir, oid)
-        logger.info(f"temp path is {temp_path}")
-        yield json.dumps({
-            "event": "progress",
-            "oid": oid,
-            "byteSoFar": 0,
-            "bytesSinceLast": 0,
-        })
+        logger.info("temp path is %s", temp_path)
+        progress = Progress(oid, size)
         try:
-            path = os.path.join(self.lfs_storage_local, oid[0:2], oid[2:4], oid)
-            shutil.copyfile(path, temp_path)
-            yield json.dumps({
-                "event": "complete",
-                "oid": oid,
-                "path": temp_path
-            })
-            self.terminate()
+            path = self.locate(oid)
+            if self.hashes.verify(temp_path, oid):
+                logger.info("A verified file exists. Skip download.")
+                progress.skip()
+            elif not os.path.exists(path) and self.packs.lookup(self.fs, oid, RELOAD_AFTER) is not None:
+                with AtomicDownload(temp_path, oid, self.hashes) as f:
+                    f.write(self.packs.read(self.fs, oid))
+                progress.add(size)
+            elif self.copier.shares_data(path, self.temp_dir):
+                if not self.hashes.verify(path, oid):
+                    raise IntegrityError(f"The stored object doesn't match {oid}.")
+                self.copier.copy(path, temp_path, progress.progress_callback)
+            else:
+                with open(path, "rb") as src, AtomicDownload(temp_path, oid, self.hashes) as f:
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                        f.write(chunk)
+                        progress.add(len(chunk))
         except Exception as e:
             handle_error(e, ERROR_CODE.DOWNLOAD)
+        yield complete(oid, temp_path)
+
+    def compact(self, min_age):
+        return self.packs.compact(self.fs, min_age)
+
+    def listdir(self, path):
+        names = set()
+        for root in self.roots:
+            try:
+                names.update(os.listdir(os.path.join(root, *path.split("/"))))
+            except FileNotFoundError:
+                pass
+        return sorted(names)
+
+    def listing(self, shard, roots=None):
+        listing = {}
+        for root in roots or self.roots:
+            try:
+                with os.scandir(os.path.join(root, *shard.split("/"))) as entries:
+                    listing.update((e.name, e.stat().st_size) for e in entries if e.is_file())
+            except FileNotFoundError:
+                pass
+        return listing
+
+    def misplaced(self, root):
+        for first in self.listdir_of(root, "."):
+            for second in self.listdir_of(root, first):
+                for name in self.listing(f"{first}/{second}", [root]):
+                    if len(name) == 64 and "." not in name and self.ring.root_of(name) != root:
+                        yield name
+
+    @staticmethod
+    def listdir_of(root, path):
+        try:
+            return [name for name in os.listdir(os.path.join(root, path)) if len(name) == 2]
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+    def move(self, oid, root):
+        src = self.path_of(oid, root)
+        dst = self.path_of(oid)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if not os.path.exists(dst) or os.path.getsize(dst) != os.path.getsize(src):
+            # The copy is renamed into place, so readers see either no object or all of it.
+            self.copier.copy(src, dst)
+        os.remove(src)
+        logger.debug(f"{oid} was moved from {root}.")
+
+    def rebalance(self, workers):
+        moved = 0
+        with ThreadPoolExecutor(workers) as executor:
+            futures = dict((executor.submit(self.move, oid, root), oid)
+                           for root in self.roots for oid in self.misplaced(root))
+            for future, oid in futures.items():
+                try:
+                    future.result()
+                    moved += 1
+                except OSError as e:
+                    logger.warning(f"Failed to move {oid}: {e}")
+        return moved
+
+    def packed(self):
+        return dict((oid, length) for oid, (_, _, length) in self.packs.load(self.fs).items())
 
     @classmethod
     def add_argument(cls, parser):
         parser.add_argument("--lfs-storage-local",
                             default="~/.lfs-miscellaneous",
-                            help="path of lfs objects directory.")
+                            help="path of lfs objects directory. "
+                                 f"Several roots separated by '{os.pathsep}' spread objects over them "
+                                 "by consistent hashing of the oid.")
+        parser.add_argument("--transfer-strategy",
+                            default="auto", choices=STRATEGIES,
+                            help="how objects are copied. "
+                                 "'auto' picks hardlink or reflink on the same filesystem "
+                                 "and kernel-side copies otherwise.")
+        cls.add_schedule_argument(parser)
+        cls.add_pack_argument(parser)
+        cls.add_daemon_argument(parser)
         parser.add_argument("--verbose", help="verbose log")
+        cls.add_metrics_argument(parser)
         parser.add_argument("--temp",
                             default=f"{gettempdir()}",
                             help="temporary directory to download lfs objects.")
-
-    @classmethod
-    def rep(cls):
-        return "file agent"
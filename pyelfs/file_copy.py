@@ -0,0 +1,122 @@
+import errno
+import os
+from logging import getLogger
+from threading import get_ident, Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = getLogger(__name__)
+
+FICLONE = 0x40049409
+CHUNK_SIZE = 1 << 20
+KERNEL_CHUNK_SIZE = 64 << 20
+UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL,
+               errno.ENOSYS, errno.ENOTTY, errno.EPERM}
+STRATEGIES = ["auto", "hardlink", "reflink", "copy_file_range", "sendfile", "copy"]
+
+
+def hardlink(src, dst, callback):
+    os.link(src, dst)
+
+
+def reflink(src, dst, callback):
+    if fcntl is None:
+        raise OSError("reflink is not supported on this platform.")
+    with open(src, "rb") as fs, open(dst, "wb") as fd:
+        fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+
+
+def copy_file_range(src, dst, callback):
+    with open(src, "rb") as fs, open(dst, "wb") as fd:
+        size = os.fstat(fs.fileno()).st_size
+        offset = 0
+        while offset < size:
+            copied = os.copy_file_range(fs.fileno(), fd.fileno(), min(KERNEL_CHUNK_SIZE, size - offset))
+            if copied == 0:
+                break
+            offset += copied
+            callback(offset)
+
+
+def sendfile(src, dst, callback):
+    with open(src, "rb") as fs, open(dst, "wb") as fd:
+        size = os.fstat(fs.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(fd.fileno(), fs.fileno(), offset, min(KERNEL_CHUNK_SIZE, size - offset))
+            if sent == 0:
+                break
+            offset += sent
+            callback(offset)
+
+
+def copy(src, dst, callback):
+    with open(src, "rb") as fs, open(dst, "wb") as fd:
+        offset = 0
+        for chunk in iter(lambda: fs.read(CHUNK_SIZE), b""):
+            fd.write(chunk)
+            offset += len(chunk)
+            callback(offset)
+
+
+METHODS = {
+    "hardlink": hardlink,
+    "reflink": reflink,
+    "copy_file_range": copy_file_range,
+    "sendfile": sendfile,
+    "copy": copy,
+}
+
+
+class FileCopier:
+
+    def __init__(self, strategy="auto"):
+        self.strategy = strategy
+        self.unsupported = set()
+        self.lock = Lock()
+
+    def candidates(self, src, dst_dir):
+        if self.strategy != "auto":
+            return [self.strategy, "copy"] if self.strategy != "copy" else ["copy"]
+        dst_dev = os.stat(dst_dir).st_dev
+        names = []
+        if os.stat(src).st_dev == dst_dev:
+            names += ["hardlink", "reflink"]
+        if hasattr(os, "copy_file_range"):
+            names.append("copy_file_range")
+        if hasattr(os, "sendfile"):
+            names.append("sendfile")
+        names.append("copy")
+        return [name for name in names if (name, dst_dev) not in self.unsupported]
+
+    def shares_data(self, src, dst_dir):
+        candidates = self.candidates(src, dst_dir)
+        return candidates[0] in ("hardlink", "reflink")
+
+    def copy(self, src, dst, callback=None):
+        callback = callback or (lambda byte_so_far: None)
+        dst_dir = os.path.dirname(dst) or "."
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            logger.debug(f"{src} and {dst} are the same file.")
+            return "same"
+        temp_path = f"{dst}.{os.getpid()}.{get_ident()}.tmp"
+        for name in self.candidates(src, dst_dir):
+            try:
+                METHODS[name](src, temp_path, callback)
+            except OSError as e:
+                logger.debug(f"{name} failed from {src} to {dst}: {e}")
+                if e.errno in UNSUPPORTED:
+                    with self.lock:
+                        self.unsupported.add((name, os.stat(dst_dir).st_dev))
+                if os.path.lexists(temp_path):
+                    os.remove(temp_path)
+                if name == "copy":
+                    raise
+                continue
+            os.replace(temp_path, dst)
+            callback(os.path.getsize(dst))
+            logger.debug(f"{src} was copied to {dst} by {name}.")
+            return name
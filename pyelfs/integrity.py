@@ -0,0 +1,121 @@
+import hashlib
+import os
+from logging import getLogger
+from tempfile import mkstemp
+from threading import Lock
+
+logger = getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+
+
+class IntegrityError(IOError):
+    pass
+
+
+def sha256_file(path, length=None):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            sha.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return sha
+
+
+class HashCache:
+
+    def __init__(self):
+        self.digests = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def key(path):
+        st = os.stat(path)
+        return os.path.abspath(path), st.st_ino, st.st_size, st.st_mtime_ns
+
+    def remember(self, path, oid):
+        with self.lock:
+            self.digests[self.key(path)] = oid
+
+    def verify(self, path, oid):
+        try:
+            key = self.key(path)
+        except FileNotFoundError:
+            return False
+        with self.lock:
+            digest = self.digests.get(key)
+        if digest is None:
+            logger.info(f"Verify {path}")
+            digest = sha256_file(path).hexdigest()
+            with self.lock:
+                self.digests[key] = digest
+        if digest != oid:
+            logger.info(f"{path} doesn't match {oid}")
+            return False
+        return True
+
+
+class HashingWriter:
+
+    def __init__(self, f, sha=None):
+        self.f = f
+        self.sha = sha or hashlib.sha256()
+
+    def write(self, data):
+        self.sha.update(data)
+        return self.f.write(data)
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
+
+
+class AtomicDownload:
+    keep_on_error = False
+
+    def __init__(self, path, oid, hashes=None):
+        self.path = path
+        self.oid = oid
+        self.hashes = hashes
+        self.temp_path = None
+        self.writer = None
+        self.offset = 0
+
+    def __enter__(self):
+        fd, self.temp_path = mkstemp(dir=os.path.dirname(self.path) or ".", prefix=f".{self.oid}.")
+        self.writer = HashingWriter(os.fdopen(fd, "wb"))
+        return self.writer
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.writer.f.close()
+        if exc_type is None and self.writer.hexdigest() != self.oid:
+            os.remove(self.temp_path)
+            raise IntegrityError(f"The downloaded object doesn't match {self.oid} "
+                                 f"(sha256 {self.writer.hexdigest()}).")
+        if exc_type is not None:
+            if not self.keep_on_error:
+                os.remove(self.temp_path)
+            return False
+        os.replace(self.temp_path, self.path)
+        if self.hashes is not None:
+            self.hashes.remember(self.path, self.oid)
+        return False
+
+
+class ResumableDownload(AtomicDownload):
+    keep_on_error = True
+
+    def __enter__(self):
+        self.temp_path = f"{self.path}.partial"
+        if os.path.exists(self.temp_path):
+            sha = sha256_file(self.temp_path)
+            self.offset = os.path.getsize(self.temp_path)
+            logger.info(f"Resume {self.temp_path} from {self.offset} bytes.")
+        else:
+            sha = None
+        self.writer = HashingWriter(open(self.temp_path, "ab"), sha)
+        return self.writer
@@ -0,0 +1,191 @@
+import json
+import os
+from contextlib import contextmanager
+from logging import getLogger
+from threading import local, Lock
+from time import monotonic, time
+
+logger = getLogger(__name__)
+
+FORMATS = ["jsonl", "prometheus"]
+
+
+class TransferRecord:
+
+    def __init__(self, oid, operation, size):
+        self.oid = oid
+        self.operation = operation
+        self.size = size
+        self.queued_at = monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.connect_time = 0.0
+        self.round_trips = 0
+        self.retries = 0
+        self.bytes = 0
+        self.error = None
+
+    @property
+    def queue_wait(self):
+        return self.started_at - self.queued_at
+
+    @property
+    def duration(self):
+        return self.finished_at - self.started_at
+
+    @property
+    def throughput(self):
+        return self.bytes / self.duration if self.duration > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "oid": self.oid,
+            "operation": self.operation,
+            "size": self.size,
+            "queue_wait": round(self.queue_wait, 6),
+            "connect_time": round(self.connect_time, 6),
+            "round_trips": self.round_trips,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "duration": round(self.duration, 6),
+            "throughput": round(self.throughput, 1),
+            "error": self.error,
+        }
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(round(p * (len(values) - 1))), len(values) - 1)]
+
+
+class Metrics:
+
+    def __init__(self):
+        self.path = None
+        self.format = "jsonl"
+        self.records = []
+        self.lock = Lock()
+        self.local = local()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def configure(self, path, format="jsonl"):
+        self.path = path
+        self.format = format
+        logger.info(f"Transfer metrics are written into {path} as {format}.")
+
+    def queued(self, data):
+        if not self.enabled:
+            return None
+        return TransferRecord(data.get("oid"), data["event"], data.get("size", 0))
+
+    def current(self):
+        return getattr(self.local, "record", None)
+
+    @contextmanager
+    def transfer(self, record):
+        if record is None:
+            yield
+            return
+        self.local.record = record
+        record.started_at = monotonic()
+        try:
+            yield
+        except Exception as e:
+            record.error = str(e)
+            raise
+        finally:
+            record.finished_at = monotonic()
+            self.local.record = None
+            with self.lock:
+                self.records.append(record)
+
+    @contextmanager
+    def attached(self, record):
+        # Threads that work for a transfer, like the segments of an object, count towards its record.
+        previous = self.current()
+        self.local.record = record
+        try:
+            yield
+        finally:
+            self.local.record = previous
+
+    @contextmanager
+    def connecting(self):
+        started_at = monotonic()
+        try:
+            yield
+        finally:
+            record = self.current()
+            if record is not None:
+                record.connect_time += monotonic() - started_at
+
+    def round_trip(self, n=1):
+        record = self.current()
+        if record is not None:
+            record.round_trips += n
+
+    def retried(self):
+        record = self.current()
+        if record is not None:
+            record.retries += 1
+
+    def summary(self):
+        with self.lock:
+            records = list(self.records)
+        if not records:
+            return {"objects": 0}
+        latencies = [r.finished_at - r.queued_at for r in records]
+        wall = max(r.finished_at for r in records) - min(r.started_at for r in records)
+        total = sum(r.bytes for r in records)
+        return {
+            "objects": len(records),
+            "errors": sum(1 for r in records if r.error),
+            "bytes": total,
+            "wall_time": round(wall, 6),
+            "latency_p50": round(percentile(latencies, 0.5), 6),
+            "latency_p95": round(percentile(latencies, 0.95), 6),
+            "queue_wait_total": round(sum(r.queue_wait for r in records), 6),
+            "connect_time_total": round(sum(r.connect_time for r in records), 6),
+            "round_trips": sum(r.round_trips for r in records),
+            "retries": sum(r.retries for r in records),
+            "mb_per_second": round(total / wall / 1e6 if wall > 0 else 0.0, 3),
+        }
+
+    def prometheus(self, summary):
+        lines = []
+        for key, value in summary.items():
+            name = f"pyelfs_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        lines.append("# TYPE pyelfs_last_run_timestamp_seconds gauge")
+        lines.append(f"pyelfs_last_run_timestamp_seconds {time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        if not self.enabled:
+            return
+        summary = self.summary()
+        logger.info(f"Transfer summary: {summary}")
+        try:
+            if self.format == "prometheus":
+                temp_path = f"{self.path}.tmp"
+                with open(temp_path, "w") as f:
+                    f.write(self.prometheus(summary))
+                os.replace(temp_path, self.path)
+            else:
+                with open(self.path, "a") as f:
+                    with self.lock:
+                        records = list(self.records)
+                    for record in records:
+                        f.write(json.dumps(record.as_dict()) + "\n")
+                    f.write(json.dumps({"summary": summary}) + "\n")
+        except OSError as e:
+            logger.warning(f"Failed to write transfer metrics: {e}")
+
+
+transfer_metrics = Metrics()
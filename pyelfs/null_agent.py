@@ -1,67 +1,47 @@
-import json
 import os
 from logging import getLogger
 
 from . import CustomTransferAgent
+from .protocol import complete, INIT, progress
 from .util import stage_logger
-from git.repo import Repo
-from git.repo.base import InvalidGitRepositoryError
 logger = getLogger(__name__)
 
 
 class NullAgent(CustomTransferAgent):
 
-    def __init__(self, lfs_storage, **kwargs):
-        self.lfs_storage = lfs_storage
+    def __init__(self, lfs_storage=None, **kwargs):
+        self.lfs_storage = lfs_storage or self.default_lfs_storage()
         logger.info("NullAgent is initialized")
 
     @stage_logger("Init Stage")
     def init(self, event, operation, remote, concurrent, concurrenttransfers):
-        yield "{}"
+        yield INIT
 
     @stage_logger("Upload Stage")
     def upload(self, event, oid, size, path, action):
-        yield json.dumps({
-            "event": "progress",
-            "oid": oid,
-            "byteSoFar": 0,
-            "bytesSinceLast": 0,
-        })
-        yield json.dumps({
-            "event": "complete",
-            "oid": oid,
-        })
+        yield progress(oid, 0, 0)
+        yield complete(oid)
 
     @stage_logger("Download Stage")
     def download(self, event, oid, size, action):
-        yield json.dumps({
-            "event": "progress",
-            "oid": oid,
-            "byteSoFar": 0,
-            "bytesSinceLast": 0,
-        })
-        self.lfs_storage = "/".join(self.lfs_storage, oid[0:2], oid[2:4], oid)
-        yield json.dumps({
-            "event": "complete",
-            "oid": oid,
-            "path": os.path.sep.join(self.lfs_storage.split("/"))
-        })
+        yield progress(oid, 0, 0)
+        path = "/".join([self.lfs_storage, oid[0:2], oid[2:4], oid])
+        yield complete(oid, os.path.sep.join(path.split("/")))
+
+    @staticmethod
+    def default_lfs_storage():
+        from git.repo import Repo
+        from git.repo.base import InvalidGitRepositoryError
+        try:
+            return os.path.join(Repo().working_dir, ".git/lfs")
+        except InvalidGitRepositoryError:
+            return "~/.lfs-miscellaneous"
 
     @classmethod
     def add_argument(cls, parser):
-        default_lfs = "~/.lfs-miscellaneous"
-        try:
-            repo = Repo()
-            default_lfs = os.path.join(repo.working_dir, ".git/lfs")
-        except InvalidGitRepositoryError:
-            pass
         parser.add_argument(
             "--lfs-storage",
-            default=default_lfs,
-            help="lfs storage"
+            help="lfs storage, defaults to .git/lfs of the current repository"
         )
         parser.add_argument("--verbose", help="verbose log")
-
-    @classmethod
-    def rep(cls):
-        return "null agent"
+        cls.add_metrics_argument(parser)
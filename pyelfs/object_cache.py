@@ -0,0 +1,90 @@
+import os
+from contextlib import contextmanager
+from logging import getLogger
+from os.path import expanduser
+from time import time
+
+from .file_copy import FileCopier
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = getLogger(__name__)
+
+
+class ObjectCache:
+
+    def __init__(self, root, max_size=None):
+        self.root = expanduser(root)
+        self.max_size = max_size
+        self.copier = FileCopier()
+        os.makedirs(os.path.join(self.root, ".locks"), exist_ok=True)
+
+    def path(self, oid):
+        return os.path.join(self.root, oid[0:2], oid[2:4], oid)
+
+    @contextmanager
+    def locked(self, name):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, ".locks", f"{name}.lock"), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def lock(self, oid):
+        return self.locked(oid[0:4])
+
+    def lookup(self, oid, size):
+        path = self.path(oid)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if st.st_size != size:
+            return None
+        try:
+            os.utime(path, ns=(int(time() * 1e9), st.st_mtime_ns))
+        except OSError as e:
+            logger.debug(e)
+        logger.info(f"{oid} was found in the cache.")
+        return path
+
+    def prepare(self, oid):
+        os.makedirs(os.path.dirname(self.path(oid)), exist_ok=True)
+        return self.path(oid)
+
+    def serve(self, oid, dst):
+        return self.copier.copy(self.path(oid), dst)
+
+    def entries(self):
+        for first in os.listdir(self.root):
+            if first.startswith("."):
+                continue
+            for second in os.listdir(os.path.join(self.root, first)):
+                shard = os.path.join(self.root, first, second)
+                for name in os.listdir(shard):
+                    if name.startswith(".") or name.endswith(".partial"):
+                        continue
+                    path = os.path.join(shard, name)
+                    yield path, os.stat(path)
+
+    def evict(self):
+        if not self.max_size:
+            return
+        with self.locked("evict"):
+            entries = sorted(self.entries(), key=lambda e: e[1].st_atime_ns)
+            total = sum(st.st_size for _, st in entries)
+            logger.info(f"The cache holds {total} bytes in {len(entries)} objects.")
+            for path, st in entries:
+                if total <= self.max_size:
+                    break
+                with self.lock(os.path.basename(path)):
+                    os.remove(path)
+                total -= st.st_size
+                logger.info(f"{path} was evicted from the cache.")
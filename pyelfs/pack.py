@@ -0,0 +1,293 @@
+import hashlib
+import os
+from logging import getLogger
+from threading import Condition
+from time import monotonic, time
+from uuid import uuid4
+
+logger = getLogger(__name__)
+
+PACK_DIR = "packs"
+PACK_SIZE = 256 << 20
+# A writer leaves its pack after this many idle seconds, and a lease this much older is of a dead writer.
+WRITER_IDLE = 300
+LEASE_TTL = 3600
+# A reader that misses an object reloads indexes loaded longer ago than this, as others may have packed it since.
+RELOAD_AFTER = 5
+
+
+class LocalFs:
+    """The subset of paramiko's SFTPClient that packs need, over a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, path):
+        return os.path.join(self.root, *path.split("/"))
+
+    def open(self, path, mode="rb"):
+        return open(self.path(path), mode)
+
+    def listdir(self, path="."):
+        return os.listdir(self.path(path))
+
+    def stat(self, path):
+        return os.stat(self.path(path))
+
+    def mkdir(self, path):
+        os.mkdir(self.path(path))
+
+    def remove(self, path):
+        os.remove(self.path(path))
+
+    def rename(self, src, dst):
+        os.rename(self.path(src), self.path(dst))
+
+
+def read_range(f, offset, length):
+    if hasattr(f, "readv"):
+        return b"".join(f.readv([(offset, length)]))
+    f.seek(offset)
+    return f.read(length)
+
+
+def read_index(fs, name):
+    entries = {}
+    with fs.open(f"{PACK_DIR}/{name}.idx", "rb") as f:
+        if hasattr(f, "prefetch"):
+            f.prefetch()
+        content = f.read()
+    for line in content.decode().splitlines():
+        # A writer that died halfway leaves a torn last line behind.
+        try:
+            oid, offset, length = line.split(" ")
+            entries[oid] = (name, int(offset), int(length))
+        except ValueError:
+            logger.warning(f"Skip a broken line in {name}.idx: {line!r}")
+    return entries
+
+
+class PackWriter:
+    idle_timeout = WRITER_IDLE
+
+    def __init__(self, pack_size=PACK_SIZE):
+        self.pack_size = pack_size
+        self.fs = None
+        self.name = None
+        self.pack = None
+        self.index = None
+        self.size = 0
+        self.written_at = monotonic()
+
+    def open(self, fs):
+        self.close()
+        try:
+            fs.mkdir(PACK_DIR)
+        except IOError:
+            pass
+        self.fs = fs
+        self.name = f"pack-{uuid4().hex}"
+        # The lease keeps compaction away from a pack as long as its writer may append to it.
+        fs.open(f"{PACK_DIR}/{self.name}.lease", "wb").close()
+        self.pack = fs.open(f"{PACK_DIR}/{self.name}.pack", "wb")
+        self.index = fs.open(f"{PACK_DIR}/{self.name}.idx", "wb")
+        self.size = 0
+
+    def close(self):
+        for f in (self.pack, self.index):
+            if f is not None:
+                try:
+                    f.close()
+                except IOError as e:
+                    logger.warning(f"Failed to close {self.name}: {e}")
+        if self.name is not None:
+            try:
+                self.fs.remove(f"{PACK_DIR}/{self.name}.lease")
+            except IOError as e:
+                logger.warning(f"Failed to release {self.name}: {e}")
+        self.fs = self.name = self.pack = self.index = None
+
+    @staticmethod
+    def write(f, data):
+        if len(data) > getattr(f, "MAX_REQUEST_SIZE", len(data)):
+            # Everything but the last byte is pipelined, and the last write waits for all of them.
+            f.set_pipelined(True)
+            f.write(data[:-1])
+            f.flush()
+            f.set_pipelined(False)
+            data = data[-1:]
+        f.write(data)
+        f.flush()
+
+    def commit(self, fs, objects):
+        data = b"".join(content for _, content in objects)
+        # A pack left idle may be compacted once its lease looks stale, so it is never appended to again.
+        if self.name is None or self.size + len(data) > self.pack_size \
+                or monotonic() - self.written_at >= self.idle_timeout:
+            self.open(fs)
+        entries = {}
+        lines = []
+        offset = self.size
+        for oid, content in objects:
+            entries[oid] = (self.name, offset, len(content))
+            lines.append(f"{oid} {offset} {len(content)}\n")
+            offset += len(content)
+        try:
+            # Objects only become visible once their data is stored, so the index is written last.
+            self.write(self.pack, data)
+            self.write(self.index, "".join(lines).encode())
+        except Exception:
+            self.close()
+            raise
+        self.size = offset
+        self.written_at = monotonic()
+        return entries
+
+
+class PackStore:
+
+    def __init__(self, threshold=None, pack_size=PACK_SIZE):
+        self.threshold = threshold
+        self.writer = PackWriter(pack_size)
+        self.entries = None
+        self.loaded_at = 0
+        self.queue = []
+        self.committing = False
+        self.condition = Condition()
+
+    def packed(self, size):
+        return bool(self.threshold) and size < self.threshold
+
+    def load(self, fs):
+        entries = {}
+        try:
+            names = fs.listdir(PACK_DIR)
+        except IOError:
+            names = []
+        for name in sorted(names):
+            if name.endswith(".idx"):
+                try:
+                    entries.update(read_index(fs, name[:-4]))
+                except IOError as e:
+                    logger.warning(f"Failed to read {name}: {e}")
+        logger.info(f"{len(entries)} packed objects were found.")
+        return entries
+
+    def lookup(self, fs, oid, max_age=None):
+        with self.condition:
+            if self.entries is None or oid not in self.entries and max_age is not None \
+                    and monotonic() - self.loaded_at >= max_age:
+                self.entries = self.load(fs)
+                self.loaded_at = monotonic()
+            return self.entries.get(oid)
+
+    def read(self, fs, oid):
+        for retry in (True, False):
+            entry = self.lookup(fs, oid)
+            if entry is None:
+                raise IOError(f"{oid} is not in any pack.")
+            name, offset, length = entry
+            try:
+                with fs.open(f"{PACK_DIR}/{name}.pack", "rb") as f:
+                    data = read_range(f, offset, length)
+                if len(data) == length:
+                    return data
+                raise IOError(f"{name}.pack is shorter than expected.")
+            except IOError as e:
+                if not retry:
+                    raise
+                # The pack may have been compacted away since the index was loaded.
+                logger.info(f"Reload the pack index after {e}")
+                with self.condition:
+                    self.entries = None
+
+    def append(self, fs, oid, data):
+        # Concurrent appends are grouped so that a batch costs the same round trips as one object.
+        item = {"oid": oid, "data": data, "done": False, "error": None}
+        with self.condition:
+            self.queue.append(item)
+            while not item["done"]:
+                if self.committing:
+                    self.condition.wait()
+                    continue
+                batch, self.queue = self.queue, []
+                self.committing = True
+                self.condition.release()
+                try:
+                    entries = self.writer.commit(fs, [(i["oid"], i["data"]) for i in batch])
+                    error = None
+                except Exception as e:
+                    entries = {}
+                    error = e
+                finally:
+                    self.condition.acquire()
+                self.committing = False
+                if self.entries is not None:
+                    self.entries.update(entries)
+                for i in batch:
+                    i["done"] = True
+                    i["error"] = error
+                self.condition.notify_all()
+        if item["error"] is not None:
+            raise item["error"]
+
+    def close(self):
+        with self.condition:
+            while self.committing:
+                self.condition.wait()
+            self.writer.close()
+
+    def compact(self, fs, min_age=3600):
+        now = time()
+        try:
+            names = fs.listdir(PACK_DIR)
+        except IOError:
+            logger.info("There are no packs.")
+            return 0
+        def age(name):
+            return now - fs.stat(f"{PACK_DIR}/{name}").st_mtime
+
+        # A leased pack is only taken over once its index went untouched for longer than a live writer allows.
+        idle = [name[:-4] for name in names if name.endswith(".idx") and age(name) >= min_age
+                and (f"{name[:-4]}.lease" not in names or age(name) >= LEASE_TTL)]
+        orphans = [name for name in names if name.endswith(".pack") and f"{name[:-5]}.idx" not in names
+                   and age(name) >= max(min_age, LEASE_TTL if f"{name[:-5]}.lease" in names else 0)]
+        orphans += [name for name in names if name.endswith(".lease") and f"{name[:-6]}.pack" not in names
+                    and age(name) >= LEASE_TTL]
+        for name in orphans:
+            logger.info(f"Remove {name} which has no index.")
+            fs.remove(f"{PACK_DIR}/{name}")
+        if len(idle) < 2:
+            logger.info(f"{len(idle)} idle packs. Nothing to compact.")
+            return 0
+        entries = {}
+        for name in sorted(idle):
+            entries.update(read_index(fs, name))
+        by_pack = {}
+        for oid, (name, offset, length) in entries.items():
+            by_pack.setdefault(name, []).append((offset, length, oid))
+        writer = PackWriter(self.writer.pack_size)
+        written = 0
+        try:
+            for name, ranges in sorted(by_pack.items()):
+                objects = []
+                with fs.open(f"{PACK_DIR}/{name}.pack", "rb") as f:
+                    for offset, length, oid in sorted(ranges):
+                        data = read_range(f, offset, length)
+                        if hashlib.sha256(data).hexdigest() != oid:
+                            logger.warning(f"{oid} in {name}.pack is corrupted. Drop it.")
+                            continue
+                        objects.append((oid, data))
+                if objects:
+                    writer.commit(fs, objects)
+                    written += len(objects)
+        finally:
+            writer.close()
+        for name in idle:
+            fs.remove(f"{PACK_DIR}/{name}.idx")
+        for name in idle:
+            fs.remove(f"{PACK_DIR}/{name}.pack")
+            if f"{name}.lease" in names:
+                fs.remove(f"{PACK_DIR}/{name}.lease")
+        logger.info(f"{written} objects in {len(idle)} packs were rewritten.")
+        return written
@@ -0,0 +1,37 @@
+import hashlib
+import os
+from bisect import bisect
+
+VNODES = 128
+
+
+class Ring:
+    """Consistent hashing of oids onto storage roots."""
+
+    def __init__(self, roots, vnodes=VNODES):
+        self.roots = list(roots)
+        points = sorted((self.point(f"{os.path.normpath(root)}#{i}"), root)
+                        for root in self.roots for i in range(vnodes))
+        self.points = [point for point, _ in points]
+        self.owners = [root for _, root in points]
+
+    @staticmethod
+    def point(key):
+        return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+    def order(self, oid):
+        # The owner comes first, then the roots that would take over its share, where reads fall back.
+        if len(self.roots) == 1:
+            return self.roots
+        start = bisect(self.points, self.point(oid))
+        roots = []
+        for i in range(len(self.owners)):
+            root = self.owners[(start + i) % len(self.owners)]
+            if root not in roots:
+                roots.append(root)
+                if len(roots) == len(self.roots):
+                    break
+        return roots
+
+    def root_of(self, oid):
+        return self.order(oid)[0]
@@ -0,0 +1,160 @@
+import json
+import os
+import shlex
+import shutil
+import sys
+from contextlib import redirect_stdout
+from logging import getLogger
+from tempfile import TemporaryFile
+
+from git.exc import GitCommandError
+from git.repo import Repo
+
+from .cli import agent_from_args
+from .integrity import sha256_file
+
+logger = getLogger(__name__)
+
+POINTER_VERSION = b"version https://git-lfs.github.com/spec/v1"
+POINTER_MAX_SIZE = 1024
+
+
+def parse_pointer(data):
+    if not data.startswith(POINTER_VERSION):
+        return None
+    fields = dict(line.split(b" ", 1) for line in data.splitlines() if b" " in line)
+    try:
+        oid = fields[b"oid"].decode()
+        size = int(fields[b"size"])
+    except (KeyError, ValueError):
+        return None
+    if not oid.startswith("sha256:"):
+        return None
+    return oid[len("sha256:"):], size
+
+
+def pointers(repo, rev):
+    commits = repo.git.rev_list(rev) if ".." in rev else repo.git.rev_parse(rev)
+    # Git lists each object of the commits once, skipping subtrees it has seen, and leaves out larger blobs.
+    with TemporaryFile() as f:
+        f.write(commits.encode())
+        f.seek(0)
+        listing = repo.git.rev_list("--objects", "--no-walk", "--stdin",
+                                    f"--filter=blob:limit={POINTER_MAX_SIZE + 1}", istream=f)
+    objects = {}
+    for line in listing.splitlines():
+        hexsha, _, path = line.partition(" ")
+        if not path:
+            continue
+        binsha = bytes.fromhex(hexsha)
+        info = repo.odb.info(binsha)
+        if info.type != b"blob" or info.size > POINTER_MAX_SIZE:
+            continue
+        pointer = parse_pointer(repo.odb.stream(binsha).read())
+        if pointer is not None:
+            objects[pointer[0]] = pointer[1]
+    return objects
+
+
+class Events:
+
+    def __init__(self):
+        self.buffer = ""
+        self.completed = {}
+        self.errors = {}
+
+    def write(self, s):
+        self.buffer += s
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            event = json.loads(line) if line else {}
+            if event.get("event") != "complete":
+                continue
+            if "error" in event:
+                self.errors[event["oid"]] = event["error"]["message"]
+            else:
+                self.completed[event["oid"]] = event["path"]
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+class Prefetch:
+
+    def __init__(self, oids, rev, repo, concurrency, **kwargs):
+        self.oids = oids
+        self.rev = rev
+        self.repo = Repo(repo, search_parent_directories=True)
+        self.concurrency = concurrency
+        self.storage = self.lfs_storage()
+
+    def lfs_storage(self):
+        # Linked worktrees share the objects of the main repository, where git-lfs keeps them too.
+        try:
+            storage = self.repo.git.config("--get", "lfs.storage")
+        except GitCommandError:
+            storage = "lfs"
+        return os.path.join(self.repo.common_dir, os.path.expanduser(storage))
+
+    def store_path(self, oid):
+        return os.path.join(self.storage, "objects", oid[0:2], oid[2:4], oid)
+
+    def present(self, oid, size):
+        try:
+            if size is None:
+                # Without a size, only a stored file of the right content counts.
+                return sha256_file(self.store_path(oid)).hexdigest() == oid
+            return os.path.getsize(self.store_path(oid)) == size
+        except OSError:
+            return False
+
+    def objects(self):
+        if not self.oids:
+            return pointers(self.repo, self.rev)
+        objects = {}
+        for oid in self.oids:
+            oid, _, size = oid.partition(":")
+            objects[oid] = int(size) if size else None
+        return objects
+
+    def agent(self):
+        args = self.repo.git.config("--get", "lfs.customtransfer.pyelfs.args")
+        return agent_from_args(shlex.split(args))
+
+    def requests(self, missing):
+        yield json.dumps({"event": "init", "operation": "download", "remote": "origin",
+                          "concurrent": True, "concurrenttransfers": self.concurrency})
+        for oid, size in missing.items():
+            # Agents look up the size of an object requested without it.
+            yield json.dumps({"event": "download", "oid": oid, "size": size or 0, "action": None})
+        yield json.dumps({"event": "terminate"})
+
+    def main_proc(self, stream):
+        objects = self.objects()
+        missing = dict((oid, size) for oid, size in objects.items() if not self.present(oid, size))
+        logger.info(f"{len(missing)} of {len(objects)} objects are missing.")
+        events = Events()
+        if missing:
+            with redirect_stdout(events):
+                self.agent().main_proc(self.requests(missing))
+        for oid, path in events.completed.items():
+            os.makedirs(os.path.dirname(self.store_path(oid)), exist_ok=True)
+            shutil.move(path, self.store_path(oid))
+        for oid, message in events.errors.items():
+            print(f"{oid}: {message}")
+        print(f"{len(events.completed)} objects were fetched, {len(objects) - len(missing)} were present "
+              f"and {len(missing) - len(events.completed)} failed.")
+        if len(events.completed) < len(missing):
+            sys.exit(1)
+
+    @classmethod
+    def add_argument(cls, parser):
+        parser.add_argument("oids", nargs="*",
+                            help="objects to fetch as oid or oid:size. "
+                                 "Without them, objects referenced by --rev are fetched.")
+        parser.add_argument("--rev", default="HEAD",
+                            help="revision, or range like v1.0..HEAD to cover every commit in it.")
+        parser.add_argument("--repo", default=".", help="path in the git repository.")
+        parser.add_argument("--concurrency", type=int, default=8, help="objects fetched at once.")
+        parser.add_argument("--verbose", help="verbose log")
@@ -0,0 +1,59 @@
+from logging import getLogger
+from threading import Lock
+from time import monotonic
+
+from .metrics import transfer_metrics
+from .protocol import progress
+from .util import current_writer
+
+logger = getLogger(__name__)
+
+
+class Progress:
+    interval = 0.5
+    min_step = 1 << 20
+    max_steps = 100
+
+    def __init__(self, oid, size, writer=None):
+        self.oid = oid
+        self.size = size
+        self.writer = writer or current_writer()
+        self.step = max(size // self.max_steps, self.min_step)
+        self.byte_so_far = 0
+        self.reported = 0
+        self.reported_at = monotonic()
+        self.lock = Lock()
+        self.record = transfer_metrics.current()
+
+    def progress_callback(self, byte_so_far, size=None):
+        with self.lock:
+            self.byte_so_far = byte_so_far
+            self.count()
+            self.report()
+
+    def add(self, n):
+        with self.lock:
+            self.byte_so_far += n
+            self.count()
+            self.report()
+
+    def skip(self):
+        with self.lock:
+            self.byte_so_far = self.size
+            self.report()
+
+    def count(self):
+        if self.record is not None:
+            self.record.bytes = self.byte_so_far
+
+    def report(self):
+        bytes_since_last = self.byte_so_far - self.reported
+        if bytes_since_last <= 0:
+            return
+        now = monotonic()
+        if bytes_since_last < self.step and now - self.reported_at < self.interval \
+                and self.byte_so_far < self.size:
+            return
+        self.reported = self.byte_so_far
+        self.reported_at = now
+        self.writer.write(progress(self.oid, self.byte_so_far, bytes_since_last), flush=False)
@@ -0,0 +1,49 @@
+import json
+from logging import DEBUG, getLogger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = getLogger(__name__)
+
+INIT = "{}"
+TERMINATE = '{"event": "terminate"}'
+COMPLETE = '{"event": "complete", "oid": "%s"}'
+COMPLETE_PATH = '{"event": "complete", "oid": "%s", "path": %s}'
+PROGRESS = '{"event": "progress", "oid": "%s", "byteSoFar": %d, "bytesSinceLast": %d}'
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+else:
+    loads = json.loads
+    dumps = json.dumps
+
+
+def complete(oid, path=None):
+    # Oids are hex digests, so only paths need escaping.
+    if path is None:
+        return COMPLETE % oid
+    return COMPLETE_PATH % (oid, dumps(path))
+
+
+def progress(oid, byte_so_far, bytes_since_last):
+    return PROGRESS % (oid, byte_so_far, bytes_since_last)
+
+
+def events(stream):
+    debug = logger.isEnabledFor(DEBUG)
+    for line in stream:
+        if debug:
+            logger.debug(line)
+        try:
+            data = loads(line)
+        except ValueError as e:
+            if debug:
+                logger.debug(e)
+            continue
+        yield data
@@ -0,0 +1,153 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from logging import getLogger
+from threading import Lock
+from time import monotonic
+from urllib.parse import urlsplit
+
+from .progress import Progress
+from .protocol import complete, INIT, TERMINATE
+
+logger = getLogger(__name__)
+
+ROUND_TRIPS = 4
+MIN_SAMPLE = 1 << 20
+SMOOTHING = 0.3
+
+
+def endpoint(url, user, port, remote):
+    parts = urlsplit(url if "://" in url else f"sftp://{url}")
+    return parts.username or user, parts.hostname, parts.port or port, parts.path or remote
+
+
+class NullWriter:
+
+    def write(self, res, flush=True):
+        pass
+
+
+class Replicas:
+
+    def __init__(self, agents, quorum=None, workers=8):
+        self.agents = agents
+        self.quorum = min(max(quorum or len(agents) // 2 + 1, 1), len(agents))
+        # Replicas finish uploads at different times, so only the quorum is reported to git-lfs.
+        for agent in agents:
+            agent.upload_writer = NullWriter()
+        self.workers = workers
+        self.executor = None
+        self.executor_lock = Lock()
+        self.stragglers = set()
+        self.latency = None
+        self.throughput = {}
+        self.lock = Lock()
+
+    def run(self, func, *args):
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers * len(self.agents))
+            return self.executor.submit(func, *args)
+
+    def init(self, event, operation, remote, concurrent, concurrenttransfers):
+        for agent in self.agents:
+            list(agent.init(event, operation, remote, concurrent, concurrenttransfers))
+        self.workers = sum(self.agents[0].lanes(concurrent, concurrenttransfers))
+        yield INIT
+
+    def prepare(self, batch):
+        for future in [self.run(agent.prepare, batch) for agent in self.agents]:
+            future.result()
+
+    def upload(self, event, oid, size, path, action):
+        pending = set(self.run(list, agent.upload(event, oid, size, path, action)) for agent in self.agents)
+        stored = 0
+        errors = []
+        while pending and stored < self.quorum:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    stored += 1
+                else:
+                    errors.append(future.exception())
+        for future in pending:
+            with self.lock:
+                self.stragglers.add(future)
+            future.add_done_callback(lambda f: self.straggled(oid, f))
+        if stored < self.quorum:
+            logger.error(f"{oid} reached {stored} of {self.quorum} replicas: {errors}")
+            raise errors[0]
+        Progress(oid, size).skip()
+        yield complete(oid)
+
+    def straggled(self, oid, future):
+        with self.lock:
+            self.stragglers.discard(future)
+        if future.exception() is not None:
+            logger.warning(f"A replica missed {oid} after the quorum: {future.exception()}")
+
+    def probe(self, agent):
+        started = monotonic()
+        try:
+            with agent.open_pool().connection() as sftp:
+                sftp.stat(".")
+        except Exception as e:
+            logger.warning(f"{agent.hostname} is unreachable: {e}")
+            return float("inf")
+        return monotonic() - started
+
+    def ranked(self, size):
+        with self.lock:
+            if self.latency is None:
+                # Replicas are probed once per run and side by side.
+                with ThreadPoolExecutor(len(self.agents)) as executor:
+                    self.latency = dict(zip(self.agents, executor.map(self.probe, self.agents)))
+                logger.info("Replica latencies: " + ", ".join(
+                    f"{agent.hostname}={latency:.3f}s" for agent, latency in self.latency.items()))
+            latency = dict(self.latency)
+            throughput = dict(self.throughput)
+
+        # Small objects go to the nearest replica and large ones to the fastest.
+        # An unmeasured replica looks fast, so it gets measured.
+        def estimate(agent):
+            return latency[agent] * ROUND_TRIPS + (size / throughput[agent] if agent in throughput else 0)
+
+        return sorted(self.agents, key=estimate)
+
+    def measured(self, agent, size, duration):
+        if size < MIN_SAMPLE or duration <= 0:
+            return
+        with self.lock:
+            previous = self.throughput.get(agent)
+            sample = size / duration
+            self.throughput[agent] = sample if previous is None else previous + SMOOTHING * (sample - previous)
+
+    def download(self, event, oid, size, action):
+        error = None
+        for agent in self.ranked(size):
+            started = monotonic()
+            try:
+                res = list(agent.download(event, oid, size, action))
+            except Exception as e:
+                logger.warning(f"Failed to download {oid} from {agent.hostname}: {e}")
+                error = e
+                continue
+            self.measured(agent, size, monotonic() - started)
+            yield from res
+            return
+        raise error
+
+    def terminate(self):
+        with self.lock:
+            stragglers = list(self.stragglers)
+        wait(stragglers)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        for agent in self.agents:
+            list(agent.terminate())
+        yield TERMINATE
+
+    def checkpoint(self):
+        for agent in self.agents:
+            agent.checkpoint()
+
+    def compact(self, min_age):
+        return sum(agent.compact(min_age) for agent in self.agents)
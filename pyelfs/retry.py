@@ -0,0 +1,29 @@
+import errno
+import socket
+from logging import getLogger
+from random import uniform
+
+logger = getLogger(__name__)
+
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, EOFError, socket.timeout)
+TRANSIENT_ERRNOS = {errno.ECONNRESET, errno.ECONNABORTED, errno.ECONNREFUSED, errno.EPIPE, errno.ETIMEDOUT,
+                    errno.EHOSTUNREACH, errno.ENETUNREACH, errno.ENETDOWN, errno.EAGAIN, errno.ESTALE}
+
+
+def transient(e, errors=TRANSIENT_ERRORS):
+    # Missing objects, permissions and hash mismatches fail the same way on every attempt.
+    if isinstance(e, errors):
+        return True
+    return isinstance(e, OSError) and e.errno in TRANSIENT_ERRNOS
+
+
+class RetryPolicy:
+
+    def __init__(self, retries=3, delay=0.5, max_delay=10.0):
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt):
+        # Full jitter keeps workers that failed together from retrying in lockstep.
+        return uniform(0, min(self.max_delay, self.delay * 2 ** attempt))
@@ -0,0 +1,116 @@
+from collections import deque
+from itertools import chain
+from logging import getLogger
+from threading import Condition
+
+logger = getLogger(__name__)
+
+SMALL = "small"
+LARGE = "large"
+
+
+class Scheduler:
+    window = 256
+    batch_size = 64
+
+    def __init__(self, executor, transfer, small_workers, large_streams=0, small_size=None,
+                 max_bytes=None, prepare=None):
+        self.executor = executor
+        self.transfer = transfer
+        self.prepare = prepare
+        self.widths = {SMALL: small_workers, LARGE: large_streams}
+        self.running = {SMALL: 0, LARGE: 0}
+        self.small_size = small_size
+        self.max_bytes = max_bytes
+        self.pending = {SMALL: deque(), LARGE: deque()}
+        self.prepared = set()
+        self.bytes = 0
+        self.condition = Condition()
+
+    @property
+    def objects(self):
+        return self.running[SMALL] + self.running[LARGE]
+
+    @staticmethod
+    def size_of(data):
+        return int(data.get("size") or 0)
+
+    def lane_of(self, data):
+        if self.small_size is None or self.size_of(data) < self.small_size:
+            return SMALL
+        return LARGE
+
+    def fits(self, lane, size):
+        if self.running[lane] >= self.widths[lane]:
+            return False
+        # An object over the byte budget still runs once nothing else is in flight.
+        return self.max_bytes is None or self.objects == 0 or self.bytes + size <= self.max_bytes
+
+    def batch(self, data, waiting):
+        # The first small object admitted prepares the ones queued behind it, so they share shard lookups.
+        if self.prepare is None or self.lane_of(data) != SMALL or data.get("oid") in self.prepared:
+            return None
+        batch = [data]
+        for other, _ in chain(waiting, self.pending[SMALL]):
+            if len(batch) >= self.batch_size:
+                break
+            if other["event"] == data["event"] and self.lane_of(other) == SMALL \
+                    and other.get("oid") not in self.prepared:
+                batch.append(other)
+        self.prepared.update(d.get("oid") for d in batch)
+        return batch
+
+    def admit(self):
+        # Lanes are queued apart, so a full lane is never scanned for every event.
+        ready = []
+        for lane, pending in self.pending.items():
+            waiting = deque()
+            while pending and self.running[lane] < self.widths[lane]:
+                data, record = pending.popleft()
+                size = self.size_of(data)
+                if self.fits(lane, size):
+                    self.running[lane] += 1
+                    self.bytes += size
+                    ready.append((data, record, self.batch(data, waiting)))
+                else:
+                    waiting.append((data, record))
+            waiting.extend(pending)
+            self.pending[lane] = waiting
+        return ready
+
+    def start(self, ready):
+        for data, record, batch in ready:
+            self.executor.submit(self.run, data, record, batch)
+
+    def run(self, data, record, batch):
+        try:
+            if batch is not None and len(batch) > 1:
+                try:
+                    self.prepare(batch)
+                except Exception as e:
+                    logger.warning(f"Failed to prepare {len(batch)} objects: {e}")
+            self.transfer(data, record)
+        finally:
+            self.done(data)
+
+    def put(self, data, record=None):
+        with self.condition:
+            while len(self.pending[SMALL]) + len(self.pending[LARGE]) >= self.window:
+                self.condition.wait()
+            self.pending[self.lane_of(data)].append((data, record))
+            ready = self.admit()
+        self.start(ready)
+
+    def done(self, data):
+        with self.condition:
+            self.running[self.lane_of(data)] -= 1
+            self.bytes -= self.size_of(data)
+            self.prepared.discard(data.get("oid"))
+            ready = self.admit()
+            self.condition.notify_all()
+        self.start(ready)
+
+    def drain(self):
+        with self.condition:
+            while self.pending[SMALL] or self.pending[LARGE] or self.objects:
+                self.condition.wait()
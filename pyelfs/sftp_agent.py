@@ -1,107 +1,606 @@
-import json
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from getpass import getuser
 from logging import getLogger
 from os.path import expanduser
-from random import random
-from time import sleep
-from tempfile import gettempdir
+from queue import Queue
+from threading import Lock
+from tempfile import gettempdir, mkstemp
+from time import monotonic, time
+from uuid import uuid4
+
+from paramiko import AuthenticationException, BadHostKeyException, SSHException
 
 from . import CustomTransferAgent
-from .sftp_auth import SftpAuth
-from .util import ERROR_CODE, handle_error, Progress, stage_logger
+from .compression import compressible, compressor, decompressor, extension_of, EXTENSIONS, MODES
+from .integrity import AtomicDownload, CHUNK_SIZE, HashCache, IntegrityError, ResumableDownload, sha256_file
+from .metrics import transfer_metrics
+from .object_cache import ObjectCache
+from .pack import PACK_SIZE, PackStore, RELOAD_AFTER
+from .sftp_auth import SftpPool
+from .sftp_index import RELIST_AFTER, RemoteIndex, shard_of
+from .protocol import complete, INIT, TERMINATE
+from .progress import Progress
+from .replication import endpoint, Replicas
+from .retry import TRANSIENT_ERRORS
+from .util import ERROR_CODE, handle_error, stage_logger
 
 logger = getLogger(__name__)
 
+# A writer refreshes the lock of a shared partial file this often, and a lock this much older is of a dead one.
+LOCK_REFRESH = 60
+LOCK_TTL = 600
+# Chunks read ahead for each session of a segmented upload.
+SEGMENT_QUEUE = 4
+
 
 class SftpAgent(CustomTransferAgent):
+    transient_errors = TRANSIENT_ERRORS + (SSHException,)
+    upload_writer = None
 
-    def __init__(self, user, hostname, port, rsa_key, lfs_storage_remote, temp, **kwargs):
+    def __init__(self, user, hostname, port, rsa_key, lfs_storage_remote, temp,
+                 channels=1, window_size=None, max_packet_size=None, prefetch_requests=None,
+                 index_cache=None, index_ttl=3600, resume_threshold=8 << 20,
+                 segments=1, segment_threshold=256 << 20, cache_dir=None, cache_size=None,
+                 pack_threshold=None, pack_size=PACK_SIZE, compression=None,
+                 replicas=None, write_quorum=None, **kwargs):
+        options = dict(channels=channels, window_size=window_size, max_packet_size=max_packet_size,
+                       prefetch_requests=prefetch_requests, index_cache=index_cache, index_ttl=index_ttl,
+                       resume_threshold=resume_threshold, segments=segments, segment_threshold=segment_threshold,
+                       cache_dir=cache_dir, cache_size=cache_size, pack_threshold=pack_threshold,
+                       pack_size=pack_size, compression=compression, **kwargs)
         self.user = user
         self.hostname = hostname
         self.port = port
         self.rsa_key = rsa_key
         self.lfs_storage_remote = lfs_storage_remote
         self.temp = temp
-        logger.info("Wait a little to avoid pipe broken")
-        sleep(random())
+        self.channels = channels
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.prefetch_requests = prefetch_requests
+        self.resume_threshold = resume_threshold
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.schedule(**kwargs)
+        self.pool = None
+        self.pool_size = 1
+        self.prepare_lock = Lock()
+        self.pack_session = None
+        self.pack_lock = Lock()
+        self.hashes = HashCache()
+        self.packs = PackStore(pack_threshold, pack_size)
+        self.extension = extension_of(compression)
+        self.cache = None
+        self.index = None
+        self.replicas = None
+        if replicas:
+            # Every endpoint gets an agent of its own, the first being the one of --hostname.
+            endpoints = [(user, hostname, port, lfs_storage_remote)]
+            endpoints += [endpoint(url, user, port, lfs_storage_remote) for url in replicas.split(",") if url]
+            if options.get("index_cache"):
+                options["index_cache"] = None
+                logger.warning("The index cache is not shared among replicas. Ignore it.")
+            self.replicas = Replicas([SftpAgent(*e[:4], rsa_key, temp, **options) for e in endpoints],
+                                     write_quorum)
+            logger.info(f"Objects are replicated to {len(endpoints)} endpoints, "
+                        f"{self.replicas.quorum} of which must store an upload.")
+        else:
+            # With replicas, objects are listed and cached by the agent of each endpoint.
+            self.cache = ObjectCache(cache_dir, cache_size) if cache_dir else None
+            self.index = RemoteIndex(f"{user}@{hostname}:{port}{lfs_storage_remote}", index_cache, index_ttl)
         logger.info("SftpAgent is initialized")
 
     @stage_logger("Init Stage")
     def init(self, event, operation, remote, concurrent, concurrenttransfers):
-        yield "{}"
+        if self.replicas is not None:
+            yield from self.replicas.init(event, operation, remote, concurrent, concurrenttransfers)
+            return
+        self.pool_size = sum(self.lanes(concurrent, concurrenttransfers))
+        self.open_pool()
+        yield INIT
+
+    def open_pool(self):
+        if self.pool is None:
+            self.pool = SftpPool(self.user, self.hostname, self.port,
+                                 self.rsa_key, self.lfs_storage_remote,
+                                 self.pool_size + self.segments - 1 + bool(self.packs.threshold),
+                                 channels=self.channels,
+                                 window_size=self.window_size,
+                                 max_packet_size=self.max_packet_size)
+        return self.pool
+
+    @contextmanager
+    def pack_connection(self):
+        # Packs are written through open handles, which belong to a session of their own.
+        # Packed uploads take no other connection, as several clients of a daemon share the pool.
+        with self.pack_lock:
+            if self.pack_session is None:
+                self.pack_session = self.open_pool().acquire()
+            session = self.pack_session
+        try:
+            yield session[1]
+        except Exception:
+            with self.pack_lock:
+                if self.pack_session is session:
+                    self.pack_session = None
+                    self.pool.discard(session)
+            raise
+
+    @stage_logger("Terminate Stage")
+    def terminate(self):
+        if self.replicas is not None:
+            yield from self.replicas.terminate()
+            return
+        self.checkpoint()
+        if self.pack_session is not None:
+            self.pool.release(self.pack_session)
+            self.pack_session = None
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        yield TERMINATE
+
+    def checkpoint(self):
+        if self.replicas is not None:
+            return self.replicas.checkpoint()
+        self.packs.close()
+        self.index.save()
+        if self.cache is not None:
+            self.cache.evict()
+
+    def transient(self, e):
+        # A rejected key or host key fails the same way on every handshake.
+        if isinstance(e, (AuthenticationException, BadHostKeyException)):
+            return False
+        # A channel closed under a transfer raises a bare OSError, which server status codes never do.
+        return super().transient(e) or (type(e) in (OSError, IOError) and str(e) == "Socket is closed")
+
+    def prepare(self, batch):
+        if self.replicas is not None:
+            return self.replicas.prepare(batch)
+        oids = [data["oid"] for data in batch if data["event"] == "upload" and not self.packs.packed(data["size"])]
+        if not oids:
+            return
+        with self.prepare_lock, self.open_pool().connection() as sftp:
+            self.index.prepare(sftp, oids)
+        logger.info(f"Shards of {len(oids)} objects were prepared at once.")
 
     @stage_logger("Upload Stage")
     def upload(self, event, oid, size, path, action):
-        with SftpAuth(self.user, self.hostname, self.port,
-                      self.rsa_key, self.lfs_storage_remote) as sftp:
-            progress = Progress(oid)
+        if self.replicas is not None:
+            yield from self.replicas.upload(event, oid, size, path, action)
+            return
+        remote_path = f"{shard_of(oid)}/{oid}"
+        with self.pack_connection() if self.packs.packed(size) else self.open_pool().connection() as sftp:
+            progress = Progress(oid, size, self.upload_writer)
             try:
-                sftp.chdir(oid[0:2])
-            except IOError:
-                sftp.mkdir(oid[0:2])
-                sftp.chdir(oid[0:2])
+                logger.info("Check existence of the same file.")
+                if self.packs.packed(size):
+                    # Listing loose shards costs a round trip per object, so a loose copy may be packed again.
+                    entry = self.packs.lookup(sftp, oid)
+                    target_size = entry and entry[2]
+                else:
+                    target_size = self.index.lookup(sftp, oid)
+                    if target_size is None and self.compressed_name(sftp, oid) is not None:
+                        target_size = size
             except Exception as e:
                 handle_error(e, ERROR_CODE.UPLOAD)
+            if size == target_size:
+                logger.info("A same file exists. Skip upload.")
+                progress.skip()
+            else:
+                logger.info("A same file doesn't exist. Start upload.")
+                stored = oid, size
+                try:
+                    if self.packs.packed(size):
+                        with open(path, "rb") as f:
+                            self.packs.append(sftp, oid, f.read())
+                        progress.progress_callback(size)
+                    elif self.segmented(size):
+                        with self.pool.connections(self.segments - 1, block=False) as extra:
+                            self.put_segmented([sftp] + extra, oid, size, path, remote_path, progress)
+                    elif self.extension is not None and compressible(path, size):
+                        stored = self.put_compressed(sftp, oid, size, path, progress.progress_callback)
+                    elif size >= self.resume_threshold:
+                        self.put_resumable(sftp, oid, size, path, remote_path, progress.progress_callback)
+                    else:
+                        sftp.put(path, remote_path, callback=progress.progress_callback)
+                except Exception as e:
+                    self.index.discard(oid)
+                    handle_error(e, ERROR_CODE.UPLOAD)
+                self.index.add(*stored)
+        yield complete(oid)
+
+    @staticmethod
+    def put_resumable(sftp, oid, size, path, remote_path, callback):
+        partial = f"{remote_path}.partial"
+        lock = SftpAgent.claim(sftp, partial)
+        if lock is None:
+            # Another agent resumes the shared partial file, so this one starts over in a file of its own.
+            logger.info(f"{partial} is being written by another agent.")
+            partial = f"{remote_path}.partial-{uuid4().hex}"
+        try:
             try:
-                sftp.chdir(oid[2:4])
-            except IOError as e:
-                sftp.mkdir(oid[2:4])
-                sftp.chdir(oid[2:4])
-            except Exception as e:
-                handle_error(e, ERROR_CODE.UPLOAD)
+                offset = sftp.stat(partial).st_size if lock is not None else 0
+            except IOError:
+                offset = 0
+            if offset > size:
+                offset = 0
+            sha = sha256_file(path, offset)
+            if offset and SftpAgent.remote_digest(sftp, partial, offset) != sha.digest():
+                logger.warning(f"{partial} doesn't match the local object. Start over.")
+                offset = 0
+                sha = hashlib.sha256()
+            if offset:
+                logger.info(f"Resume {partial} from {offset} bytes.")
+            refreshed = monotonic()
+            with open(path, "rb") as fl, sftp.open(partial, "r+" if offset else "w") as fr:
+                fr.set_pipelined(True)
+                fl.seek(offset)
+                fr.seek(offset)
+                for chunk in iter(lambda: fl.read(CHUNK_SIZE), b""):
+                    sha.update(chunk)
+                    fr.write(chunk)
+                    offset += len(chunk)
+                    callback(offset, size)
+                    if lock is not None and monotonic() - refreshed >= LOCK_REFRESH:
+                        sftp.utime(lock, None)
+                        refreshed = monotonic()
+            if sha.hexdigest() != oid or sftp.stat(partial).st_size != size:
+                sftp.remove(partial)
+                raise IntegrityError(f"The uploaded object doesn't match {oid}.")
+            SftpAgent.rename(sftp, partial, remote_path)
+        except Exception:
+            if lock is None:
+                try:
+                    sftp.remove(partial)
+                except IOError:
+                    pass
+            raise
+        finally:
+            if lock is not None:
+                try:
+                    sftp.remove(lock)
+                except IOError as e:
+                    logger.warning(f"Failed to release {lock}: {e}")
 
-            same_file_exists = False
+    @staticmethod
+    def claim(sftp, partial):
+        lock = f"{partial}.lock"
+        for takeover in (True, False):
             try:
-                logger.info("Check existence of the same file.")
-                target_size = sftp.stat(oid).st_size
-                if size == target_size:
-                    same_file_exists = True
-                    logger.info("A same file exists. Skip upload.")
-                    res = json.dumps({
-                        "event": "progress",
-                        "oid": oid,
-                        "byteSoFar": size,
-                        "bytesSinceLast": 0
-                    })
-                    logger.debug(res)
-                    print(res, flush=True)
-                else:
-                    logger.info("A same file doesn't exist (size). Start upload.")
-            except:
-                logger.info("A same file doesn't exist (name). Start upload.")
+                sftp.open(lock, "x").close()
+                return lock
+            except IOError:
+                pass
+            try:
+                stale = time() - sftp.stat(lock).st_mtime >= LOCK_TTL
+            except IOError:
+                stale = True
+            if not (takeover and stale):
+                return None
+            logger.info(f"Take over {lock} of a dead writer.")
+            try:
+                sftp.remove(lock)
+            except IOError:
+                pass
+        return None
+
+    @staticmethod
+    def remote_digest(sftp, remote_path, length):
+        with sftp.open(remote_path, "rb") as fr:
+            try:
+                # Servers with the check-file extension hash the prefix without sending it.
+                return fr.check("sha256", 0, length, 0)
+            except IOError:
+                logger.info(f"Read back {length} bytes of {remote_path} to verify them.")
+            sha = hashlib.sha256()
+            fr.prefetch(length)
+            while length > 0:
+                chunk = fr.read(min(CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                sha.update(chunk)
+                length -= len(chunk)
+            return sha.digest()
+
+    def compressed_name(self, sftp, oid, max_age=None):
+        # With max_age, a miss lists the shard again unless it was listed more recently.
+        for age in (None,) if max_age is None else (None, max_age):
+            entries = self.index.listing(sftp, shard_of(oid), age)
+            for extension in EXTENSIONS:
+                if f"{oid}.{extension}" in entries:
+                    return f"{oid}.{extension}"
+        return None
+
+    def put_compressed(self, sftp, oid, size, path, callback):
+        name = f"{oid}.{self.extension}"
+        # A private partial, as agents pushing the same object at once would write over each other's.
+        partial = f"{shard_of(oid)}/{name}.partial-{uuid4().hex}"
+        c = compressor(self.extension)
+        sha = hashlib.sha256()
+        offset = written = 0
+        try:
+            with open(path, "rb") as fl, sftp.open(partial, "w") as fr:
+                fr.set_pipelined(True)
+                for chunk in iter(lambda: fl.read(CHUNK_SIZE), b""):
+                    sha.update(chunk)
+                    data = c.compress(chunk)
+                    fr.write(data)
+                    written += len(data)
+                    offset += len(chunk)
+                    callback(offset, size)
+                data = c.flush()
+                fr.write(data)
+                written += len(data)
+            if sha.hexdigest() != oid or sftp.stat(partial).st_size != written:
+                raise IntegrityError(f"The uploaded object doesn't match {oid}.")
+        except Exception:
+            try:
+                sftp.remove(partial)
+            except IOError:
+                pass
+            raise
+        self.rename(sftp, partial, f"{shard_of(oid)}/{name}")
+        logger.info(f"{oid} was stored as {name} in {written} bytes.")
+        return name, written
+
+    def get_compressed(self, sftp, oid, name, path, progress):
+        d = decompressor(name.rsplit(".", 1)[1])
+        with sftp.open(f"{shard_of(oid)}/{name}", "rb") as fr, AtomicDownload(path, oid, self.hashes) as f:
+            fr.prefetch()
+            for chunk in iter(lambda: fr.read(CHUNK_SIZE), b""):
+                data = d.decompress(chunk)
+                f.write(data)
+                progress.add(len(data))
+            f.write(d.flush())
+
+    def segmented(self, size):
+        return self.segments > 1 and size >= self.segment_threshold
+
+    @staticmethod
+    def ranges(size, n):
+        step = -(-size // n)
+        step += -step % CHUNK_SIZE
+        return [(start, min(step, size - start)) for start in range(0, size, step)]
+
+    @staticmethod
+    def in_transfer(func):
+        record = transfer_metrics.current()
+
+        def run(*args):
+            with transfer_metrics.attached(record):
+                return func(*args)
+        return run
+
+    @staticmethod
+    def run_segments(func, sessions, ranges):
+        func = SftpAgent.in_transfer(func)
+        with ThreadPoolExecutor(len(sessions)) as executor:
+            futures = [executor.submit(func, sessions[i % len(sessions)], start, length)
+                       for i, (start, length) in enumerate(ranges)]
+            for future in futures:
+                future.result()
+
+    def put_segmented(self, sessions, oid, size, path, remote_path, progress):
+        # A partial file of its own keeps resumable uploads of the same object out of the way.
+        partial = f"{remote_path}.partial-{uuid4().hex}"
+        logger.info(f"Upload {oid} in {len(sessions)} segments.")
+        with sessions[0].open(partial, "w") as fr:
+            fr.truncate(size)
+        queues = [Queue(SEGMENT_QUEUE) for _ in sessions]
+        errors = []
+
+        def put_chunks(sftp, queue):
+            done = False
             try:
-                if not same_file_exists:
-                    sftp.put(path, oid, callback=progress.progress_callback)
+                with sftp.open(partial, "r+") as fr:
+                    fr.set_pipelined(True)
+                    for offset, data in iter(queue.get, None):
+                        fr.seek(offset)
+                        fr.write(data)
+                        progress.add(len(data))
+                    done = True
             except Exception as e:
-                handle_error(e, ERROR_CODE.UPLOAD)
-        yield json.dumps({
-            "event": "complete",
-            "oid": oid,
-        })
+                errors.append(e)
+                # The reader never waits on a queue nobody takes from.
+                while not done:
+                    done = queue.get() is None
+                raise
+
+        sha = hashlib.sha256()
+        try:
+            with ThreadPoolExecutor(len(sessions)) as executor:
+                put = self.in_transfer(put_chunks)
+                futures = [executor.submit(put, sftp, queue) for sftp, queue in zip(sessions, queues)]
+                try:
+                    # Chunks are dealt to the sessions in turn, so the file is read and hashed once, in order.
+                    with open(path, "rb") as f:
+                        for i, chunk in enumerate(iter(lambda: f.read(CHUNK_SIZE), b"")):
+                            if errors:
+                                break
+                            sha.update(chunk)
+                            queues[i % len(queues)].put((i * CHUNK_SIZE, chunk))
+                finally:
+                    for queue in queues:
+                        queue.put(None)
+                for future in futures:
+                    future.result()
+            if sha.hexdigest() != oid or sessions[0].stat(partial).st_size != size:
+                raise IntegrityError(f"The uploaded object doesn't match {oid}.")
+        except Exception:
+            try:
+                sessions[0].remove(partial)
+            except IOError:
+                pass
+            raise
+        self.rename(sessions[0], partial, remote_path)
+
+    def get_segmented(self, sessions, oid, size, remote_path, temp_path, progress):
+        logger.info(f"Download {oid} in {len(sessions)} segments.")
+        fd, partial = mkstemp(dir=os.path.dirname(temp_path) or ".", prefix=f".{oid}.")
+
+        def get_range(sftp, start, length):
+            with sftp.open(remote_path, "rb") as fr:
+                chunks = [(offset, min(CHUNK_SIZE, start + length - offset))
+                          for offset in range(start, start + length, CHUNK_SIZE)]
+                for (offset, _), data in zip(chunks, fr.readv(chunks)):
+                    os.pwrite(fd, data, offset)
+                    progress.add(len(data))
+
+        try:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, size)
+            self.run_segments(get_range, sessions, self.ranges(size, len(sessions)))
+            os.close(fd)
+            fd = None
+            if sha256_file(partial).hexdigest() != oid:
+                raise IntegrityError(f"The downloaded object doesn't match {oid}.")
+            os.replace(partial, temp_path)
+        except Exception:
+            if fd is not None:
+                os.close(fd)
+            os.remove(partial)
+            raise
+        self.hashes.remember(temp_path, oid)
+
+    @staticmethod
+    def rename(sftp, src, dst):
+        try:
+            sftp.posix_rename(src, dst)
+        except IOError:
+            # Only a partial that is still there replaces the destination, which may be another agent's.
+            sftp.stat(src)
+            try:
+                sftp.remove(dst)
+            except IOError:
+                pass
+            sftp.rename(src, dst)
+
+    def getfo(self, sftp, remote_path, f, callback, offset=0, size=None):
+        if offset == 0:
+            if self.prefetch_requests:
+                return sftp.getfo(remote_path, f, callback=callback,
+                                  max_concurrent_prefetch_requests=self.prefetch_requests)
+            return sftp.getfo(remote_path, f, callback=callback)
+        with sftp.open(remote_path, "rb") as fr:
+            fr.seek(offset)
+            if self.prefetch_requests:
+                fr.prefetch(size, self.prefetch_requests)
+            else:
+                fr.prefetch(size)
+            while offset < size:
+                data = fr.read(CHUNK_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                offset += len(data)
+                callback(offset, size)
+        return offset
+
+    def fetch(self, oid, size, path, progress):
+        with self.open_pool().connection() as sftp:
+            if self.fetch_packed(sftp, oid, size, path, progress) \
+                    or self.extension is not None and self.fetch_compressed(sftp, oid, path, progress):
+                return
+        try:
+            self.fetch_loose(oid, size, path, progress)
+        except IOError:
+            # The object may have been stored compressed or packed since the listings were taken,
+            # or compressed by an agent with --compression.
+            with self.open_pool().connection() as sftp:
+                if not (self.fetch_compressed(sftp, oid, path, progress, RELIST_AFTER)
+                        or self.fetch_packed(sftp, oid, size, path, progress, RELOAD_AFTER)):
+                    raise
+
+    def fetch_packed(self, sftp, oid, size, path, progress, max_age=None):
+        if self.packs.lookup(sftp, oid, max_age) is None:
+            return False
+        with AtomicDownload(path, oid, self.hashes) as f:
+            f.write(self.packs.read(sftp, oid))
+        progress.add(size)
+        return True
+
+    def fetch_compressed(self, sftp, oid, path, progress, max_age=None):
+        name = self.compressed_name(sftp, oid, max_age)
+        if name is None:
+            return False
+        self.get_compressed(sftp, oid, name, path, progress)
+        return True
+
+    def fetch_loose(self, oid, size, path, progress):
+        remote_path = f"{shard_of(oid)}/{oid}"
+        if not size:
+            # Objects requested by oid alone, as by prefetch, come without their size.
+            with self.open_pool().connection() as sftp:
+                size = sftp.stat(remote_path).st_size
+        if self.segmented(size):
+            with self.open_pool().connections(self.segments) as sessions:
+                self.get_segmented(sessions, oid, size, remote_path, path, progress)
+            return
+        if size >= self.resume_threshold:
+            transfer = ResumableDownload(path, oid, self.hashes)
+        else:
+            transfer = AtomicDownload(path, oid, self.hashes)
+        with self.open_pool().connection() as sftp, transfer as f:
+            if transfer.offset < size:
+                self.getfo(sftp, remote_path, f, progress.progress_callback, transfer.offset, size)
 
     @stage_logger("Download Stage")
     def download(self, event, oid, size, action):
-        with SftpAuth(self.user, self.hostname, self.port,
-                      self.rsa_key, self.lfs_storage_remote) as sftp:
-            progress = Progress(oid)
-            temp_path = self.temp.split("/")
-            temp_path.append(oid)
-            temp_path = "/".join(temp_path)
-            logger.info(f"temp path is {temp_path}")
+        if self.replicas is not None:
+            yield from self.replicas.download(event, oid, size, action)
+            return
+        progress = Progress(oid, size)
+        temp_path = self.temp.split("/")
+        temp_path.append(oid)
+        temp_path = "/".join(temp_path)
+        logger.info("temp path is %s", temp_path)
+        try:
+            if self.hashes.verify(temp_path, oid):
+                logger.info("A verified file exists. Skip download.")
+            elif self.cache is not None:
+                with self.cache.lock(oid):
+                    if self.cache.lookup(oid, size) is None:
+                        self.fetch(oid, size, self.cache.prepare(oid), progress)
+                    logger.debug(f"{oid} was served from the cache by {self.cache.serve(oid, temp_path)}.")
+            else:
+                self.fetch(oid, size, temp_path, progress)
+        except Exception as e:
+            handle_error(e, ERROR_CODE.DOWNLOAD)
+        yield complete(oid, temp_path)
+
+    def compact(self, min_age):
+        if self.replicas is not None:
+            return self.replicas.compact(min_age)
+        with self.open_pool().connection() as sftp:
+            return self.packs.compact(sftp, min_age)
+
+    @property
+    def primary(self):
+        # Storage maintenance like sync listings looks at the endpoint of --hostname.
+        return self if self.replicas is None else self.replicas.agents[0]
+
+    def listdir(self, path):
+        with self.primary.open_pool().connection() as sftp:
             try:
-                sftp.chdir(oid[0:2])
-                sftp.chdir(oid[2:4])
-                if not os.path.exists(temp_path):
-                    with open(temp_path, "bw") as f:
-                        sftp.getfo(oid, f, callback=progress.progress_callback)
-                yield json.dumps({
-                    "event": "complete",
-                    "oid": oid,
-                    "path": temp_path
-                })
-            except Exception as e:
-                handle_error(e, ERROR_CODE.DOWNLOAD)
+                return sftp.listdir(path)
+            except IOError:
+                return []
+
+    def listing(self, shard):
+        # Listings go through the index, so uploads into a listed shard need no further lookups.
+        with self.primary.open_pool().connection() as sftp:
+            return dict(self.primary.index.listing(sftp, shard))
+
+    def packed(self):
+        with self.primary.open_pool().connection() as sftp:
+            return dict((oid, length) for oid, (_, _, length) in self.primary.packs.load(sftp).items())
 
     @classmethod
     def add_argument(cls, parser):
@@ -122,11 +621,58 @@ class SftpAgent(CustomTransferAgent):
                             help="remote directory for lfs object."
                                  "please add 'pyelfs://' in .git/config, "
                                  "in order to avoid unintentional path expansion by git-lfs. ")
+        parser.add_argument("--channels",
+                            default=1, type=int,
+                            help="number of sftp channels multiplexed over one ssh transport.")
+        parser.add_argument("--window-size",
+                            type=int,
+                            help="ssh window size of each sftp channel in bytes.")
+        parser.add_argument("--max-packet-size",
+                            type=int,
+                            help="maximum ssh packet size of each sftp channel in bytes.")
+        parser.add_argument("--prefetch-requests",
+                            type=int,
+                            help="maximum number of read requests in flight per download. "
+                                 "requires paramiko 3.3 or newer.")
+        parser.add_argument("--index-cache",
+                            help="local file to keep the listing of remote objects between runs.")
+        parser.add_argument("--index-ttl",
+                            default=3600, type=int,
+                            help="seconds for which a cached listing of remote objects is trusted.")
+        parser.add_argument("--resume-threshold",
+                            default=8 << 20, type=int,
+                            help="objects of this size in bytes or larger are transferred "
+                                 "through a partial file and resumed after an interruption.")
+        parser.add_argument("--segments",
+                            default=1, type=int,
+                            help="number of sftp sessions used in parallel for one large object.")
+        parser.add_argument("--segment-threshold",
+                            default=256 << 20, type=int,
+                            help="objects of this size in bytes or larger are split into segments.")
+        parser.add_argument("--cache-dir",
+                            help="local directory to cache downloaded lfs objects "
+                                 "across repositories.")
+        parser.add_argument("--cache-size",
+                            type=int,
+                            help="size limit of the cache directory in bytes. "
+                                 "least recently used objects are evicted at the end of a run.")
+        cls.add_schedule_argument(parser)
+        cls.add_pack_argument(parser)
+        cls.add_daemon_argument(parser)
+        parser.add_argument("--compression",
+                            choices=MODES,
+                            help="store compressible objects compressed, as oid.zst with zstd or oid.zz with zlib. "
+                                 "'auto' prefers zstd when the zstandard package is installed.")
+        parser.add_argument("--replicas",
+                            help="more endpoints as comma separated sftp://[user@]host[:port][/path], "
+                                 "with user, port and path defaulting to the options above. "
+                                 "Uploads go to all of them and downloads come from the fastest.")
+        parser.add_argument("--write-quorum",
+                            type=int,
+                            help="endpoints that must store an upload before it completes, "
+                                 "defaults to a majority. The others finish in the background.")
         parser.add_argument("--verbose", help="verbose log")
+        cls.add_metrics_argument(parser)
         parser.add_argument("--temp",
                             default=f"{gettempdir()}",
                             help="temporary directory to download lfs objects.")
-
-    @classmethod
-    def rep(cls):
-        return "sftp agent"
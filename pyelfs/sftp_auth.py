@@ -1,19 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from logging import getLogger
+from threading import Condition, Event, Lock
+from time import monotonic
 from paramiko import SFTPClient, Transport, RSAKey
+from .metrics import transfer_metrics
 from .util import handle_error, ERROR_CODE
 
 logger = getLogger(__name__)
 
 
+class MeteredSFTPClient(SFTPClient):
+    """Counts the requests that wait for their response, which pipelined reads and writes do not."""
+
+    def _request(self, t, *args):
+        transfer_metrics.round_trip()
+        return super()._request(t, *args)
+
+
 class SftpAuth:
 
-    def __init__(self, user, hostname, port, rsa_key, remote_dir):
+    def __init__(self, user, hostname, port, rsa_key, remote_dir,
+                 window_size=None, max_packet_size=None):
         self.user = user
         self.hostname = hostname
         self.port = port
         self.rsa_key = rsa_key
         self.remote_dir = remote_dir
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
         self.transport = Transport(f"{self.hostname}:{self.port}")
+        self.sftp = None
+        self.channels = []
         logger.info(self.__repr__())
 
     def __repr__(self):
@@ -34,9 +52,10 @@ class SftpAuth:
 
         logger.info("Transport was initialized.")
 
-    def __enter__(self):
+    def open(self):
         self.set_transport()
-        self.sftp = SFTPClient.from_transport(self.transport)
+        self.sftp = MeteredSFTPClient.from_transport(self.transport, self.window_size, self.max_packet_size)
+        self.channels.append(self.sftp)
         try:
             logger.info("Try to make a directory")
             self.sftp.mkdir(self.remote_dir)
@@ -46,6 +65,220 @@ class SftpAuth:
         self.sftp.chdir(self.remote_dir)
         return self.sftp
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
+    def open_channel(self):
+        sftp = MeteredSFTPClient.from_transport(self.transport, self.window_size, self.max_packet_size)
+        sftp.chdir(self.remote_dir)
+        self.channels.append(sftp)
+        logger.info(f"A sftp channel was opened. ({len(self.channels)} on this transport)")
+        return sftp
+
+    def close_channel(self, sftp):
+        if sftp in self.channels:
+            self.channels.remove(sftp)
+        sftp.close()
+
+    def is_active(self):
+        return self.transport.is_active()
+
+    def close(self):
         self.transport.close()
-        self.sftp.close()
+        for sftp in self.channels:
+            sftp.close()
+        self.channels = []
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SftpPool:
+    keepalive = 30
+
+    def __init__(self, user, hostname, port, rsa_key, remote_dir, size=1,
+                 channels=1, window_size=None, max_packet_size=None):
+        self.user = user
+        self.hostname = hostname
+        self.port = port
+        self.rsa_key = rsa_key
+        self.remote_dir = remote_dir
+        self.size = size
+        self.channels = max(channels, 1)
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.opened = 0
+        self.idle = []
+        self.transports = []
+        self.condition = Condition()
+        self.transports_lock = Lock()
+        self.dialing = {}
+        self.pending = {}
+        self.closed = False
+
+    def connect(self):
+        with transfer_metrics.connecting():
+            return self.open_session()
+
+    def open_session(self):
+        while True:
+            # Only the choice of a transport is locked, so that new transports are dialed side by side.
+            with self.transports_lock:
+                self.transports = [auth for auth in self.transports if auth in self.dialing or auth.is_active()]
+                auth = next((auth for auth in self.transports
+                             if len(auth.channels) + self.pending.get(auth, 0) < self.channels), None)
+                dial = auth is None
+                if dial:
+                    auth = SftpAuth(self.user, self.hostname, self.port, self.rsa_key, self.remote_dir,
+                                    self.window_size, self.max_packet_size)
+                    self.transports.append(auth)
+                    self.dialing[auth] = Event()
+                self.pending[auth] = self.pending.get(auth, 0) + 1
+                dialed = self.dialing.get(auth)
+            try:
+                if dial:
+                    return auth, self.dial(auth)
+                if dialed is not None:
+                    dialed.wait()
+                if auth.is_active():
+                    return auth, auth.open_channel()
+            finally:
+                with self.transports_lock:
+                    self.pending[auth] -= 1
+                    if not self.pending[auth]:
+                        del self.pending[auth]
+            logger.info("The transport to share failed to connect. Try another one.")
+
+    def dial(self, auth):
+        try:
+            sftp = auth.open()
+            auth.transport.set_keepalive(self.keepalive)
+        except Exception:
+            auth.close()
+            with self.transports_lock:
+                if auth in self.transports:
+                    self.transports.remove(auth)
+            raise
+        finally:
+            with self.transports_lock:
+                self.dialing.pop(auth).set()
+        logger.info(f"A sftp transport was opened. ({len(self.transports)} transports)")
+        return sftp
+
+    def healthy(self, session, idle_since):
+        auth, sftp = session
+        if not auth.is_active():
+            return False
+        if monotonic() - idle_since < self.keepalive:
+            return True
+        try:
+            sftp.stat(".")
+            return True
+        except Exception as e:
+            logger.info(f"A sftp session failed the health check: {e}")
+            return False
+
+    def reserve(self, block=True):
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise RuntimeError("The sftp pool was already closed.")
+                if self.idle:
+                    return self.idle.pop()
+                if self.opened < self.size:
+                    self.opened += 1
+                    return None, None
+                if not block:
+                    return None
+                self.condition.wait()
+
+    def acquire(self, block=True):
+        slot = self.reserve(block)
+        if slot is None:
+            return None
+        return self.ready(slot)
+
+    def ready(self, slot):
+        session, idle_since = slot
+        if session is not None:
+            if self.healthy(session, idle_since):
+                return session
+            self.discard(session, reserve=True)
+        try:
+            return self.connect()
+        except Exception:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, session):
+        # A session whose channel or transport dropped is replaced, so a retry gets a working one.
+        if not session[0].is_active() or getattr(getattr(session[1], "sock", None), "closed", False) is True:
+            self.discard(session)
+            return
+        with self.condition:
+            if self.closed:
+                self.opened -= 1
+                return
+            self.idle.append((session, monotonic()))
+            self.condition.notify()
+
+    def discard(self, session, reserve=False):
+        auth, sftp = session
+        logger.info("A sftp session was discarded.")
+        try:
+            if auth.is_active():
+                auth.close_channel(sftp)
+            else:
+                auth.close()
+        except Exception as e:
+            logger.debug(e)
+        if reserve:
+            return
+        with self.condition:
+            self.opened -= 1
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self):
+        session = self.acquire()
+        try:
+            yield session[1]
+        finally:
+            self.release(session)
+
+    @contextmanager
+    def connections(self, n, block=True):
+        slots = []
+        while len(slots) < n:
+            slot = self.reserve(block and not slots)
+            if slot is None:
+                break
+            slots.append(slot)
+        sessions = []
+        try:
+            # Sessions that have to be opened are opened side by side to pay the handshake once.
+            with ThreadPoolExecutor(max(len(slots), 1)) as executor:
+                futures = [executor.submit(self.ready, slot) for slot in slots]
+            for future in futures:
+                if future.exception() is None:
+                    sessions.append(future.result())
+            for future in futures:
+                future.result()
+            yield [session[1] for session in sessions]
+        finally:
+            for session in sessions:
+                self.release(session)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.opened -= len(self.idle)
+            self.idle = []
+            self.condition.notify_all()
+        with self.transports_lock:
+            transports, self.transports = self.transports, []
+        for auth in transports:
+            auth.close()
+        logger.info("The sftp pool was closed.")
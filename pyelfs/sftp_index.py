@@ -0,0 +1,133 @@
+import json
+import os
+from logging import getLogger
+from threading import Lock
+from time import time
+
+logger = getLogger(__name__)
+
+# A lookup that misses an object lists its shard again if listed longer ago than this.
+RELIST_AFTER = 5
+
+
+def shard_of(oid):
+    return f"{oid[0:2]}/{oid[2:4]}"
+
+
+class RemoteIndex:
+
+    def __init__(self, remote, cache_path=None, ttl=3600):
+        self.remote = remote
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.shards = {}
+        self.listed_at = {}
+        self.lock = Lock()
+        self.shard_locks = {}
+        if cache_path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.info(f"No usable index cache: {e}")
+            return
+        if cache.get("remote") != self.remote:
+            logger.info("The index cache belongs to another remote. Ignore it.")
+            return
+        now = time()
+        for shard, (listed_at, entries) in cache.get("shards", {}).items():
+            if now - listed_at < self.ttl:
+                self.shards[shard] = entries
+                self.listed_at[shard] = listed_at
+        logger.info(f"{len(self.shards)} shards were loaded from {self.cache_path}")
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with self.lock:
+            shards = dict((shard, [self.listed_at[shard], dict(entries)])
+                          for shard, entries in self.shards.items())
+        temp_path = f"{self.cache_path}.{os.getpid()}"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump({"remote": self.remote, "shards": shards}, f)
+            os.replace(temp_path, self.cache_path)
+            logger.info(f"{len(shards)} shards were saved into {self.cache_path}")
+        except OSError as e:
+            logger.warning(f"Failed to save the index cache: {e}")
+
+    def shard_lock(self, shard):
+        with self.lock:
+            return self.shard_locks.setdefault(shard, Lock())
+
+    def fresh(self, shard, max_age=None):
+        # Listings expire in memory as they do in the cache file, which matters to long-lived agents.
+        ttl = self.ttl if max_age is None else min(self.ttl, max_age)
+        with self.lock:
+            return shard in self.shards and time() - self.listed_at[shard] < ttl
+
+    def listing(self, sftp, shard, max_age=None):
+        with self.shard_lock(shard):
+            if self.fresh(shard, max_age):
+                return self.shards[shard]
+            try:
+                entries = dict((a.filename, a.st_size) for a in sftp.listdir_attr(shard))
+            except IOError:
+                logger.info(f"Shard {shard} doesn't exist. Create it.")
+                self.make_shard(sftp, shard)
+                entries = {}
+            with self.lock:
+                self.shards[shard] = entries
+                self.listed_at[shard] = time()
+            return entries
+
+    @staticmethod
+    def mkdir(sftp, d):
+        try:
+            sftp.mkdir(d)
+        except IOError:
+            sftp.stat(d)
+
+    @classmethod
+    def make_shard(cls, sftp, shard):
+        for d in (shard[0:2], shard):
+            cls.mkdir(sftp, d)
+
+    def prepare(self, sftp, oids):
+        shards = set(shard for shard in set(shard_of(oid) for oid in oids) if not self.fresh(shard))
+        if not shards:
+            return
+        firsts = set(sftp.listdir("."))
+        seconds = {}
+        for shard in sorted(shards):
+            first = shard[0:2]
+            if first not in firsts:
+                self.mkdir(sftp, first)
+                firsts.add(first)
+                seconds[first] = set()
+            elif first not in seconds:
+                seconds[first] = set(sftp.listdir(first))
+            if shard[3:5] not in seconds[first]:
+                self.mkdir(sftp, shard)
+                seconds[first].add(shard[3:5])
+                with self.lock:
+                    self.shards[shard] = {}
+                    self.listed_at[shard] = time()
+        for shard in sorted(shards):
+            self.listing(sftp, shard)
+
+    def lookup(self, sftp, oid):
+        return self.listing(sftp, shard_of(oid)).get(oid)
+
+    def add(self, oid, size):
+        with self.lock:
+            entries = self.shards.get(shard_of(oid))
+            if entries is not None:
+                entries[oid] = size
+
+    def discard(self, oid):
+        with self.lock:
+            self.shards.get(shard_of(oid), {}).pop(oid, None)
@@ -0,0 +1,145 @@
+import json
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from logging import getLogger
+from threading import Lock
+
+from .cli import agent_from_args
+from .compression import EXTENSIONS
+from .sftp_index import shard_of
+from .util import event_writer
+
+logger = getLogger(__name__)
+
+AGENTS = ("file", "sftp")
+OID = re.compile(r"[0-9a-f]{64}")
+SHARD = re.compile(r"[0-9a-f]{2}")
+
+
+def stored(listing):
+    # Partial and temporary files are skipped, and compressed objects count as present without a known size.
+    objects = {}
+    for name, size in listing.items():
+        oid, _, extension = name.partition(".")
+        if not OID.fullmatch(oid):
+            continue
+        if not extension:
+            objects[oid] = size
+        elif extension in EXTENSIONS:
+            objects.setdefault(oid, None)
+    return objects
+
+
+def missing(source, destination):
+    # An object stored compressed has no known size, so on either side it only has to exist.
+    return dict((oid, size) for oid, size in source.items()
+                if oid not in destination
+                or size is not None and destination[oid] is not None and destination[oid] != size)
+
+
+class Sync:
+
+    def __init__(self, source, destination, workers, verify, **kwargs):
+        self.source = source
+        self.destination = destination
+        self.workers = workers
+        self.verify = verify
+        self.lock = Lock()
+        self.copied = 0
+        self.copied_bytes = 0
+        self.failed = {}
+
+    @staticmethod
+    def agent(args):
+        args = shlex.split(args)
+        if not args or args[0] not in AGENTS:
+            raise ValueError(f"sync supports {' and '.join(AGENTS)} agents, not {args[:1]}.")
+        return agent_from_args(args)
+
+    def shards(self, executor, agent):
+        firsts = [name for name in agent.listdir(".") if SHARD.fullmatch(name)]
+        shards = []
+        for first, seconds in zip(firsts, executor.map(agent.listdir, firsts)):
+            shards += [f"{first}/{second}" for second in seconds if SHARD.fullmatch(second)]
+        return shards
+
+    def diff(self, executor, source, destination):
+        source_objects = source.packed()
+        destination_objects = destination.packed()
+        # Packed objects may live in shards that hold no loose files on the source.
+        shards = sorted(set(self.shards(executor, source)) | set(shard_of(oid) for oid in source_objects))
+        logger.info(f"Diff {len(shards)} shards.")
+
+        def list_shard(shard):
+            return stored(source.listing(shard)), stored(destination.listing(shard))
+
+        for source_stored, destination_stored in executor.map(list_shard, shards):
+            source_objects.update(source_stored)
+            destination_objects.update(destination_stored)
+        return source_objects, missing(source_objects, destination_objects)
+
+    @staticmethod
+    def path_of(events):
+        return json.loads(list(events)[-1])["path"]
+
+    def copy(self, source, destination, oid, size):
+        try:
+            # The size of an object stored compressed is only known once it is downloaded.
+            path = self.path_of(source.download("download", oid, size or 0, None))
+            try:
+                size = os.path.getsize(path)
+                list(destination.upload("upload", oid, size, path, None))
+            finally:
+                os.remove(path)
+            if self.verify:
+                os.remove(self.path_of(destination.download("download", oid, size, None)))
+        except Exception as e:
+            logger.exception(e)
+            with self.lock:
+                self.failed[oid] = str(e)
+            return
+        with self.lock:
+            self.copied += 1
+            self.copied_bytes += size
+
+    def main_proc(self, stream):
+        source = self.agent(self.source)
+        destination = self.agent(self.destination)
+        # Agents report progress as git-lfs events, which are of no use here.
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for agent in (source, destination):
+                list(agent.init("init", "upload", "origin", True, self.workers))
+            try:
+                with ThreadPoolExecutor(self.workers) as executor:
+                    objects, copies = self.diff(executor, source, destination)
+                    logger.info(f"{len(copies)} of {len(objects)} objects are missing.")
+                    for oid, size in copies.items():
+                        executor.submit(self.copy, source, destination, oid, size)
+            finally:
+                for agent in (source, destination):
+                    list(agent.terminate())
+                event_writer.flush()
+        for oid, message in sorted(self.failed.items()):
+            print(f"{oid}: {message}")
+        print(f"{self.copied} objects ({self.copied_bytes} bytes) were copied, "
+              f"{len(objects) - len(copies)} were present and {len(self.failed)} failed.")
+        if self.failed:
+            sys.exit(1)
+
+    @classmethod
+    def add_argument(cls, parser):
+        parser.add_argument("source",
+                            help="agent arguments of the source as in lfs.customtransfer.pyelfs.args, "
+                                 "e.g. 'file --lfs-storage-local /mnt/nas/lfs'.")
+        parser.add_argument("destination",
+                            help="agent arguments of the destination, "
+                                 "e.g. 'sftp --hostname lfs.example.com --lfs-storage-remote /srv/lfs'.")
+        parser.add_argument("--workers", type=int, default=8,
+                            help="shards listed and objects copied at once.")
+        parser.add_argument("--verify", action="store_true",
+                            help="read every copied object back from the destination and check its sha256.")
+        parser.add_argument("--verbose", help="verbose log")
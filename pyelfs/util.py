@@ -1,6 +1,12 @@
-import json
+import os
+import sys
+from contextlib import contextmanager
 from enum import Enum
-from logging import getLogger
+from logging import DEBUG, INFO, getLogger
+from threading import local, Lock
+from time import monotonic
+
+from .protocol import dumps
 logger = getLogger(__name__)
 
 
@@ -15,40 +21,87 @@ class ERROR_CODE(Enum):
 
 def handle_error(e, error_code):
     logger.error(f"In {error_code}: {e}")
-    print(json.dumps({"error": {"code": error_code, "message": e}}), flush=True)
     raise
 
 
-class Progress:
-    byte_so_far = 0
-    oid = None
-    i = 0.0
-
-    def __init__(self, oid):
-        logger.info("Progress is initialized")
-        self.oid = oid
-
-    def progress_callback(self, byte_so_far, size):
-        if byte_so_far / size < self.i:
-            return
-        self.i += 0.1
-        bytes_since_last = byte_so_far - self.byte_so_far
-        self.byte_so_far = byte_so_far
-        res = json.dumps({
-            "event": "progress",
-            "oid": self.oid,
-            "byteSoFar": byte_so_far,
-            "bytesSinceLast": bytes_since_last,
-        })
-        logger.debug(res)
-        print(res, flush=True)  # Tried, but couldn't return by yield in a callback.
+def error_event(e, error_code, oid=None):
+    error = {"code": error_code.value, "message": str(e)}
+    if oid is None:
+        return dumps({"error": error})
+    return dumps({"event": "complete", "oid": oid, "error": error})
+
+
+class EventWriter:
+    flush_interval = 0.1
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.lock = Lock()
+        self.buffer = []
+        self.flushed_at = monotonic()
+        self.closed = False
+
+    def write(self, res, flush=True):
+        with self.lock:
+            if logger.isEnabledFor(DEBUG):
+                logger.debug(res)
+            if self.closed:
+                return
+            self.buffer.append(res)
+            if flush or monotonic() - self.flushed_at >= self.flush_interval:
+                self.flush_buffer()
+
+    def flush(self):
+        with self.lock:
+            if self.buffer:
+                self.flush_buffer()
+
+    def flush_buffer(self):
+        self.buffer.append("")
+        stream = self.stream or sys.stdout
+        try:
+            stream.write("\n".join(self.buffer))
+            stream.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning("git-lfs closed the pipe, the remaining events are dropped.")
+            self.closed = True
+            if self.stream is None:
+                # Point stdout at devnull so that the interpreter does not fail flushing it at exit.
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        self.buffer = []
+        self.flushed_at = monotonic()
+
+
+event_writer = EventWriter()
+routes = local()
+
+
+def current_writer():
+    return getattr(routes, "writer", None) or event_writer
+
+
+@contextmanager
+def routed(writer):
+    # Events of a transfer go to the client it came from, which matters once a daemon serves several.
+    previous = getattr(routes, "writer", None)
+    routes.writer = writer
+    try:
+        yield
+    finally:
+        routes.writer = previous
 
 
 def stage_logger(phase):
     def decorator(func):
         def wrapper(*args, **kwargs):
+            # Logging is configured after import, so whether to log is decided per call.
+            if not logger.isEnabledFor(INFO):
+                return func(*args, **kwargs)
+            return logged(func(*args, **kwargs))
+
+        def logged(events):
             logger.info(f"Enter {phase}.")
-            yield from func(*args, **kwargs)
+            yield from events
             logger.info(f"Exit {phase}.")
         return wrapper
     return decorator
@@ -60,12 +113,27 @@ def include(k):
     return option
 
 
+def include_not_none(k):
+    # For options where 0 means something other than the default.
+    def option(v):
+        return [] if v is None else [k, str(v)]
+    return option
+
+
 def include_pyelfs_wrapped(k):
     def option(v):
         return [k, f"pyelfs://{str(v)}"] if v else []
     return option
 
 
+def include_optional_pyelfs_wrapped(k):
+    def option(v):
+        if v is None:
+            return []
+        return [k, f"pyelfs://{str(v)}"] if v else [k]
+    return option
+
+
 def exclude():
     def option(v):
         return []
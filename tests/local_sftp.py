@@ -0,0 +1,85 @@
+import os
+import shutil
+
+
+class LocalSftpFile:
+
+    def __init__(self, f):
+        self.f = f
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.f.close()
+
+    def set_pipelined(self, pipelined=True):
+        pass
+
+    def prefetch(self, file_size=None, max_concurrent_requests=None):
+        pass
+
+    def check(self, hash_algorithm, offset=0, length=0, block_size=0):
+        raise IOError("Operation unsupported")
+
+    def readv(self, chunks, max_concurrent_prefetch_requests=None):
+        for offset, length in chunks:
+            yield os.pread(self.f.fileno(), length, offset)
+
+
+class LocalSftp:
+    """SFTPClient look-alike backed by a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, path):
+        return os.path.join(self.root, path)
+
+    def stat(self, path):
+        return os.stat(self.path(path))
+
+    def open(self, path, mode="r"):
+        mode = {"r": "rb", "rb": "rb", "w": "wb", "wb": "wb", "r+": "r+b", "r+b": "r+b", "x": "xb"}[mode]
+        return LocalSftpFile(open(self.path(path), mode))
+
+    def listdir(self, path="."):
+        return os.listdir(self.path(path))
+
+    def listdir_attr(self, path="."):
+        attrs = []
+        for name in os.listdir(self.path(path)):
+            attr = os.stat(os.path.join(self.path(path), name))
+            attrs.append(type("SFTPAttributes", (), {"filename": name, "st_size": attr.st_size}))
+        return attrs
+
+    def mkdir(self, path):
+        os.mkdir(self.path(path))
+
+    def remove(self, path):
+        os.remove(self.path(path))
+
+    def utime(self, path, times):
+        os.utime(self.path(path), times)
+
+    def rename(self, src, dst):
+        if os.path.exists(self.path(dst)):
+            raise IOError("Failure")
+        os.rename(self.path(src), self.path(dst))
+
+    def posix_rename(self, src, dst):
+        os.replace(self.path(src), self.path(dst))
+
+    def put(self, localpath, remotepath, callback=None, confirm=True):
+        shutil.copyfile(localpath, self.path(remotepath))
+
+    def getfo(self, remotepath, fl, callback=None, prefetch=True, max_concurrent_prefetch_requests=None):
+        with open(self.path(remotepath), "rb") as f:
+            data = f.read()
+        fl.write(data)
+        if callback:
+            callback(len(data), len(data))
+        return len(data)
@@ -0,0 +1,72 @@
+import json
+from io import StringIO
+from threading import Barrier
+from unittest import TestCase
+from unittest.mock import patch
+
+from pyelfs import CustomTransferAgent
+
+
+class BarrierAgent(CustomTransferAgent):
+
+    def __init__(self, parties):
+        self.barrier = Barrier(parties, timeout=5)
+        self.drops = []
+
+    def init(self, event, operation, remote, concurrent, concurrenttransfers):
+        yield "{}"
+
+    def upload(self, event, oid, size, path, action):
+        if oid == "bad":
+            raise IOError("broken object")
+        if oid in self.drops:
+            self.drops.remove(oid)
+            raise ConnectionResetError("connection dropped")
+        self.barrier.wait()
+        yield json.dumps({"event": "complete", "oid": oid})
+
+    def download(self, event, oid, size, action):
+        yield json.dumps({"event": "complete", "oid": oid, "path": oid})
+
+
+def requests(concurrenttransfers, oids):
+    yield json.dumps({"event": "init", "operation": "upload", "remote": "origin",
+                      "concurrent": True, "concurrenttransfers": concurrenttransfers})
+    for oid in oids:
+        yield json.dumps({"event": "upload", "oid": oid, "size": 1, "path": oid, "action": None})
+    yield json.dumps({"event": "terminate"})
+
+
+class TestCustomTransferAgent(TestCase):
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_concurrent_transfers(self, stdout):
+        # Every upload waits for the others, so this only finishes when they run at once.
+        oids = [str(i) for i in range(4)]
+        BarrierAgent(4).main_proc(requests(4, oids))
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(lines[0], {})
+        self.assertEqual(sorted(d["oid"] for d in lines[1:-1]), oids)
+        self.assertEqual(lines[-1], {"event": "terminate"})
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_error_event(self, stdout):
+        BarrierAgent(1).main_proc(requests(2, ["bad", "good"]))
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        error = [d for d in lines if d.get("oid") == "bad"][0]
+        self.assertEqual(error["event"], "complete")
+        self.assertEqual(error["error"]["message"], "broken object")
+        self.assertIn({"event": "complete", "oid": "good"}, lines)
+
+    @patch("pyelfs.sleep")
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_retry_transient_error(self, stdout, sleep):
+        agent = BarrierAgent(1)
+        agent.schedule(retries=2)
+        agent.drops = ["flaky", "flaky", "lost", "lost", "lost"]
+        agent.main_proc(requests(1, ["flaky", "bad", "lost"]))
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertIn({"event": "complete", "oid": "flaky"}, lines)
+        errors = dict((d["oid"], d["error"]["message"]) for d in lines if "error" in d)
+        self.assertEqual(errors, {"bad": "broken object", "lost": "connection dropped"})
+        self.assertEqual(sleep.call_count, 4)
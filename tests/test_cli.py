@@ -1,6 +1,7 @@
 from unittest import TestCase, mock
 from argparse import ArgumentParser
-from pyelfs.cli import Cli, SubCommands
+from pyelfs.cli import AGENTS, Cli
+import subprocess
 import sys
 
 
@@ -22,8 +23,21 @@ class TestCli(TestCase):
         p = ArgumentParser()
         Cli.add_argument(p)
 
-        for subcommand in SubCommands:
-            if subcommand.name == "init":
-                continue
-            a = p.parse_args([subcommand.name])
-            self.assertEqual(subcommand.name, a.agent)
+        for name in AGENTS:
+            a = p.parse_args([name])
+            self.assertEqual(name, a.agent)
+
+    @mock.patch("builtins.print")
+    def test_retries_zero(self, print):
+        p = ArgumentParser()
+        Cli.add_argument(p)
+        Cli(**p.parse_args(["sftp", "--retries", "0", "--retry-delay", "0"]).__dict__).main_proc(None)
+        self.assertIn("--retries 0 --retry-delay 0.0", print.call_args[0][0])
+
+    def test_load_imports_only_selected_agent(self):
+        code = "import sys\n" \
+               "from pyelfs.cli import SubCommands\n" \
+               "SubCommands.file.load()\n" \
+               "print('paramiko' in sys.modules, 'git' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True)
+        self.assertEqual(b"False False", out.stdout.strip())
@@ -0,0 +1,41 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyelfs import compression
+
+
+class TestCompression(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write(self, content):
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_extension_of(self):
+        self.assertIsNone(compression.extension_of(None))
+        self.assertIsNone(compression.extension_of("none"))
+        self.assertEqual(compression.extension_of("zlib"), "zz")
+        self.assertEqual(compression.extension_of("auto"), "zst" if compression.zstandard else "zz")
+
+    def test_compressible(self):
+        text = b"id,name,value\n" + b"".join(b"%d,item%d,%d\n" % (i, i, i * 7) for i in range(50000))
+        self.assertTrue(compression.compressible(self.write(text), len(text)))
+        noise = os.urandom(1 << 20)
+        self.assertFalse(compression.compressible(self.write(noise), len(noise)))
+        self.assertFalse(compression.compressible(self.write(b"a" * 100), 100))
+
+    def test_round_trip(self):
+        content = b"lfs object " * 10000
+        c = compression.compressor("zz")
+        data = c.compress(content) + c.flush()
+        self.assertLess(len(data), len(content))
+        d = compression.decompressor("zz")
+        self.assertEqual(d.decompress(data) + d.flush(), content)
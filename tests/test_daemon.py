@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import socket
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+
+from pyelfs.daemon import check_directory, client_args, Daemon, default_socket, forward, peer_uid, resolve
+
+DATA = b"lfs object"
+OID = hashlib.sha256(DATA).hexdigest()
+
+
+class TestDaemon(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.storage = os.path.join(self.temp.name, "storage")
+        self.work = os.path.join(self.temp.name, "work")
+        for d in (self.storage, self.work):
+            os.mkdir(d)
+        self.socket = os.path.join(self.temp.name, "run", "daemon.sock")
+        self.daemon = Daemon(self.socket, 0.2)
+        self.thread = Thread(target=self.daemon.main_proc, args=(None,), daemon=True)
+        self.thread.start()
+        for _ in range(100):
+            if os.path.exists(self.socket):
+                break
+            self.thread.join(0.05)
+        self.args = ["file", "--lfs-storage-local", self.storage, "--temp", self.work]
+
+    def tearDown(self):
+        self.thread.join(5)
+        self.temp.cleanup()
+
+    def run_client(self, *events, args=None):
+        stdin = BytesIO(b"".join(json.dumps(e).encode() + b"\n" for e in events))
+        stdout = BytesIO()
+        self.assertTrue(forward(self.socket, args or self.args, stdin, stdout))
+        return [json.loads(line) for line in stdout.getvalue().decode().splitlines()]
+
+    def test_client_args(self):
+        self.assertIsNone(client_args(["file", "--temp", "/tmp"]))
+        self.assertIsNone(client_args(["null", "--daemon"]))
+        self.assertEqual(client_args(["file", "--daemon", "--temp", "/tmp"]),
+                         (default_socket(), ["file", "--temp", "/tmp"]))
+        self.assertEqual(client_args(["sftp", "--daemon", "pyelfs:///run/d.sock", "--port", "22"]),
+                         ("/run/d.sock", ["sftp", "--port", "22"]))
+
+    def test_round_trip(self):
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(DATA)
+        init = {"event": "init", "operation": "upload", "remote": "origin",
+                "concurrent": True, "concurrenttransfers": 2}
+        upload = {"event": "upload", "oid": OID, "size": len(DATA), "path": path, "action": None}
+        res = self.run_client(init, upload, {"event": "terminate"})
+        self.assertEqual(res[0], {})
+        self.assertIn({"event": "complete", "oid": OID}, res)
+        self.assertEqual(res[-1], {"event": "terminate"})
+
+        init["operation"] = "download"
+        download = {"event": "download", "oid": OID, "size": len(DATA), "action": None}
+        res = self.run_client(init, download, {"event": "terminate"})
+        completed = [r for r in res if r.get("event") == "complete"]
+        self.assertEqual(len(completed), 1)
+        with open(completed[0]["path"], "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        # Both clients were served by one agent.
+        self.assertEqual(len(self.daemon.agents), 1)
+
+    def test_checkpoint_on_disconnect(self):
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(DATA)
+        init = {"event": "init", "operation": "upload", "remote": "origin",
+                "concurrent": True, "concurrenttransfers": 2}
+        upload = {"event": "upload", "oid": OID, "size": len(DATA), "path": path, "action": None}
+        self.run_client(init, upload, {"event": "terminate"}, args=self.args + ["--pack-threshold", "100"])
+        # The pack the client wrote to is closed, so it is no longer leased while the agent lives on.
+        names = os.listdir(os.path.join(self.storage, "packs"))
+        self.assertFalse([name for name in names if name.endswith(".lease")])
+        self.assertEqual(len(self.daemon.agents), 1)
+
+    def test_relative_paths(self):
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(DATA)
+        init = {"event": "init", "operation": "download", "remote": "origin",
+                "concurrent": True, "concurrenttransfers": 2}
+        upload = {"event": "upload", "oid": OID, "size": len(DATA), "path": path, "action": None}
+        download = {"event": "download", "oid": OID, "size": len(DATA), "action": None}
+        cwd = os.getcwd()
+        os.chdir(self.temp.name)
+        try:
+            res = self.run_client(init, upload, download, {"event": "terminate"},
+                                  args=["file", "--lfs-storage-local", "pyelfs://storage", "--temp", "work"])
+        finally:
+            os.chdir(cwd)
+        self.assertTrue(os.path.isfile(os.path.join(self.storage, OID[0:2], OID[2:4], OID)))
+        self.assertIn({"event": "complete", "oid": OID, "path": os.path.join(self.work, OID)}, res)
+        self.assertEqual(resolve({"temp": "~/t", "lfs_storage_local": f"a{os.pathsep}/b"}, "/w"),
+                         {"temp": os.path.expanduser("~/t"), "lfs_storage_local": f"/w/a{os.pathsep}/b"})
+
+    def test_rejects_other_agents(self):
+        res = self.run_client({"event": "terminate"}, args=["null"])
+        self.assertIn("error", res[0])
+
+    def test_fallback_without_daemon(self):
+        self.assertFalse(forward(os.path.join(self.temp.name, "absent.sock"), self.args, BytesIO(), BytesIO()))
+
+    def test_shared_directory(self):
+        shared = os.path.join(self.temp.name, "shared")
+        os.mkdir(shared)
+        os.chmod(shared, 0o777)
+        path = os.path.join(shared, "daemon.sock")
+        with self.assertRaises(PermissionError):
+            Daemon(path, 1).listen()
+        self.assertFalse(forward(path, self.args, BytesIO(), BytesIO()))
+        link = os.path.join(self.temp.name, "link")
+        os.symlink(os.path.dirname(self.socket), link)
+        with self.assertRaises(PermissionError):
+            check_directory(link)
+        check_directory(os.path.dirname(self.socket))
+
+    def test_peer_uid(self):
+        a, b = socket.socketpair(socket.AF_UNIX)
+        with a, b:
+            self.assertIn(peer_uid(a), (None, os.getuid()))
+
+    def test_idle_timeout(self):
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket))
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from pyelfs import file_agent
+from pyelfs.integrity import IntegrityError
+
+OID = "bf3e3e2af9366a3b704ae0c31de5afa64193ebabffde2091936ad2e7510bc03a"
+
+
+class TestFileAgent(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.storage = os.path.join(self.temp.name, "storage")
+        os.mkdir(self.storage)
+        self.path = os.path.join(self.temp.name, "object")
+        with open(self.path, "wb") as f:
+            f.write(b"lfs object")
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def agent(self):
+        return file_agent.FileAgent(self.storage, self.temp.name)
+
+    def test_upload(self):
+        agent = self.agent()
+        res = [json.loads(r) for r in agent.upload("upload", OID, 10, self.path, None)]
+        self.assertEqual(res[-1], {"event": "complete", "oid": OID})
+        self.assertTrue(os.path.isfile(os.path.join(self.storage, "bf", "3e", OID)))
+
+    def test_upload_skips_present_object(self):
+        list(self.agent().upload("upload", OID, 10, self.path, None))
+        agent = self.agent()
+        with patch.object(agent.copier, "copy") as copy, patch.object(file_agent, "Progress") as progress:
+            list(agent.upload("upload", OID, 10, self.path, None))
+            list(agent.upload("upload", OID, 10, self.path, None))
+            copy.assert_not_called()
+        progress.return_value.skip.assert_called_with()
+        self.assertIn(OID, agent.present)
+
+    def test_upload_replaces_truncated_object(self):
+        os.makedirs(os.path.join(self.storage, "bf", "3e"))
+        open(os.path.join(self.storage, "bf", "3e", OID), "wb").close()
+        agent = self.agent()
+        list(agent.upload("upload", OID, 10, self.path, None))
+        self.assertEqual(os.path.getsize(os.path.join(self.storage, "bf", "3e", OID)), 10)
+
+    def test_download(self):
+        oid = "781f1a15e191cad9de5075c2b566ba2b9bd286e33f2d5d4f1511d411e67aeb23"
+        list(self.agent().upload("upload", oid, 10, self.path, None))
+        for strategy in ("auto", "copy"):
+            temp = os.path.join(self.temp.name, strategy)
+            os.mkdir(temp)
+            agent = file_agent.FileAgent(self.storage, temp, strategy)
+            res = [json.loads(r) for r in agent.download("download", oid, 10, None)]
+            self.assertEqual(res[-1], {"event": "complete", "oid": oid, "path": os.path.join(temp, oid)})
+            self.assertEqual(os.listdir(temp), [oid])
+
+    def test_packed_objects(self):
+        oid = "781f1a15e191cad9de5075c2b566ba2b9bd286e33f2d5d4f1511d411e67aeb23"
+        agent = file_agent.FileAgent(self.storage, self.temp.name, pack_threshold=100)
+        list(agent.upload("upload", oid, 10, self.path, None))
+        self.assertEqual(os.listdir(self.storage), ["packs"])
+        agent = file_agent.FileAgent(self.storage, self.temp.name)
+        self.assertTrue(agent.exists(oid, 10))
+        list(agent.download("download", oid, 10, None))
+        with open(os.path.join(self.temp.name, oid), "rb") as f:
+            self.assertEqual(f.read(), b"lfs object")
+
+    def test_download_packed_later(self):
+        # A long-lived agent, as in the daemon, reloads pack indexes when it misses an object.
+        oid = "781f1a15e191cad9de5075c2b566ba2b9bd286e33f2d5d4f1511d411e67aeb23"
+        reader = self.agent()
+        self.assertFalse(reader.exists(oid, 10))
+        writer = file_agent.FileAgent(self.storage, self.temp.name, pack_threshold=100)
+        list(writer.upload("upload", oid, 10, self.path, None))
+        list(writer.terminate())
+        reader.packs.loaded_at -= file_agent.RELOAD_AFTER
+        list(reader.download("download", oid, 10, None))
+        with open(os.path.join(self.temp.name, oid), "rb") as f:
+            self.assertEqual(f.read(), b"lfs object")
+
+    def test_download_verification(self):
+        list(self.agent().upload("upload", OID, 10, self.path, None))
+        for strategy in ("auto", "copy"):
+            agent = file_agent.FileAgent(self.storage, self.temp.name, strategy)
+            with self.assertRaises(IntegrityError):
+                list(agent.download("download", OID, 10, None))
+            self.assertFalse(os.path.exists(os.path.join(self.temp.name, OID)))
+
+    def test_multiple_roots(self):
+        roots = [os.path.join(self.temp.name, name) for name in "abc"]
+        objects = {}
+        agent = file_agent.FileAgent(os.pathsep.join(roots[:2]), self.temp.name)
+        for i in range(20):
+            content = f"lfs object {i}".encode()
+            oid = hashlib.sha256(content).hexdigest()
+            path = os.path.join(self.temp.name, f"object{i}")
+            with open(path, "wb") as f:
+                f.write(content)
+            list(agent.upload("upload", oid, len(content), path, None))
+            objects[oid] = content
+        self.assertEqual(set(os.listdir(self.temp.name)) & set("abc"), {"a", "b"})
+        agent = file_agent.FileAgent(os.pathsep.join(roots), self.temp.name)
+        moving = [oid for oid in objects if agent.ring.root_of(oid) == roots[2]]
+        self.assertTrue(moving)
+        for rebalanced in (False, True):
+            for oid, content in objects.items():
+                self.assertTrue(agent.exists(oid, len(content)))
+                list(agent.download("download", oid, len(content), None))
+                with open(os.path.join(self.temp.name, oid), "rb") as f:
+                    self.assertEqual(f.read(), content)
+            if not rebalanced:
+                self.assertEqual(agent.rebalance(4), len(moving))
+        for oid in objects:
+            self.assertTrue(os.path.isfile(agent.path_of(oid)))
+        self.assertEqual(agent.rebalance(4), 0)
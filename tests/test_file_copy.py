@@ -0,0 +1,49 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from pyelfs import file_copy
+
+
+class TestFileCopier(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.src = os.path.join(self.temp.name, "src")
+        self.dst = os.path.join(self.temp.name, "dst")
+        with open(self.src, "wb") as f:
+            f.write(b"lfs object" * 1000)
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_auto_same_filesystem(self):
+        self.assertEqual(file_copy.FileCopier().copy(self.src, self.dst), "hardlink")
+        self.assertTrue(os.path.samefile(self.src, self.dst))
+        self.assertEqual(file_copy.FileCopier().copy(self.src, self.dst), "same")
+
+    def test_strategies(self):
+        for strategy in file_copy.STRATEGIES[1:]:
+            method = file_copy.FileCopier(strategy).copy(self.src, self.dst)
+            self.assertIn(method, (strategy, "copy", "same"))
+            self.assertEqual(self.read(self.src), self.read(self.dst))
+            os.remove(self.dst)
+
+    def test_fallback(self):
+        copier = file_copy.FileCopier()
+        with patch.dict(file_copy.METHODS, hardlink=self.unsupported, reflink=self.unsupported):
+            method = copier.copy(self.src, self.dst)
+            self.assertNotIn(method, ("hardlink", "reflink"))
+            self.assertEqual(self.read(self.src), self.read(self.dst))
+            self.assertNotIn("hardlink", copier.candidates(self.src, self.temp.name))
+        self.assertEqual(sorted(os.listdir(self.temp.name)), ["dst", "src"])
+
+    @staticmethod
+    def unsupported(src, dst, callback):
+        open(dst, "wb").close()
+        raise OSError(file_copy.errno.EXDEV, "cross-device link")
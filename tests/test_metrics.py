@@ -0,0 +1,65 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyelfs import metrics
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.metrics = metrics.Metrics()
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def run_transfers(self):
+        for i in range(4):
+            record = self.metrics.queued({"event": "upload", "oid": str(i), "size": 100})
+            with self.metrics.transfer(record):
+                with self.metrics.connecting():
+                    pass
+                self.metrics.round_trip(2)
+                self.metrics.current().bytes = 100
+        record = self.metrics.queued({"event": "download", "oid": "bad", "size": 100})
+        with self.assertRaises(IOError), self.metrics.transfer(record):
+            raise IOError("broken")
+
+    def test_disabled(self):
+        self.assertIsNone(self.metrics.queued({"event": "upload", "oid": "0", "size": 100}))
+        with self.metrics.transfer(None):
+            self.metrics.round_trip()
+        self.metrics.write()
+        self.assertEqual(self.metrics.records, [])
+
+    def test_jsonl(self):
+        path = os.path.join(self.temp.name, "metrics.jsonl")
+        self.metrics.configure(path)
+        self.run_transfers()
+        self.metrics.write()
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line["oid"] for line in lines[:-1]], ["0", "1", "2", "3", "bad"])
+        self.assertEqual(lines[0]["round_trips"], 2)
+        self.assertEqual(lines[-2]["error"], "broken")
+        summary = lines[-1]["summary"]
+        self.assertEqual(summary["objects"], 5)
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(summary["bytes"], 400)
+        self.assertEqual(summary["round_trips"], 8)
+
+    def test_prometheus(self):
+        path = os.path.join(self.temp.name, "pyelfs.prom")
+        self.metrics.configure(path, "prometheus")
+        self.run_transfers()
+        self.metrics.write()
+        with open(path) as f:
+            text = f.read()
+        self.assertIn("pyelfs_objects 5\n", text)
+        self.assertIn("# TYPE pyelfs_latency_p95 gauge\n", text)
+
+    def test_percentile(self):
+        self.assertEqual(metrics.percentile([], 0.5), 0.0)
+        self.assertEqual(metrics.percentile(list(range(101)), 0.95), 95)
@@ -0,0 +1,43 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyelfs import object_cache
+
+OID = "bf3e3e2af9366a3b704ae0c31de5afa64193ebabffde2091936ad2e7510bc03a"
+
+
+class TestObjectCache(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.root = os.path.join(self.temp.name, "cache")
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def put(self, cache, oid, size):
+        with open(cache.prepare(oid), "wb") as f:
+            f.write(b"x" * size)
+
+    def test_lookup_and_serve(self):
+        cache = object_cache.ObjectCache(self.root)
+        self.assertIsNone(cache.lookup(OID, 10))
+        self.put(cache, OID, 10)
+        self.assertIsNone(cache.lookup(OID, 11))
+        self.assertEqual(cache.lookup(OID, 10), os.path.join(self.root, "bf", "3e", OID))
+        dst = os.path.join(self.temp.name, OID)
+        self.assertEqual(cache.serve(OID, dst), "hardlink")
+        self.assertEqual(os.path.getsize(dst), 10)
+
+    def test_evict(self):
+        cache = object_cache.ObjectCache(self.root, 25)
+        oids = [f"{i:02x}" * 32 for i in range(3)]
+        for i, oid in enumerate(oids):
+            self.put(cache, oid, 10)
+            os.utime(cache.path(oid), (1000 + i, 1000))
+        cache.lookup(oids[0], 10)
+        cache.evict()
+        self.assertTrue(os.path.exists(cache.path(oids[0])))
+        self.assertFalse(os.path.exists(cache.path(oids[1])))
+        self.assertTrue(os.path.exists(cache.path(oids[2])))
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import time
+from tempfile import TemporaryDirectory
+from threading import Barrier, Thread
+from unittest import TestCase
+from unittest.mock import patch
+
+from pyelfs.pack import LocalFs, PACK_DIR, PackStore, PackWriter
+from tests.local_sftp import LocalSftp
+
+
+def obj(content):
+    return hashlib.sha256(content).hexdigest(), content
+
+
+class TestPackStore(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.fs = LocalFs(self.temp.name)
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def test_append_and_read(self):
+        store = PackStore(100)
+        for content in (b"first", b"second"):
+            store.append(self.fs, *obj(content))
+        oid, content = obj(b"second")
+        self.assertEqual(store.read(self.fs, oid), content)
+        # Another process sees the same objects through the index files.
+        reader = PackStore()
+        self.assertEqual(reader.lookup(self.fs, oid)[1:], (5, 6))
+        self.assertEqual(reader.read(LocalSftp(self.temp.name), oid), content)
+        self.assertEqual(len(os.listdir(os.path.join(self.temp.name, PACK_DIR))), 3)
+        store.close()
+        self.assertEqual(len(os.listdir(os.path.join(self.temp.name, PACK_DIR))), 2)
+
+    def test_packed(self):
+        self.assertFalse(PackStore().packed(1))
+        self.assertTrue(PackStore(100).packed(99))
+        self.assertFalse(PackStore(100).packed(100))
+
+    def test_concurrent_appends_are_grouped(self):
+        store = PackStore(100)
+        commit = PackWriter.commit
+        barrier = Barrier(2, timeout=5)
+
+        def slow_commit(writer, fs, objects):
+            if len(objects) == 1 and objects[0][1] == b"0":
+                barrier.wait()
+            return commit(writer, fs, objects)
+
+        with patch.object(PackWriter, "commit", autospec=True, side_effect=slow_commit) as commits:
+            first = Thread(target=store.append, args=(self.fs, *obj(b"0")))
+            first.start()
+            threads = [Thread(target=store.append, args=(self.fs, *obj(str(i).encode()))) for i in range(1, 4)]
+            for thread in threads:
+                thread.start()
+            while len(store.queue) < 3:
+                time.sleep(0.01)
+            barrier.wait()
+            for thread in [first] + threads:
+                thread.join()
+        self.assertEqual([len(call[0][2]) for call in commits.call_args_list], [1, 3])
+
+    def test_rolls_over_to_new_pack(self):
+        store = PackStore(100, pack_size=8)
+        store.append(self.fs, *obj(b"12345"))
+        store.append(self.fs, *obj(b"67890"))
+        packs = [name for name in os.listdir(os.path.join(self.temp.name, PACK_DIR)) if name.endswith(".pack")]
+        self.assertEqual(len(packs), 2)
+
+    def test_torn_index_line(self):
+        store = PackStore(100)
+        oid, content = obj(b"object")
+        store.append(self.fs, oid, content)
+        with open(os.path.join(self.temp.name, PACK_DIR, f"{store.writer.name}.idx"), "a") as f:
+            f.write("abc 12")
+        self.assertEqual(PackStore().read(self.fs, oid), content)
+
+    def test_compact(self):
+        objects = [obj(str(i).encode()) for i in range(3)]
+        for oid, content in objects:
+            store = PackStore(100)
+            store.append(self.fs, oid, content)
+            store.close()
+        reader = PackStore()
+        reader.lookup(self.fs, objects[0][0])
+        self.assertEqual(PackStore().compact(self.fs, min_age=0), 3)
+        names = os.listdir(os.path.join(self.temp.name, PACK_DIR))
+        self.assertEqual(sorted(name.rsplit(".")[1] for name in names), ["idx", "pack"])
+        # A reader that loaded the old index finds the objects again.
+        for oid, content in objects:
+            self.assertEqual(reader.read(self.fs, oid), content)
+
+    def test_compact_skips_recent_packs(self):
+        for i in range(2):
+            store = PackStore(100)
+            store.append(self.fs, *obj(str(i).encode()))
+            store.close()
+        self.assertEqual(PackStore().compact(self.fs, min_age=3600), 0)
+        self.assertEqual(len(os.listdir(os.path.join(self.temp.name, PACK_DIR))), 4)
+
+    def test_compact_skips_leased_packs(self):
+        for i in range(2):
+            store = PackStore(100)
+            store.append(self.fs, *obj(str(i).encode()))
+            store.close()
+        live = PackStore(100)
+        live.append(self.fs, *obj(b"live"))
+        self.assertEqual(PackStore().compact(self.fs, min_age=0), 2)
+        # The live writer keeps appending to its pack, which compaction left alone.
+        live.append(self.fs, *obj(b"later"))
+        for content in (b"live", b"later"):
+            self.assertEqual(PackStore().read(self.fs, *obj(content)[:1]), content)
+
+    def test_idle_writer_starts_new_pack(self):
+        store = PackStore(100)
+        store.append(self.fs, *obj(b"first"))
+        first = store.writer.name
+        with patch.object(PackWriter, "idle_timeout", 0):
+            store.append(self.fs, *obj(b"second"))
+        self.assertNotEqual(store.writer.name, first)
+        names = os.listdir(os.path.join(self.temp.name, PACK_DIR))
+        self.assertNotIn(f"{first}.lease", names)
+        self.assertIn(f"{store.writer.name}.lease", names)
+
+    def test_lookup_reloads_on_miss(self):
+        reader = PackStore()
+        oid, content = obj(b"first")
+        self.assertIsNone(reader.lookup(self.fs, oid))
+        writer = PackStore(100)
+        writer.append(self.fs, oid, content)
+        writer.close()
+        self.assertIsNone(reader.lookup(self.fs, oid, 60))
+        reader.loaded_at -= 60
+        self.assertEqual(reader.lookup(self.fs, oid, 60)[1:], (0, 5))
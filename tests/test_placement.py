@@ -0,0 +1,27 @@
+import hashlib
+from unittest import TestCase
+
+from pyelfs.placement import Ring
+
+OIDS = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(2000)]
+
+
+class TestRing(TestCase):
+
+    def test_spreads_objects(self):
+        ring = Ring(["/a", "/b", "/c"])
+        counts = dict((root, 0) for root in ring.roots)
+        for oid in OIDS:
+            counts[ring.root_of(oid)] += 1
+        for count in counts.values():
+            self.assertGreater(count, len(OIDS) / 3 * 0.75)
+        self.assertEqual(sorted(ring.order(OIDS[0])), ["/a", "/b", "/c"])
+
+    def test_adding_root_moves_its_share(self):
+        before = Ring(["/a", "/b", "/c"])
+        after = Ring(["/a", "/b", "/c", "/d"])
+        moved = [oid for oid in OIDS if before.root_of(oid) != after.root_of(oid)]
+        self.assertTrue(all(after.root_of(oid) == "/d" for oid in moved))
+        self.assertLess(len(moved), len(OIDS) / 4 * 1.3)
+        # The previous owner is where reads fall back to.
+        self.assertTrue(all(after.order(oid)[1] == before.root_of(oid) for oid in moved))
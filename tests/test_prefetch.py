@@ -0,0 +1,102 @@
+import hashlib
+import os
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from git.repo import Repo
+
+from pyelfs import sftp_agent
+from pyelfs.file_agent import FileAgent
+from pyelfs.prefetch import parse_pointer, pointers, Prefetch
+from tests.local_sftp import LocalSftp
+
+DATA = b"lfs object"
+OID = hashlib.sha256(DATA).hexdigest()
+POINTER = f"version https://git-lfs.github.com/spec/v1\noid sha256:{OID}\nsize {len(DATA)}\n"
+
+
+class TestPrefetch(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.storage = os.path.join(self.temp.name, "storage")
+        self.work = os.path.join(self.temp.name, "work")
+        for d in (self.storage, self.work):
+            os.mkdir(d)
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(DATA)
+        list(FileAgent(self.storage, self.work).upload("upload", OID, len(DATA), path, None))
+        self.repo = Repo.init(os.path.join(self.temp.name, "repo"))
+        with open(os.path.join(self.repo.working_dir, "data.bin"), "w") as f:
+            f.write(POINTER)
+        with open(os.path.join(self.repo.working_dir, "README"), "w") as f:
+            f.write("not a pointer\n")
+        self.repo.index.add(["data.bin", "README"])
+        self.repo.index.commit("add an lfs object")
+        with self.repo.config_writer() as config:
+            config.set_value("lfs \"customtransfer.pyelfs\"", "args",
+                             f"file --lfs-storage-local pyelfs://{self.storage} --temp {self.work}")
+
+    def tearDown(self):
+        self.repo.close()
+        self.temp.cleanup()
+
+    def prefetch(self, *oids, rev="HEAD", repo=None):
+        with patch("sys.stdout", new_callable=StringIO) as out:
+            Prefetch(list(oids), rev, repo or self.repo.working_dir, 2).main_proc(None)
+        return out.getvalue()
+
+    def test_parse_pointer(self):
+        self.assertEqual(parse_pointer(POINTER.encode()), (OID, len(DATA)))
+        self.assertIsNone(parse_pointer(b"not a pointer"))
+        self.assertIsNone(parse_pointer(POINTER.replace("size 10", "size x").encode()))
+
+    def test_fetches_objects_of_revision(self):
+        out = self.prefetch()
+        self.assertIn("1 objects were fetched, 0 were present", out)
+        stored = os.path.join(self.repo.git_dir, "lfs", "objects", OID[0:2], OID[2:4], OID)
+        with open(stored, "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertIn("0 objects were fetched, 1 were present", self.prefetch())
+
+    def test_range(self):
+        with open(os.path.join(self.repo.working_dir, "other.bin"), "w") as f:
+            f.write(POINTER.replace(OID, "0" * 64))
+        self.repo.index.add(["other.bin"])
+        self.repo.index.commit("add another lfs object")
+        # Commits of the range reference their whole tree, not only what they changed.
+        self.assertEqual(pointers(self.repo, "HEAD~1..HEAD"), {OID: len(DATA), "0" * 64: len(DATA)})
+        self.assertEqual(pointers(self.repo, "HEAD~1"), {OID: len(DATA)})
+
+    def test_linked_worktree_and_storage(self):
+        worktree = os.path.join(self.temp.name, "worktree")
+        self.repo.git.worktree("add", worktree)
+        self.assertIn("1 objects were fetched", self.prefetch(repo=worktree))
+        self.assertTrue(os.path.isfile(os.path.join(self.repo.git_dir, "lfs", "objects", OID[0:2], OID[2:4], OID)))
+        storage = os.path.join(self.temp.name, "lfs-storage")
+        with self.repo.config_writer() as config:
+            config.set_value("lfs", "storage", storage)
+        self.assertIn("1 objects were fetched", self.prefetch(repo=worktree))
+        self.assertTrue(os.path.isfile(os.path.join(storage, "objects", OID[0:2], OID[2:4], OID)))
+
+    def test_fails_on_missing_object(self):
+        with self.assertRaises(SystemExit):
+            self.prefetch(f"{'0' * 64}:10")
+
+    @patch.object(sftp_agent, "SftpPool")
+    def test_oid_without_size(self, pool):
+        pool.return_value.connection.return_value.__enter__.return_value = LocalSftp(self.storage)
+        agent = sftp_agent.SftpAgent("elf", "localhost", 22, "~/.ssh/id_rsa", "/srv/lfs", self.work)
+        with patch.object(Prefetch, "agent", return_value=agent):
+            self.assertIn("1 objects were fetched", self.prefetch(OID))
+            self.assertIn("1 were present", self.prefetch(OID))
+        stored = os.path.join(self.repo.git_dir, "lfs", "objects", OID[0:2], OID[2:4], OID)
+        with open(stored, "wb") as f:
+            f.write(b"truncated")
+        with patch.object(Prefetch, "agent", return_value=agent):
+            self.assertIn("1 objects were fetched", self.prefetch(OID))
+        with open(stored, "rb") as f:
+            self.assertEqual(f.read(), DATA)
@@ -0,0 +1,52 @@
+import json
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from pyelfs import progress
+from pyelfs.util import EventWriter
+
+
+class TestProgress(TestCase):
+
+    def setUp(self):
+        self.writer = EventWriter()
+        self.events = []
+        self.writer.write = lambda res, flush=True: self.events.append(json.loads(res))
+
+    def test_byte_threshold(self):
+        p = progress.Progress("oid", 100 << 20, self.writer)
+        p.interval = float("inf")
+        for byte_so_far in range(0, 100 << 20, 1 << 16):
+            p.progress_callback(byte_so_far, 100 << 20)
+        p.progress_callback(100 << 20, 100 << 20)
+        self.assertEqual(len(self.events), 100)
+        self.assertEqual(sum(e["bytesSinceLast"] for e in self.events), 100 << 20)
+        self.assertEqual(self.events[-1]["byteSoFar"], 100 << 20)
+
+    def test_time_threshold(self):
+        p = progress.Progress("oid", 100 << 20, self.writer)
+        p.interval = 0
+        p.add(10)
+        p.add(10)
+        p.add(0)
+        self.assertEqual([e["byteSoFar"] for e in self.events], [10, 20])
+
+    def test_small_object(self):
+        p = progress.Progress("oid", 100, self.writer)
+        for n in range(10):
+            p.add(10)
+        self.assertEqual(self.events, [{"event": "progress", "oid": "oid", "byteSoFar": 100, "bytesSinceLast": 100}])
+
+
+class TestEventWriter(TestCase):
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_coalesce(self, stdout):
+        writer = EventWriter()
+        writer.flush_interval = float("inf")
+        writer.write("progress", flush=False)
+        writer.write("progress", flush=False)
+        self.assertEqual(stdout.getvalue(), "")
+        writer.write("complete")
+        self.assertEqual(stdout.getvalue(), "progress\nprogress\ncomplete\n")
@@ -0,0 +1,21 @@
+import json
+from unittest import TestCase
+
+from pyelfs import protocol
+
+OID = "bf3e3e2af9366a3b704ae0c31de5afa64193ebabffde2091936ad2e7510bc03a"
+
+
+class TestProtocol(TestCase):
+
+    def test_templates(self):
+        self.assertEqual(json.loads(protocol.complete(OID)), {"event": "complete", "oid": OID})
+        path = 'C:\\temp\\"lfs"\\' + OID
+        self.assertEqual(json.loads(protocol.complete(OID, path)), {"event": "complete", "oid": OID, "path": path})
+        self.assertEqual(json.loads(protocol.progress(OID, 10, 4)),
+                         {"event": "progress", "oid": OID, "byteSoFar": 10, "bytesSinceLast": 4})
+        self.assertEqual(json.loads(protocol.TERMINATE), {"event": "terminate"})
+
+    def test_events(self):
+        lines = [b'{"event": "init"}\n', b"\n", b"not json\n", '{"event": "terminate"}\n']
+        self.assertEqual(list(protocol.events(lines)), [{"event": "init"}, {"event": "terminate"}])
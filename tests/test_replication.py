@@ -0,0 +1,92 @@
+import hashlib
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from pyelfs import sftp_agent
+from pyelfs.replication import endpoint
+from .local_sftp import LocalSftp
+
+CONTENT = b"replicated lfs object"
+OID = hashlib.sha256(CONTENT).hexdigest()
+
+
+class TestReplication(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.roots = {}
+        for host in "abc":
+            self.roots[host] = os.path.join(self.temp.name, host)
+            os.mkdir(self.roots[host])
+        self.path = os.path.join(self.temp.name, "object")
+        with open(self.path, "wb") as f:
+            f.write(CONTENT)
+        patcher = patch.object(sftp_agent, "SftpPool", side_effect=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def pool(self, user, hostname, port, rsa_key, remote_dir, size, **kwargs):
+        pool = MagicMock()
+        pool.connection.return_value.__enter__.return_value = LocalSftp(self.roots[hostname])
+        return pool
+
+    def agent(self, **kwargs):
+        return sftp_agent.SftpAgent("elf", "a", 22, "~/.ssh/id_rsa", "/lfs", self.temp.name,
+                                    replicas="sftp://b,sftp://c:2222/other", **kwargs)
+
+    def stored(self, host):
+        return os.path.exists(os.path.join(self.roots[host], OID[0:2], OID[2:4], OID))
+
+    def test_endpoint(self):
+        self.assertEqual(endpoint("sftp://git@mirror:2222/srv/lfs", "elf", 22, "/lfs"),
+                         ("git", "mirror", 2222, "/srv/lfs"))
+        self.assertEqual(endpoint("mirror", "elf", 22, "/lfs"), ("elf", "mirror", 22, "/lfs"))
+
+    def test_only_endpoints_index_and_cache(self):
+        with patch.object(sftp_agent, "RemoteIndex") as index, patch.object(sftp_agent, "ObjectCache") as cache:
+            agent = self.agent(index_cache=os.path.join(self.temp.name, "index.json"),
+                               cache_dir=os.path.join(self.temp.name, "cache"))
+        self.assertIsNone(agent.index)
+        self.assertIsNone(agent.cache)
+        self.assertEqual(index.call_count, 3)
+        self.assertEqual(cache.call_count, 3)
+        # The cache file belongs to no single endpoint, so none of them loads it.
+        self.assertTrue(all(call[0][1] is None for call in index.call_args_list))
+
+    def test_upload_reaches_quorum(self):
+        os.rmdir(self.roots["c"])
+        open(self.roots["c"], "w").close()
+        agent = self.agent()
+        self.assertEqual([a.hostname for a in agent.replicas.agents], ["a", "b", "c"])
+        self.assertEqual(agent.replicas.quorum, 2)
+        list(agent.upload("upload", OID, len(CONTENT), self.path, None))
+        list(agent.terminate())
+        self.assertTrue(self.stored("a") and self.stored("b"))
+        with self.assertRaises(OSError):
+            list(self.agent(write_quorum=3).upload("upload", OID, len(CONTENT), self.path, None))
+
+    def test_download_fails_over(self):
+        agent = sftp_agent.SftpAgent("elf", "b", 22, "~/.ssh/id_rsa", "/lfs", self.temp.name)
+        list(agent.upload("upload", OID, len(CONTENT), self.path, None))
+        os.remove(self.path)
+        agent = self.agent()
+        latency = {"a": 0.01, "b": 0.2, "c": 0.1}
+        with patch.object(agent.replicas, "probe", side_effect=lambda a: latency[a.hostname]):
+            self.assertEqual([a.hostname for a in agent.replicas.ranked(1)], ["a", "c", "b"])
+            list(agent.download("download", OID, len(CONTENT), None))
+        with open(os.path.join(self.temp.name, OID), "rb") as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_large_objects_prefer_throughput(self):
+        replicas = self.agent().replicas
+        replicas.latency = dict(zip(replicas.agents, [0.01, 0.2, 0.1]))
+        replicas.measured(replicas.agents[0], 100 << 20, 10.0)
+        replicas.measured(replicas.agents[1], 100 << 20, 1.0)
+        replicas.measured(replicas.agents[2], 100 << 20, 5.0)
+        self.assertEqual([a.hostname for a in replicas.ranked(1 << 10)], ["a", "c", "b"])
+        self.assertEqual([a.hostname for a in replicas.ranked(1 << 30)], ["b", "c", "a"])
@@ -0,0 +1,23 @@
+import errno
+import socket
+from unittest import TestCase
+
+from pyelfs.integrity import IntegrityError
+from pyelfs.retry import RetryPolicy, transient
+
+
+class TestRetry(TestCase):
+
+    def test_transient(self):
+        for e in (ConnectionResetError(), EOFError(), socket.timeout(), OSError(errno.EPIPE, "Broken pipe")):
+            self.assertTrue(transient(e), e)
+        for e in (FileNotFoundError(errno.ENOENT, "missing"), PermissionError(errno.EACCES, "denied"),
+                  IntegrityError("mismatch"), OSError("Failure"), ValueError()):
+            self.assertFalse(transient(e), e)
+        self.assertTrue(transient(KeyError(), (KeyError,)))
+
+    def test_backoff(self):
+        policy = RetryPolicy(5, 0.5, 3.0)
+        for attempt, limit in enumerate([0.5, 1.0, 2.0, 3.0, 3.0]):
+            for _ in range(20):
+                self.assertTrue(0 <= policy.backoff(attempt) <= limit)
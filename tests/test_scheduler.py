@@ -0,0 +1,88 @@
+from unittest import TestCase
+
+from pyelfs.scheduler import Scheduler
+
+
+class ManualExecutor:
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args):
+        self.submitted.append((func, args))
+
+    def run_next(self, oid=None):
+        i = 0 if oid is None else [args[0]["oid"] for _, args in self.submitted].index(oid)
+        func, args = self.submitted.pop(i)
+        func(*args)
+
+
+def request(oid, size, event="upload"):
+    return {"event": event, "oid": oid, "size": size, "path": oid, "action": None}
+
+
+class TestScheduler(TestCase):
+
+    def setUp(self):
+        self.executor = ManualExecutor()
+        self.transferred = []
+        self.prepared = []
+
+    def scheduler(self, small_workers=2, large_streams=0, small_size=None, max_bytes=None):
+        return Scheduler(self.executor, lambda data, record: self.transferred.append(data["oid"]),
+                         small_workers, large_streams, small_size, max_bytes,
+                         lambda batch: self.prepared.append([d["oid"] for d in batch]))
+
+    def started(self):
+        return [args[0]["oid"] for _, args in self.executor.submitted]
+
+    def test_limits_objects(self):
+        scheduler = self.scheduler()
+        for oid in "abc":
+            scheduler.put(request(oid, 1))
+        self.assertEqual(self.started(), ["a", "b"])
+        self.executor.run_next()
+        self.assertEqual(self.transferred, ["a"])
+        self.assertEqual(self.started(), ["b", "c"])
+
+    def test_small_objects_overtake_large_one(self):
+        scheduler = self.scheduler(max_bytes=100)
+        scheduler.put(request("small", 60))
+        scheduler.put(request("large", 1000))
+        scheduler.put(request("tiny", 10))
+        self.assertEqual(self.started(), ["small", "tiny"])
+        self.executor.run_next()
+        self.assertEqual(self.started(), ["tiny"])
+        self.executor.run_next()
+        self.assertEqual(self.started(), ["large"])
+        self.assertEqual(scheduler.bytes, 1000)
+
+    def test_large_objects_get_dedicated_streams(self):
+        scheduler = self.scheduler(small_workers=1, large_streams=1, small_size=100)
+        for oid, size in [("big1", 1000), ("big2", 1000), ("s1", 1), ("s2", 1)]:
+            scheduler.put(request(oid, size))
+        self.assertEqual(self.started(), ["big1", "s1"])
+        self.executor.run_next("s1")
+        self.assertEqual(self.started(), ["big1", "s2"])
+        self.executor.run_next("big1")
+        self.assertEqual(self.started(), ["s2", "big2"])
+
+    def test_small_objects_are_prepared_in_batches(self):
+        scheduler = self.scheduler(small_workers=1, large_streams=1, small_size=100)
+        for oid, size in [("a", 1), ("b", 1), ("big", 1000), ("c", 1), ("d", 1, )]:
+            scheduler.put(request(oid, size))
+        scheduler.put(request("e", 1, "download"))
+        while self.executor.submitted:
+            self.executor.run_next()
+        self.assertEqual(self.prepared, [["b", "c", "d"]])
+        self.assertEqual(sorted(self.transferred), ["a", "b", "big", "c", "d", "e"])
+        scheduler.drain()
+        self.assertEqual(scheduler.prepared, set())
+
+    def test_drain(self):
+        scheduler = self.scheduler()
+        scheduler.put(request("a", 1))
+        self.executor.run_next()
+        scheduler.drain()
+        self.assertEqual(scheduler.objects, 0)
+        self.assertEqual(scheduler.bytes, 0)
@@ -1,16 +1,38 @@
+import hashlib
 import json
+import os
 from getpass import getuser
 from os.path import expanduser
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from threading import Barrier, Thread
+
+from paramiko import AuthenticationException, BadHostKeyException, SSHException
 
 from pyelfs import sftp_agent
+from pyelfs.integrity import IntegrityError
+from .local_sftp import LocalSftp
+
+
+class BrokenSftp(LocalSftp):
+
+    def open(self, path, mode="r"):
+        if mode == "r+":
+            raise IOError("Socket is closed")
+        return super().open(path, mode)
 
 
 class TestSftpAgent(TestCase):
-    agent = sftp_agent.SftpAgent(
-        "elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects", "temp")
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.agent = sftp_agent.SftpAgent(
+            "elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects", self.temp.name)
+
+    def tearDown(self):
+        self.temp.cleanup()
 
     def test_init(self):
         stdin_init = '{ ' \
@@ -24,8 +46,8 @@ class TestSftpAgent(TestCase):
         for res in self.agent.init(**stdin_init):
             self.assertEqual("{}", res)
 
-    @patch.object(sftp_agent, "SftpAuth")
-    def test_upload(self, auth):
+    @patch.object(sftp_agent, "SftpPool")
+    def test_upload(self, pool):
         stdin_upload = '{ ' \
                        '"event": "upload", ' \
                        '"oid": ' \
@@ -46,22 +68,25 @@ class TestSftpAgent(TestCase):
                          '"oid": '
                          '"bf3e3e2af9366a3b704ae0c31de5afa64193ebabffde2091936ad2e7510bc03a"'
                          '}')
-        auth.assert_called_once_with(
-            "elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects")
+        pool.assert_called_once_with(
+            "elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects", 1,
+            channels=1, window_size=None, max_packet_size=None)
 
-    @patch.object(sftp_agent, "SftpAuth")
-    def test_download(self, auth):
+    @patch.object(sftp_agent, "SftpPool")
+    def test_download(self, pool):
         stdin_download = '{ ' \
                          '"event": "download", ' \
                          '"oid": ' \
-                         '"22ab5f63670800cc7be06dbed816012b0dc411e774754c7579467d2536a9cf3e", ' \
-                         '"size": 21245, ' \
+                         '"781f1a15e191cad9de5075c2b566ba2b9bd286e33f2d5d4f1511d411e67aeb23", ' \
+                         '"size": 10, ' \
                          '"action": { ' \
                          '"href": "nfs://server/path", ' \
                          '"header": { "key": "value" } ' \
                          '} ' \
                          '}'
         stdin_download = json.loads(stdin_download)
+        sftp = pool.return_value.connection.return_value.__enter__.return_value
+        sftp.getfo.side_effect = lambda remote_path, f, callback: f.write(b"lfs object")
         generator = self.agent.download(**stdin_download)
         res = next(generator)
         res = json.loads(res)
@@ -69,17 +94,278 @@ class TestSftpAgent(TestCase):
         exp = '{' \
               '"event": "complete", ' \
               '"oid": ' \
-              '"22ab5f63670800cc7be06dbed816012b0dc411e774754c7579467d2536a9cf3e", ' \
+              '"781f1a15e191cad9de5075c2b566ba2b9bd286e33f2d5d4f1511d411e67aeb23", ' \
               '"path": ' \
               '"/var/folders/nw/2kgc3k852755dtjv0mfm05z00000gn/T' \
-              '/22ab5f63670800cc7be06dbed816012b0dc411e774754c7579467d2536a9cf3e"' \
+              '/781f1a15e191cad9de5075c2b566ba2b9bd286e33f2d5d4f1511d411e67aeb23"' \
               '}'
         exp = json.loads(exp)
         exp["path"] = None
         for k, v in res.items():
             self.assertEqual(v, exp[k])
-        auth.assert_called_once_with(
-            "elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects")
+        pool.assert_called_once_with(
+            "elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects", 1,
+            channels=1, window_size=None, max_packet_size=None)
+
+    @patch.object(sftp_agent, "SftpPool")
+    def test_download_verification(self, pool):
+        oid = "781f1a15e191cad9de5075c2b566ba2b9bd286e33f2d5d4f1511d411e67aeb23"
+        sftp = pool.return_value.connection.return_value.__enter__.return_value
+        sftp.getfo.side_effect = lambda remote_path, f, callback: f.write(b"broken object")
+        with self.assertRaises(IntegrityError):
+            list(self.agent.download("download", oid, 10, None))
+        self.assertEqual(os.listdir(self.temp.name), [])
+
+        sftp.getfo.side_effect = lambda remote_path, f, callback: f.write(b"lfs object")
+        list(self.agent.download("download", oid, 10, None))
+        list(self.agent.download("download", oid, 10, None))
+        self.assertEqual(sftp.getfo.call_count, 2)
+        self.assertEqual(os.listdir(self.temp.name), [oid])
+
+    def test_resumable_upload(self):
+        content = os.urandom(1 << 16)
+        oid = hashlib.sha256(content).hexdigest()
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(content)
+        remote = os.path.join(self.temp.name, "remote")
+        os.makedirs(os.path.join(remote, oid[0:2], oid[2:4]))
+        remote_path = f"{oid[0:2]}/{oid[2:4]}/{oid}"
+        with open(os.path.join(remote, f"{remote_path}.partial"), "wb") as f:
+            f.write(content[:1000])
+        progress = []
+        self.agent.put_resumable(LocalSftp(remote), oid, len(content), path, remote_path,
+                                 lambda so_far, size: progress.append(so_far))
+        with open(os.path.join(remote, remote_path), "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(os.path.exists(os.path.join(remote, f"{remote_path}.partial")))
+        self.assertEqual(progress, [len(content)])
+
+    def put_over_partial(self, prefix, locked=False):
+        content = os.urandom(1 << 16)
+        oid = hashlib.sha256(content).hexdigest()
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(content)
+        remote = os.path.join(self.temp.name, "remote")
+        os.makedirs(os.path.join(remote, oid[0:2], oid[2:4]))
+        remote_path = f"{oid[0:2]}/{oid[2:4]}/{oid}"
+        partial = os.path.join(remote, f"{remote_path}.partial")
+        with open(partial, "wb") as f:
+            f.write(prefix)
+        if locked:
+            open(f"{partial}.lock", "wb").close()
+        self.agent.put_resumable(LocalSftp(remote), oid, len(content), path, remote_path, lambda so_far, size: None)
+        with open(os.path.join(remote, remote_path), "rb") as f:
+            self.assertEqual(f.read(), content)
+        return os.listdir(os.path.dirname(partial))
+
+    def test_resumable_upload_over_foreign_partial(self):
+        names = self.put_over_partial(b"\0" * 1000)
+        self.assertEqual(len(names), 1)
+
+    def test_resumable_upload_beside_locked_partial(self):
+        names = self.put_over_partial(b"\0" * 1000, locked=True)
+        # The partial of the other writer is left to it.
+        self.assertEqual(sorted(name.split(".", 1)[1:] for name in names), [[], ["partial"], ["partial.lock"]])
+
+    def test_resumable_upload_takes_over_stale_lock(self):
+        with patch.object(sftp_agent, "LOCK_TTL", 0):
+            names = self.put_over_partial(b"\0" * 1000, locked=True)
+        self.assertEqual(len(names), 1)
+
+    @patch.object(sftp_agent, "SftpPool")
+    def test_resumable_download(self, pool):
+        content = os.urandom(1 << 16)
+        oid = hashlib.sha256(content).hexdigest()
+        remote = os.path.join(self.temp.name, "remote")
+        os.makedirs(os.path.join(remote, oid[0:2], oid[2:4]))
+        with open(os.path.join(remote, oid[0:2], oid[2:4], oid), "wb") as f:
+            f.write(content)
+        temp_path = os.path.join(self.temp.name, oid)
+        with open(f"{temp_path}.partial", "wb") as f:
+            f.write(content[:1000])
+        pool.return_value.connection.return_value.__enter__.return_value = LocalSftp(remote)
+        self.agent.resume_threshold = 0
+        list(self.agent.download("download", oid, len(content), None))
+        with open(temp_path, "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(os.path.exists(f"{temp_path}.partial"))
+
+    @patch.object(sftp_agent, "SftpPool")
+    def test_packed_objects(self, pool):
+        content = os.urandom(1000)
+        oid = hashlib.sha256(content).hexdigest()
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(content)
+        remote = os.path.join(self.temp.name, "remote")
+        os.mkdir(remote)
+        pool.return_value.connection.return_value.__enter__.return_value = LocalSftp(remote)
+        pool.return_value.acquire.return_value = (None, LocalSftp(remote))
+        self.agent.packs.threshold = 4096
+        list(self.agent.upload("upload", oid, len(content), path, None))
+        self.assertEqual(os.listdir(remote), ["packs"])
+        list(self.agent.terminate())
+        pool.return_value.release.assert_called_once_with(pool.return_value.acquire.return_value)
+        agent = sftp_agent.SftpAgent(
+            "elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects", self.temp.name)
+        list(agent.download("download", oid, len(content), None))
+        with open(os.path.join(self.temp.name, oid), "rb") as f:
+            self.assertEqual(f.read(), content)
+
+    def test_packed_uploads_share_pool(self):
+        remote = os.path.join(self.temp.name, "remote")
+        os.mkdir(remote)
+        self.agent.packs.threshold = 4096
+        list(self.agent.init("init", "upload", "origin", True, 2))
+        contents = [os.urandom(1000) for _ in range(3 * self.agent.pool.size)]
+        paths = []
+        for i, content in enumerate(contents):
+            paths.append(os.path.join(self.temp.name, f"object{i}"))
+            with open(paths[-1], "wb") as f:
+                f.write(content)
+        # Clients of a daemon run their own executors, so uploads may outnumber the sessions.
+        barrier = Barrier(len(contents), timeout=2)
+        lookup = self.agent.packs.lookup
+
+        def meet(*args):
+            barrier.wait()
+            return lookup(*args)
+
+        with patch.object(self.agent.pool, "connect", side_effect=lambda: (Mock(), LocalSftp(remote))), \
+                patch.object(self.agent.packs, "lookup", side_effect=meet):
+            threads = [Thread(target=list, args=(self.agent.upload("upload", hashlib.sha256(content).hexdigest(),
+                                                                   len(content), path, None),), daemon=True)
+                       for content, path in zip(contents, paths)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+            list(self.agent.terminate())
+        self.assertEqual(len(sftp_agent.PackStore().load(LocalSftp(remote))), len(contents))
+
+    @patch.object(sftp_agent, "SftpPool")
+    def test_compressed_objects(self, pool):
+        content = b"".join(b"%d,row,%d\n" % (i, i * 3) for i in range(20000))
+        oid = hashlib.sha256(content).hexdigest()
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(content)
+        remote = os.path.join(self.temp.name, "remote")
+        os.mkdir(remote)
+        pool.return_value.connection.return_value.__enter__.return_value = LocalSftp(remote)
+        agent = sftp_agent.SftpAgent(
+            "elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects", self.temp.name, compression="zlib")
+        list(agent.upload("upload", oid, len(content), path, None))
+        stored = os.path.join(remote, oid[0:2], oid[2:4], f"{oid}.zz")
+        self.assertLess(os.path.getsize(stored), len(content) / 3)
+        self.assertEqual(os.listdir(os.path.dirname(stored)), [f"{oid}.zz"])
+        # An agent without --compression still reads it.
+        list(self.agent.download("download", oid, len(content), None))
+        with open(os.path.join(self.temp.name, oid), "rb") as f:
+            self.assertEqual(f.read(), content)
+        with patch.object(agent, "put_compressed") as put_compressed:
+            list(agent.upload("upload", oid, len(content), path, None))
+            put_compressed.assert_not_called()
+
+    def test_rename_keeps_published_object(self):
+        remote = os.path.join(self.temp.name, "remote")
+        os.mkdir(remote)
+        with open(os.path.join(remote, "object"), "wb") as f:
+            f.write(b"published")
+        sftp = LocalSftp(remote)
+        # A server without posix-rename, and a partial another agent already renamed.
+        with patch.object(sftp, "posix_rename", side_effect=IOError("Failure")):
+            with self.assertRaises(IOError):
+                sftp_agent.SftpAgent.rename(sftp, "object.partial", "object")
+        with open(os.path.join(remote, "object"), "rb") as f:
+            self.assertEqual(f.read(), b"published")
+
+    @patch.object(sftp_agent, "SftpPool")
+    def test_segmented_transfer(self, pool):
+        content = os.urandom(3 << 20 | 12345)
+        oid = hashlib.sha256(content).hexdigest()
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(content)
+        remote = os.path.join(self.temp.name, "remote")
+        os.mkdir(remote)
+        sessions = [LocalSftp(remote) for _ in range(3)]
+        pool.return_value.connection.return_value.__enter__.return_value = sessions[0]
+        pool.return_value.connections.return_value.__enter__.return_value = sessions
+        self.agent.segments = 3
+        self.agent.segment_threshold = 0
+        with patch.object(sftp_agent, "sha256_file") as sha256_file:
+            list(self.agent.upload("upload", oid, len(content), path, None))
+        # The object is hashed while it is read for the upload.
+        sha256_file.assert_not_called()
+        with open(os.path.join(remote, oid[0:2], oid[2:4], oid), "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(os.path.join(remote, oid[0:2], oid[2:4])), [oid])
+
+        os.remove(path)
+        list(self.agent.download("download", oid, len(content), None))
+        with open(os.path.join(self.temp.name, oid), "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(sorted(os.listdir(self.temp.name)), sorted([oid, "remote"]))
+
+    def test_segmented_upload_failure(self):
+        content = os.urandom(3 << 20)
+        path = os.path.join(self.temp.name, "object")
+        with open(path, "wb") as f:
+            f.write(content)
+        remote = os.path.join(self.temp.name, "remote")
+        os.makedirs(os.path.join(remote, "ab"))
+        sessions = [LocalSftp(remote), BrokenSftp(remote)]
+        with self.assertRaises(IOError):
+            self.agent.put_segmented(sessions, "ab" * 32, len(content), path, f"ab/{'ab' * 32}", Mock())
+        self.assertEqual(os.listdir(os.path.join(remote, "ab")), [])
+
+    @patch.object(sftp_agent, "SftpPool")
+    def test_cache(self, pool):
+        oid = "781f1a15e191cad9de5075c2b566ba2b9bd286e33f2d5d4f1511d411e67aeb23"
+        sftp = pool.return_value.connection.return_value.__enter__.return_value
+        sftp.getfo.side_effect = lambda remote_path, f, callback: f.write(b"lfs object")
+        cache_dir = os.path.join(self.temp.name, "cache")
+        for name in ("first", "second"):
+            temp = os.path.join(self.temp.name, name)
+            os.mkdir(temp)
+            agent = sftp_agent.SftpAgent("elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects", temp,
+                                         cache_dir=cache_dir)
+            list(agent.download("download", oid, 10, None))
+            with open(os.path.join(temp, oid), "rb") as f:
+                self.assertEqual(f.read(), b"lfs object")
+        sftp.getfo.assert_called_once()
+        self.assertTrue(os.path.isfile(os.path.join(cache_dir, oid[0:2], oid[2:4], oid)))
+
+    def test_transient(self):
+        for e in (SSHException("Error reading SSH protocol banner"), IOError("Socket is closed")):
+            self.assertTrue(self.agent.transient(e), e)
+        for e in (AuthenticationException("bad key"), BadHostKeyException("localhost", Mock(), Mock()),
+                  IOError("No such file")):
+            self.assertFalse(self.agent.transient(e), e)
+
+    def test_ranges(self):
+        self.assertEqual(sftp_agent.SftpAgent.ranges(10, 4), [(0, 10)])
+        self.assertEqual(sftp_agent.SftpAgent.ranges(5 << 20, 2), [(0, 3 << 20), (3 << 20, 2 << 20)])
+
+    @patch.object(sftp_agent, "SftpPool")
+    def test_pool_is_shared(self, pool):
+        for res in self.agent.init("init", "upload", "origin", True, 8):
+            self.assertEqual("{}", res)
+        oid = "bf3e3e2af9366a3b704ae0c31de5afa64193ebabffde2091936ad2e7510bc03a"
+        for _ in range(3):
+            list(self.agent.upload("upload", oid, 346232, "/path/to/file.png", None))
+        # Eight small-object workers and two large-object streams.
+        pool.assert_called_once_with(
+            "elf", "localhost", 22, "~/.ssh/id_rsa", "/home/elf/.lfs-objects", 10,
+            channels=1, window_size=None, max_packet_size=None)
+        self.assertEqual(pool.return_value.connection.call_count, 3)
+        list(self.agent.terminate())
+        pool.return_value.close.assert_called_once_with()
+        self.assertIsNone(self.agent.pool)
 
     def test_terminate(self):
         for res in self.agent.terminate():
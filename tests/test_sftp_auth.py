@@ -1,7 +1,9 @@
 from unittest import TestCase
-from unittest.mock import patch
+from threading import Barrier
+from unittest.mock import MagicMock, patch
 
 from pyelfs import sftp_auth
+from pyelfs.metrics import TransferRecord
 
 
 class TestSftpAuth(TestCase):
@@ -17,3 +19,99 @@ class TestSftpAuth(TestCase):
         transport.assert_called_once_with("localhost:22")
         transport.auth_publickey("elf", rsa_key.return_value)
         rsa_key.assert_called_once_with("~/.ssh/rsa_id")
+
+
+class TestSftpPool(TestCase):
+
+    def setUp(self):
+        self.pool = sftp_auth.SftpPool("elf", "localhost", 22, "~/.ssh/rsa_id", "/home/elf/.lfs-objects")
+
+    @patch.object(sftp_auth, "SftpAuth")
+    def test_reuse(self, auth):
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        auth.assert_called_once_with("elf", "localhost", 22, "~/.ssh/rsa_id", "/home/elf/.lfs-objects",
+                                     None, None)
+        auth.return_value.open.assert_called_once_with()
+
+    @patch.object(sftp_auth, "SftpAuth")
+    def test_reconnect(self, auth):
+        with self.pool.connection():
+            pass
+        auth.return_value.is_active.return_value = False
+        with self.pool.connection():
+            pass
+        self.assertEqual(auth.call_count, 2)
+        auth.return_value.close.assert_called()
+
+    @patch.object(sftp_auth, "SftpAuth")
+    def test_close(self, auth):
+        with self.pool.connection():
+            pass
+        self.pool.close()
+        auth.return_value.close.assert_called_once_with()
+        with self.assertRaises(RuntimeError):
+            self.pool.acquire()
+
+    @patch.object(sftp_auth, "SftpAuth")
+    def test_channels(self, auth):
+        auth.return_value.channels = []
+        auth.return_value.open.side_effect = lambda: auth.return_value.channels.append("first") or "first"
+        auth.return_value.open_channel.side_effect = lambda: auth.return_value.channels.append("second") or "second"
+        pool = sftp_auth.SftpPool("elf", "localhost", 22, "~/.ssh/rsa_id", "/home/elf/.lfs-objects",
+                                  size=2, channels=2, window_size=1 << 24)
+        with pool.connection() as first, pool.connection() as second:
+            self.assertEqual((first, second), ("first", "second"))
+        auth.assert_called_once_with("elf", "localhost", 22, "~/.ssh/rsa_id", "/home/elf/.lfs-objects",
+                                     1 << 24, None)
+
+    @patch.object(sftp_auth, "SftpAuth")
+    def test_connections(self, auth):
+        pool = sftp_auth.SftpPool("elf", "localhost", 22, "~/.ssh/rsa_id", "/home/elf/.lfs-objects", size=3)
+        with pool.connection():
+            with pool.connections(4) as sessions:
+                self.assertEqual(len(sessions), 2)
+                with pool.connections(1, block=False) as extra:
+                    self.assertEqual(extra, [])
+        self.assertEqual(len(pool.idle), 3)
+
+    @patch.object(sftp_auth, "SftpAuth")
+    def test_transports_are_dialed_side_by_side(self, auth):
+        barrier = Barrier(2, timeout=5)
+
+        def new_auth(*args):
+            transport = MagicMock()
+            transport.channels = []
+
+            def open():
+                # Both handshakes have to be in flight at once to pass the barrier.
+                barrier.wait()
+                transport.channels.append("first")
+                return "first"
+
+            transport.open.side_effect = open
+            transport.open_channel.side_effect = lambda: transport.channels.append("second") or "second"
+            return transport
+
+        auth.side_effect = new_auth
+        pool = sftp_auth.SftpPool("elf", "localhost", 22, "~/.ssh/rsa_id", "/home/elf/.lfs-objects",
+                                  size=4, channels=2)
+        with pool.connections(4) as sessions:
+            self.assertEqual(sorted(sessions), ["first", "first", "second", "second"])
+        self.assertEqual(auth.call_count, 2)
+
+
+class TestMeteredSFTPClient(TestCase):
+
+    @patch.object(sftp_auth.SFTPClient, "_request")
+    def test_counts_requests(self, request):
+        record = TransferRecord("0", "upload", 1)
+        sftp = sftp_auth.MeteredSFTPClient.__new__(sftp_auth.MeteredSFTPClient)
+        with sftp_auth.transfer_metrics.attached(record):
+            sftp._request(1)
+            sftp._request(2)
+        self.assertEqual(record.round_trips, 2)
+        self.assertEqual(request.call_count, 2)
@@ -0,0 +1,94 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from pyelfs import sftp_index
+
+OID = "bf3e3e2af9366a3b704ae0c31de5afa64193ebabffde2091936ad2e7510bc03a"
+
+
+def attr(filename, st_size):
+    a = MagicMock()
+    a.filename = filename
+    a.st_size = st_size
+    return a
+
+
+class TestRemoteIndex(TestCase):
+
+    def test_lookup(self):
+        sftp = MagicMock()
+        sftp.listdir_attr.return_value = [attr(OID, 10)]
+        index = sftp_index.RemoteIndex("elf@localhost:22/lfs")
+        self.assertEqual(index.lookup(sftp, OID), 10)
+        self.assertIsNone(index.lookup(sftp, "bf3e" + "0" * 60))
+        sftp.listdir_attr.assert_called_once_with("bf/3e")
+
+    def test_missing_shard(self):
+        sftp = MagicMock()
+        sftp.listdir_attr.side_effect = IOError("No such file")
+        index = sftp_index.RemoteIndex("elf@localhost:22/lfs")
+        self.assertIsNone(index.lookup(sftp, OID))
+        sftp.mkdir.assert_any_call("bf")
+        sftp.mkdir.assert_any_call("bf/3e")
+        index.add(OID, 10)
+        self.assertEqual(index.lookup(sftp, OID), 10)
+
+    def test_prepare(self):
+        sftp = MagicMock()
+        sftp.listdir.side_effect = lambda d: {".": ["bf"], "bf": []}[d]
+        index = sftp_index.RemoteIndex("elf@localhost:22/lfs")
+        index.prepare(sftp, [OID, "bf3e" + "0" * 60, "0000" + "0" * 60])
+        sftp.mkdir.assert_any_call("bf/3e")
+        sftp.mkdir.assert_any_call("00")
+        sftp.mkdir.assert_any_call("00/00")
+        sftp.listdir_attr.assert_not_called()
+
+    def test_listing_expires(self):
+        sftp = MagicMock()
+        sftp.listdir_attr.return_value = []
+        index = sftp_index.RemoteIndex("elf@localhost:22/lfs", ttl=3600)
+        self.assertIsNone(index.lookup(sftp, OID))
+        index.listed_at["bf/3e"] -= 3600
+        sftp.listdir_attr.return_value = [attr(OID, 10)]
+        self.assertEqual(index.lookup(sftp, OID), 10)
+        self.assertEqual(sftp.listdir_attr.call_count, 2)
+
+    def test_listing_max_age(self):
+        sftp = MagicMock()
+        sftp.listdir_attr.return_value = []
+        index = sftp_index.RemoteIndex("elf@localhost:22/lfs", ttl=3600)
+        self.assertEqual(index.listing(sftp, "bf/3e", 5), {})
+        self.assertEqual(index.listing(sftp, "bf/3e", 5), {})
+        sftp.listdir_attr.assert_called_once_with("bf/3e")
+        index.listed_at["bf/3e"] -= 5
+        sftp.listdir_attr.return_value = [attr(OID, 10)]
+        self.assertEqual(index.listing(sftp, "bf/3e", 5), {OID: 10})
+        self.assertEqual(sftp.listdir_attr.call_count, 2)
+
+    def test_prepare_lists_expired_shards(self):
+        sftp = MagicMock()
+        sftp.listdir.side_effect = lambda d: {".": ["bf"], "bf": ["3e"]}[d]
+        sftp.listdir_attr.return_value = [attr(OID, 10)]
+        index = sftp_index.RemoteIndex("elf@localhost:22/lfs")
+        index.shards["bf/3e"] = {}
+        index.listed_at["bf/3e"] = 0
+        index.prepare(sftp, [OID])
+        self.assertEqual(index.lookup(sftp, OID), 10)
+        sftp.listdir_attr.assert_called_once_with("bf/3e")
+
+    def test_cache(self):
+        sftp = MagicMock()
+        sftp.listdir_attr.return_value = [attr(OID, 10)]
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, "index.json")
+            sftp_index.RemoteIndex("elf@localhost:22/lfs", path).lookup(sftp, OID)
+            sftp_index.RemoteIndex("elf@localhost:22/lfs", path).save()
+            index = sftp_index.RemoteIndex("elf@localhost:22/lfs", path)
+            index.lookup(sftp, OID)
+            index.save()
+            self.assertEqual(sftp_index.RemoteIndex("elf@localhost:22/lfs", path).lookup(sftp, OID), 10)
+            self.assertEqual(sftp.listdir_attr.call_count, 2)
+            self.assertEqual(sftp_index.RemoteIndex("elf@localhost:22/lfs", path, ttl=-1).shards, {})
+            self.assertEqual(sftp_index.RemoteIndex("elf@otherhost:22/lfs", path).shards, {})
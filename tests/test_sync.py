@@ -0,0 +1,90 @@
+import hashlib
+import os
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from pyelfs.file_agent import FileAgent
+from pyelfs.sync import missing, stored, Sync
+from .local_sftp import LocalSftp
+
+OID = "bf3e3e2af9366a3b704ae0c31de5afa64193ebabffde2091936ad2e7510bc03a"
+
+
+class TestSync(TestCase):
+
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.work = os.path.join(self.temp.name, "work")
+        self.source = os.path.join(self.temp.name, "source")
+        self.destination = os.path.join(self.temp.name, "destination")
+        for d in (self.work, self.source, self.destination):
+            os.mkdir(d)
+        self.objects = {}
+        for i in range(5):
+            data = f"lfs object {i}".encode() * (i + 1)
+            self.objects[hashlib.sha256(data).hexdigest()] = data
+        agent = FileAgent(self.source, self.work, pack_threshold=30)
+        for oid, data in self.objects.items():
+            path = os.path.join(self.temp.name, oid)
+            with open(path, "wb") as f:
+                f.write(data)
+            list(agent.upload("upload", oid, len(data), path, None))
+        list(agent.terminate())
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def sync(self, verify=False):
+        source = f"file --lfs-storage-local pyelfs://{self.source} --temp {self.work}"
+        destination = f"file --lfs-storage-local pyelfs://{self.destination} --temp {self.work}"
+        with patch("sys.stdout", new_callable=StringIO) as out:
+            Sync(source, destination, 4, verify).main_proc(None)
+        return out.getvalue()
+
+    def test_stored(self):
+        listing = {OID: 10, f"{OID}.partial": 3, f"{OID[:-1]}0.zz": 4, "pack-1.idx": 5}
+        self.assertEqual(stored(listing), {OID: 10, f"{OID[:-1]}0": None})
+
+    def test_missing(self):
+        source = {"a": 10, "b": None, "c": 10, "d": 10}
+        destination = {"a": None, "b": 10, "c": 11}
+        # Sizes are compared only where both sides know them.
+        self.assertEqual(missing(source, destination), {"c": 10, "d": 10})
+
+    def test_copies_missing_objects(self):
+        out = self.sync(verify=True)
+        self.assertIn("5 objects", out)
+        self.assertIn("0 were present and 0 failed", out)
+        agent = FileAgent(self.destination, self.work)
+        for oid, data in self.objects.items():
+            path = os.path.join(self.work, oid)
+            list(agent.download("download", oid, len(data), None))
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+            os.remove(path)
+        self.assertEqual(os.listdir(self.work), [])
+
+    def test_restart_skips_copied_objects(self):
+        self.sync()
+        oid, data = max(self.objects.items(), key=lambda item: len(item[1]))
+        path = os.path.join(self.destination, oid[0:2], oid[2:4], oid)
+        os.remove(path)
+        with open(path, "wb") as f:
+            f.write(data[:3])
+        self.assertIn("1 objects", self.sync())
+        self.assertIn("0 objects (0 bytes) were copied, 5 were present", self.sync())
+
+    @patch("pyelfs.sftp_agent.SftpPool")
+    def test_copies_to_sftp(self, pool):
+        remote = os.path.join(self.temp.name, "remote")
+        os.mkdir(remote)
+        pool.return_value.connection.return_value.__enter__.return_value = LocalSftp(remote)
+        source = f"file --lfs-storage-local pyelfs://{self.source} --temp {self.work}"
+        with patch("sys.stdout", new_callable=StringIO) as out:
+            Sync(source, f"sftp --lfs-storage-remote {remote} --temp {self.work}", 2, False).main_proc(None)
+        self.assertIn("5 objects", out.getvalue())
+        for oid, data in self.objects.items():
+            with open(os.path.join(remote, oid[0:2], oid[2:4], oid), "rb") as f:
+                self.assertEqual(f.read(), data)